@@ -0,0 +1,59 @@
+import copy
+
+from django.conf import settings
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from movies_for_all.lru import LRUCache
+from movies_for_all.routers import primary_reads, replica_in_sync
+
+options = getattr(settings, 'APP_USER_TOKEN_CACHE', {})
+# token key: (user, token) of the last successful authentication
+token_cache = LRUCache(options.get('MAX_ENTRIES', 10000), options.get('TIMEOUT', 60))
+
+
+def forget_token(key):
+    token_cache.delete(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    """
+        Token authentication keeping the user of recently used tokens in
+        process memory, so most requests do not query the token and user
+        * Size and lifetime of the cache: settings.APP_USER_TOKEN_CACHE
+        * Entries are removed when the token is deleted (logout, rotation)
+          or its user is saved or deleted (signals in app_user.models).
+          Changes made by other processes are seen after TIMEOUT seconds
+        * Invalid tokens and inactive users are not cached. Tokens are
+          read from the read replica, from the primary when the replica
+          does not have them (created after its copy). Tokens read from a
+          replica behind the primary are not cached
+    """
+
+    def get_token(self, key):
+        tokens = self.model.objects.select_related('user')
+        try:
+            return tokens.get(key=key)
+        except self.model.DoesNotExist:
+            pass
+        with primary_reads():
+            try:
+                return tokens.get(key=key)
+            except self.model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is None:
+            token = self.get_token(key)
+            if not token.user.is_active:
+                raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+            cached = (token.user, token)
+            if replica_in_sync():
+                token_cache.set(key, cached)
+        # Each request gets its own copy of the snapshot
+        user, token = copy.copy(cached[0]), copy.copy(cached[1])
+        token.user = user
+        return user, token
@@ -0,0 +1,174 @@
+"""
+    Password hashing profiles, timing and offloading
+    * Profiles are PBKDF2 hashers with different iteration counts, chosen
+      per deployment with settings.PASSWORD_HASHING['PROFILE']. They share
+      the pbkdf2_sha256 algorithm, so hashes made with another profile
+      still verify and are upgraded at the next login
+    * Time spent hashing is counted in hashing_stats
+    * With settings.PASSWORD_HASHING['THREADS'] hashing runs in a bounded
+      pool of threads. At most THREADS hashes run at once in the process,
+      further requests wait in a queue of QUEUE_SIZE and HashingBusy (503)
+      is raised when it is full, so login bursts get a quick answer
+      instead of holding every worker thread
+"""
+import time
+import threading
+from Queue import Queue, Full
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from rest_framework import exceptions, status
+
+
+class HashingBusy(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins in progress, please try again.'
+
+
+class HashingStats(object):
+
+    """
+        Number and duration of hashes per operation (encode, verify)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+            self.rejected = 0
+
+    def record(self, operation, seconds):
+        with self.lock:
+            stats = self.operations.setdefault(operation, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+    def reject(self):
+        with self.lock:
+            self.rejected += 1
+
+    def stats(self):
+        with self.lock:
+            operations = dict((operation, dict(stats)) for operation, stats in self.operations.items())
+            return {'operations': operations, 'rejected': self.rejected,
+                    'seconds': sum(stats['seconds'] for stats in operations.values())}
+
+
+hashing_stats = HashingStats()
+
+
+class HashingPool(object):
+
+    """
+        Fixed number of threads running hashes, fed by a bounded queue
+    """
+
+    def __init__(self, threads, queue_size=64):
+        self.jobs = Queue(queue_size)
+        for i in range(threads):
+            worker = threading.Thread(target=self.work, name='password-hashing-%d' % i)
+            worker.daemon = True
+            worker.start()
+
+    def work(self):
+        while True:
+            function, args, result, done = self.jobs.get()
+            try:
+                result['value'] = function(*args)
+            except Exception as exception:
+                result['error'] = exception
+            done.set()
+
+    def run(self, function, *args):
+        result = {}
+        done = threading.Event()
+        try:
+            self.jobs.put_nowait((function, args, result, done))
+        except Full:
+            hashing_stats.reject()
+            raise HashingBusy()
+        done.wait()
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+
+pool_lock = threading.Lock()
+hashing_pool = None
+
+
+def get_hashing_pool():
+    # Started on first use, None when hashing is done in the request thread
+    global hashing_pool
+    options = getattr(settings, 'PASSWORD_HASHING', {})
+    if not options.get('THREADS'):
+        return None
+    with pool_lock:
+        if hashing_pool is None:
+            hashing_pool = HashingPool(options['THREADS'], options.get('QUEUE_SIZE', 64))
+    return hashing_pool
+
+
+# Set while a hash runs, verify calls encode which must not be timed or
+# queued again
+local = threading.local()
+
+
+def run_hash(function, *args):
+    local.hashing = True
+    try:
+        return function(*args)
+    finally:
+        local.hashing = False
+
+
+def timed(operation, function, *args):
+    if getattr(local, 'hashing', False):
+        return function(*args)
+    pool = get_hashing_pool()
+    start = time.time()
+    if pool is not None:
+        result = pool.run(run_hash, function, *args)
+    else:
+        result = run_hash(function, *args)
+    hashing_stats.record(operation, time.time() - start)
+    return result
+
+
+class TimedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+
+    """
+        Django's PBKDF2 hasher (default profile), timed and run in the
+        hashing pool when there is one
+    """
+
+    def encode(self, password, salt, iterations=None):
+        encode = super(TimedPBKDF2PasswordHasher, self).encode
+        return timed('encode', encode, password, salt, iterations)
+
+    def verify(self, password, encoded):
+        verify = super(TimedPBKDF2PasswordHasher, self).verify
+        return timed('verify', verify, password, encoded)
+
+
+class FastPBKDF2PasswordHasher(TimedPBKDF2PasswordHasher):
+
+    """
+        Fewer iterations for deployments where login throughput matters
+        more than the cost of an offline attack
+    """
+
+    iterations = 12000
+
+
+class StrongPBKDF2PasswordHasher(TimedPBKDF2PasswordHasher):
+
+    """
+        More iterations, about four times the default cost
+    """
+
+    iterations = 100000
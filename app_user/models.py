@@ -1,11 +1,13 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 
 from rest_framework.authtoken.models import Token
 
+from .authentication import forget_token
+
 
 class AppUser(AbstractUser):
 
@@ -22,3 +24,20 @@ class AppUser(AbstractUser):
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
         Token.objects.create(user=instance)
+
+
+# Cached authentications of a token are dropped when it is deleted
+# (logout, rotation) or its user changes
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    forget_token(instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user_tokens(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    for key in Token.objects.filter(user_id=instance.pk).values_list('key', flat=True):
+        forget_token(key)
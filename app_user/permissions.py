@@ -11,5 +11,8 @@ class IsAdminUser(permissions.BasePermission):
 class IsAdminOrSameUser(permissions.BasePermission):
 
     def has_permission(self, request, view):
-        user_instance = view.get_object()
-        return request.user.is_staff or user_instance == request.user
\ No newline at end of file
+        # Decided from the url, the user is not loaded here
+        if request.user.is_staff:
+            return True
+        lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+        return unicode(view.kwargs.get(lookup_url_kwarg)) == unicode(request.user.pk)
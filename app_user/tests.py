@@ -1,3 +1,201 @@
+import os
+import imp
+import time
+import threading
+
+from django.contrib.auth.hashers import check_password, get_hasher, make_password
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .authentication import token_cache
+from . import hashers
+from .hashers import hashing_stats, HashingBusy, HashingPool
+from .models import AppUser
+
+
+class CachedTokenAuthenticationTest(TestCase):
+
+    """
+        Users of recently used tokens are not queried again until the
+        token or the user changes
+    """
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = AppUser.objects.create_user(
+            username='user', email='user@example.com', password='password')
+        self.token = Token.objects.get(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token %s' % self.token.key)
+
+    def test_cached(self):
+        self.assertEqual(self.client.get('/movies/list/').status_code, 200)
+        # Response and authentication are both cached
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/movies/list/').status_code, 200)
+
+    def test_invalid_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token invalid')
+        self.assertEqual(self.client.get('/movies/list/').status_code, 401)
+        self.assertEqual(len(token_cache), 0)
+
+    def test_logout(self):
+        self.client.get('/movies/list/')
+        self.assertEqual(self.client.delete('/user/login_token/').data['status'], 1)
+        self.assertEqual(self.client.get('/movies/list/').status_code, 401)
+
+    def test_rotation(self):
+        self.client.get('/movies/list/')
+        self.token.delete()
+        token = Token.objects.create(user=self.user)
+        self.assertEqual(self.client.get('/movies/list/').status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION='Token %s' % token.key)
+        self.assertEqual(self.client.get('/movies/list/').status_code, 200)
+
+    def test_user_update(self):
+        self.client.get('/movies/list/')
+        response = self.client.put('/user/%d/' % self.user.pk, {
+            'username': 'user', 'email': 'user@example.com', 'password': 'password',
+            'is_staff': True}, format='json')
+        self.assertEqual(response.data['status'], 1)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_staff)
+        # Admin only endpoint sees the new is_staff
+        self.assertEqual(self.client.get('/movies/cache_stats/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/movies/list/').status_code, 401)
+
+    def test_user_delete(self):
+        self.client.get('/movies/list/')
+        self.assertEqual(self.client.delete('/user/%d/' % self.user.pk).data['status'], 1)
+        self.assertEqual(self.client.get('/movies/list/').status_code, 401)
+
+
+class UpdateUserPermissionTest(TestCase):
+
+    """
+        Users update themselves, admins update anyone. The user is
+        loaded once per request
+    """
+
+    def setUp(self):
+        self.user = AppUser.objects.create_user(
+            username='user', email='user@example.com', password='password')
+        self.other = AppUser.objects.create_user(
+            username='other', email='other@example.com', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def user_queries(self, method, user, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)('/user/%d/' % user.pk, data, format='json')
+        lookups = [query for query in queries.captured_queries
+                   if query['sql'].startswith('SELECT') and
+                   'WHERE "app_user_appuser"."id" = %d' % user.pk in query['sql']]
+        return response, len(lookups)
+
+    def test_same_user(self):
+        response, lookups = self.user_queries('put', self.user, {
+            'username': 'user', 'email': 'new@example.com', 'password': 'password'})
+        self.assertEqual(response.data['status'], 1)
+        self.assertEqual(lookups, 1)
+
+    def test_other_user(self):
+        with self.assertNumQueries(0):
+            response = self.client.delete('/user/%d/' % self.other.pk)
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(AppUser.objects.filter(pk=self.other.pk).exists())
+
+    def test_admin(self):
+        self.user.is_staff = True
+        response, lookups = self.user_queries('delete', self.other)
+        self.assertEqual(response.data['status'], 1)
+        self.assertEqual(lookups, 1)
+        self.assertEqual(self.client.delete('/user/0/').status_code, 404)
+
+
+class PasswordHashingTest(TestCase):
+
+    """
+        Hashing profiles, stats and the bounded hashing pool
+    """
+
+    def setUp(self):
+        hashing_stats.reset()
+
+    def test_stats(self):
+        client = APIClient()
+        response = client.post('/user/', {'username': 'user', 'email': 'user@example.com',
+                                          'password': 'password'}, format='json')
+        self.assertEqual(response.data['status'], 1)
+        response = client.post('/user/login_token/', {'username': 'user', 'password': 'password'},
+                               format='json')
+        self.assertEqual(response.data['status'], 1)
+        stats = hashing_stats.stats()
+        self.assertEqual(stats['operations']['encode']['count'], 1)
+        self.assertEqual(stats['operations']['verify']['count'], 1)
+        admin = APIClient()
+        admin.force_authenticate(AppUser.objects.create_user(
+            username='admin', email='admin@example.com', password='password', is_staff=True))
+        response = admin.get('/user/hashing_stats/')
+        self.assertEqual(response.data['profile'], 'default')
+        self.assertEqual(response.data['operations']['verify']['count'], 1)
+
+    def test_profiles(self):
+        encoded = make_password('password', hasher='default')
+        with self.settings(PASSWORD_HASHERS=('app_user.hashers.FastPBKDF2PasswordHasher',
+                                             'app_user.hashers.TimedPBKDF2PasswordHasher')):
+            self.assertTrue(make_password('password').startswith('pbkdf2_sha256$12000$'))
+            # Hashes of another profile verify and are upgraded
+            self.assertTrue(check_password('password', encoded))
+            self.assertTrue(get_hasher().must_update(encoded))
+
+    def test_unknown_profile(self):
+        self.addCleanup(os.environ.pop, 'PASSWORD_HASHING_PROFILE', None)
+        os.environ['PASSWORD_HASHING_PROFILE'] = 'strongest'
+        settings_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'movies_for_all', 'settings.py')
+        with self.assertRaisesRegexp(ImproperlyConfigured, 'default, fast, strong'):
+            imp.load_source('movies_for_all.settings_check', settings_file)
+
+    def test_hashing_in_pool(self):
+        self.addCleanup(setattr, hashers, 'hashing_pool', None)
+        hashers.hashing_pool = None
+        with self.settings(PASSWORD_HASHING={'PROFILE': 'default', 'THREADS': 1}):
+            # verify calls encode, which runs in the same pool thread
+            self.assertTrue(check_password('password', make_password('password')))
+            self.assertIsNotNone(hashers.hashing_pool)
+        self.assertEqual(hashing_stats.stats()['operations']['verify']['count'], 1)
+
+    def test_busy_pool(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def hash_slowly():
+            started.set()
+            release.wait()
+            return 'hashed'
 
-# Create your tests here.
+        pool = HashingPool(1, queue_size=1)
+        results = []
+        first = threading.Thread(target=lambda: results.append(pool.run(hash_slowly)))
+        first.start()
+        started.wait()
+        second = threading.Thread(target=lambda: results.append(pool.run(lambda: 'queued')))
+        second.start()
+        while pool.jobs.qsize() < 1:
+            time.sleep(0.001)
+        with self.assertRaises(HashingBusy):
+            pool.run(lambda: 'rejected')
+        release.set()
+        first.join()
+        second.join()
+        self.assertEqual(sorted(results), ['hashed', 'queued'])
+        self.assertEqual(hashing_stats.stats()['rejected'], 1)
@@ -1,9 +1,10 @@
 from django.conf.urls import url
 
-from .views import User, UserLogin, UpdateUser
+from .views import User, UserLogin, UpdateUser, PasswordHashingStats
 
 urlpatterns = [
     url(r'^$', User.as_view(), name="user_list"),
     url(r'^login_token/$', UserLogin.as_view()),
     url(r'^(?P<pk>[0-9]+)/$', UpdateUser.as_view()),
+    url(r'^hashing_stats/$', PasswordHashingStats.as_view()),
 ]
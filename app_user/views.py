@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib.auth import login
 from django.http import Http404
 from django.shortcuts import get_object_or_404
@@ -10,7 +11,8 @@ from rest_framework.authtoken.models import Token
 
 from .serializers import UserSerializer
 from .models import AppUser
-from .permissions import IsAdminOrSameUser
+from .permissions import IsAdminUser, IsAdminOrSameUser
+from .hashers import hashing_stats
 
 # Create your views here.
 
@@ -121,6 +123,12 @@ class UpdateUser(generics.GenericAPIView):
     permission_classes = (permissions.IsAuthenticated,
                           IsAdminOrSameUser)
 
+    def get_object(self):
+        # Loaded once per request
+        if not hasattr(self, 'user_instance'):
+            self.user_instance = super(UpdateUser, self).get_object()
+        return self.user_instance
+
     def put(self, request, *args, **kwargs):
         return self.update(request, *args, **kwargs)
 
@@ -139,3 +147,22 @@ class UpdateUser(generics.GenericAPIView):
         user = self.get_object()
         user.delete()
         return Response({"status": 1})
+
+
+class PasswordHashingStats(APIView):
+
+    """
+        Time spent hashing passwords by this process, per operation
+        (encode on signup and password change, verify on login)
+        * Admin only
+        * URL: /user/hashing_stats/
+        * METHOD: GET
+    """
+
+    permission_classes = (permissions.IsAuthenticated,
+                          IsAdminUser)
+
+    def get(self, request, *args, **kwargs):
+        return Response(dict(hashing_stats.stats(), status=1,
+                             profile=settings.PASSWORD_HASHING['PROFILE'],
+                             threads=settings.PASSWORD_HASHING['THREADS']))
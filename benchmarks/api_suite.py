@@ -0,0 +1,235 @@
+"""
+Latency, queries and throughput of the API endpoints on a synthetic
+catalogue, written as JSON to compare commits.
+
+A test database is created (the configured database is not touched) and
+filled with a catalogue of movies.synthetic through the bulk write path.
+Each scenario sends its requests one after the other through the Django
+test client: listings (each sort), searches (each type and sort), movie
+detail, create, update and login. Requests are varied (pages, keywords,
+movies) and the response cache is cleared before each one, so every
+request does its work; --cached keeps the cache.
+
+For each scenario p50/p99 latency, SQL queries per request and requests
+per second are printed, and written with the commit and database to
+--output. --compare prints the change from a previous results file.
+
+    $ python benchmarks/api_suite.py --movies 10000 --output results.json
+    $ git checkout other-branch
+    $ python benchmarks/api_suite.py --movies 10000 --compare results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'movies_for_all.settings')
+
+import django
+django.setup()
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import setup_test_environment, CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from app_user.models import AppUser
+from movies.bulk import bulk_save_movies
+from movies.cache import response_cache
+from movies.filters import MovieSort
+from movies.models import Movie
+from movies.readers import normalise_movie
+from movies.synthetic import synthetic_movies
+
+SEARCH_TYPES = ('name', 'director', 'genre', 'all')
+SORTS = ('',) + tuple(MovieSort.sort_fields)
+PASSWORD = 'bench-password'
+
+
+def populate(count, seed, batch_size=500):
+    batch = []
+    for movie in synthetic_movies(count, seed):
+        batch.append(normalise_movie(movie))
+        if len(batch) == batch_size:
+            with transaction.atomic():
+                bulk_save_movies(batch)
+            batch = []
+    if batch:
+        with transaction.atomic():
+            bulk_save_movies(batch)
+    if connection.vendor == 'postgresql':
+        connection.cursor().execute('ANALYZE')
+
+
+def percentile(timings, percent):
+    # Nearest rank of sorted timings
+    index = int(len(timings) * percent / 100.0 + 0.999999) - 1
+    return timings[min(max(index, 0), len(timings) - 1)]
+
+
+class Scenarios(object):
+
+    """
+        Requests of each scenario: name -> function(index) returning the
+        client, method, path and data of the index-th request
+    """
+
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.user_client = APIClient()
+        self.user_client.force_authenticate(AppUser.objects.create_user(
+            username='bench', email='bench@example.com', password=PASSWORD))
+        self.admin_client = APIClient()
+        self.admin_client.force_authenticate(AppUser.objects.create_user(
+            username='bench-admin', email='bench-admin@example.com', password=PASSWORD, is_staff=True))
+        self.login_client = APIClient()
+        self.movies = list(Movie.objects.values_list('id', 'name', 'director__name', 'imdb_score'))
+        self.genres = list(Movie.genre.through.objects.values_list('genre__name', flat=True).distinct())
+        self.pages = max(len(self.movies) // settings.REST_FRAMEWORK['PAGE_SIZE'], 1)
+
+    def all(self):
+        scenarios = []
+        for sort in SORTS:
+            scenarios.append(('list sort=%s' % sort, self.listing(sort)))
+        for search_type in SEARCH_TYPES:
+            for sort in SORTS:
+                scenarios.append(('search type=%s sort=%s' % (search_type, sort), self.search(search_type, sort)))
+        scenarios.extend([('detail', self.detail), ('create', self.create), ('update', self.update),
+                          ('login', self.login)])
+        return scenarios
+
+    def page(self):
+        # Early pages are read more often
+        return min(int(self.random.expovariate(0.2)) + 1, self.pages)
+
+    def listing(self, sort):
+        def request(index):
+            return self.user_client, 'get', '/movies/list/', {'sort': sort, 'page': self.page()}
+        return request
+
+    def keyword(self, search_type):
+        movie_id, name, director, imdb_score = self.random.choice(self.movies)
+        if search_type == 'name':
+            return self.random.choice(name.split())
+        if search_type == 'director':
+            return director.split()[-1]
+        if search_type == 'genre':
+            return self.random.choice(self.genres)
+        return '%s %s' % (name.split()[-1], director.split()[-1])
+
+    def search(self, search_type, sort):
+        def request(index):
+            return self.user_client, 'get', '/movies/search/', {
+                'keyword': self.keyword(search_type), 'type': search_type, 'sort': sort}
+        return request
+
+    def detail(self, index):
+        return self.user_client, 'get', '/movies/%d/view/' % self.random.choice(self.movies)[0], {}
+
+    def create(self, index):
+        return self.admin_client, 'post', '/movies/', {
+            'name': 'Benchmark Movie %d' % index, 'director': 'Benchmark Director %d' % (index % 10),
+            'imdb_score': 7.5, 'popularity': 75.0, 'genre': self.random.sample(self.genres, 2)}
+
+    def update(self, index):
+        movie_id, name, director, imdb_score = self.random.choice(self.movies)
+        return self.admin_client, 'put', '/movies/%d/' % movie_id, {
+            'name': name, 'director': director, 'imdb_score': round(self.random.uniform(1, 10), 1),
+            'popularity': round(self.random.uniform(0, 100), 1), 'genre': self.random.sample(self.genres, 2)}
+
+    def login(self, index):
+        return self.login_client, 'post', '/user/login_token/', {'username': 'bench', 'password': PASSWORD}
+
+
+def measure(scenario, requests, cached):
+    timings, queries = [], 0
+    for index in range(requests + 1):
+        client, method, path, data = scenario(index)
+        if not cached:
+            response_cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.time()
+            if method == 'get':
+                response = client.get(path, data)
+            else:
+                response = getattr(client, method)(path, data, format='json')
+            elapsed = time.time() - start
+        assert response.status_code == 200 and response.data['status'] == 1, (path, data, response.data)
+        # The first request warms up the process
+        if index:
+            timings.append(elapsed)
+            queries += len(captured)
+    timings.sort()
+    return {'requests': requests,
+            'p50_ms': round(percentile(timings, 50) * 1000, 3),
+            'p99_ms': round(percentile(timings, 99) * 1000, 3),
+            'queries_per_request': round(queries / float(requests), 2),
+            'requests_per_second': round(requests / sum(timings), 1)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=settings.BASE_DIR or '.').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as baseline:
+        baseline = json.load(baseline)
+    print '\nCompared with %s (%s)' % (baseline_file, baseline['meta'].get('commit'))
+    print '%-40s %10s %10s %12s' % ('scenario', 'p50', 'p99', 'queries')
+    for name, result in results['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if old:
+            print '%-40s %+9.1f%% %+9.1f%% %+12.2f' % (
+                name, (result['p50_ms'] / old['p50_ms'] - 1) * 100, (result['p99_ms'] / old['p99_ms'] - 1) * 100,
+                result['queries_per_request'] - old['queries_per_request'])
+
+
+def main(options):
+    setup_test_environment()
+    results = {'meta': {'commit': git_commit(), 'database': connection.vendor, 'movies': options.movies,
+                        'seed': options.seed, 'requests': options.requests, 'cached': options.cached,
+                        'python': platform.python_version(), 'django': django.get_version()},
+               'scenarios': {}}
+    print 'Database: %s, %d movies, %d requests per scenario' % (connection.vendor, options.movies,
+                                                                 options.requests)
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        start = time.time()
+        populate(options.movies, options.seed)
+        print 'Catalogue written in %.1fs' % (time.time() - start)
+        print '%-40s %10s %10s %10s %10s' % ('scenario', 'p50 ms', 'p99 ms', 'queries', 'req/s')
+        for name, scenario in Scenarios(options.seed).all():
+            if options.only and options.only not in name:
+                continue
+            result = results['scenarios'][name] = measure(scenario, options.requests, options.cached)
+            print '%-40s %10.2f %10.2f %10.2f %10.1f' % (name, result['p50_ms'], result['p99_ms'],
+                                                         result['queries_per_request'],
+                                                         result['requests_per_second'])
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if options.compare:
+        compare(results, options.compare)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the API endpoints')
+    parser.add_argument('--movies', type=int, default=10000, help='Movies in the catalogue')
+    parser.add_argument('--requests', type=int, default=50, help='Requests per scenario')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the catalogue and the requests')
+    parser.add_argument('--cached', action='store_true', default=False, help='Keep the response cache')
+    parser.add_argument('--only', default=None, help='Run the scenarios whose name contains it')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to')
+    parser.add_argument('--compare', default=None, help='Results file to compare with')
+    main(parser.parse_args())
@@ -0,0 +1,76 @@
+"""
+Authenticated requests per second with DRF's TokenAuthentication and with
+app_user.authentication.CachedTokenAuthentication.
+
+A test database is created (the configured database is not touched) and
+/movies/list/ is requested with a token through the full Django stack.
+The response itself is served from the movie response cache, so the
+difference comes from authentication.
+
+    $ python benchmarks/auth_throughput.py
+    $ python benchmarks/auth_throughput.py 5000
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'movies_for_all.settings')
+
+import django
+django.setup()
+
+from django.db import connection
+from django.test.utils import setup_test_environment, CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+
+from app_user.authentication import CachedTokenAuthentication, token_cache
+from app_user.models import AppUser
+from movies.models import Movie, Director
+
+AUTHENTICATIONS = (
+    ('TokenAuthentication', TokenAuthentication),
+    ('CachedTokenAuthentication', CachedTokenAuthentication),
+)
+
+
+def measure(client, requests):
+    # Warm up, fills the response and token caches
+    client.get('/movies/list/')
+    with CaptureQueriesContext(connection) as queries:
+        start = time.time()
+        for i in range(requests):
+            response = client.get('/movies/list/')
+            assert response.status_code == 200
+        elapsed = time.time() - start
+    return requests / elapsed, len(queries) / float(requests)
+
+
+def main(requests):
+    setup_test_environment()
+    print 'Database: %s' % connection.vendor
+    print '%30s %12s %16s' % ('authentication', 'requests/s', 'queries/request')
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        director = Director.objects.create(name='Director')
+        for index in range(20):
+            Movie.objects.create(name='Movie %d' % index, imdb_score=7.5, popularity=75,
+                                 director=director)
+        user = AppUser.objects.create_user(username='bench', email='bench@example.com',
+                                           password='bench')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token %s' % Token.objects.get(user=user).key)
+        for name, authentication in AUTHENTICATIONS:
+            token_cache.clear()
+            # Views read the authentication classes from APIView
+            APIView.authentication_classes = (authentication,)
+            rate, queries = measure(client, requests)
+            print '%30s %12.1f %16.2f' % (name, rate, queries)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,79 @@
+"""
+Peak memory of the load_movies reader for growing catalogue files.
+
+Each size is written to a temporary file in the imdb.json format and read
+back in a fresh process, so the peak RSS reported is the reader's only.
+
+    $ python benchmarks/loader_memory.py 10000 100000 1000000
+    $ python benchmarks/loader_memory.py --lines 10000 100000 1000000
+"""
+import os
+import sys
+import json
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_catalogue(data_file, count, lines=False):
+    if not lines:
+        data_file.write('[\n')
+    for index in xrange(count):
+        movie = {'99popularity': float(index % 100), 'director': 'Director %d' % (index % 5000),
+                 'genre': ['Drama', ' Genre %d' % (index % 30)],
+                 'imdb_score': float(index % 100) / 10, 'name': 'Movie %d' % index}
+        if lines:
+            data_file.write(json.dumps(movie) + '\n')
+        else:
+            data_file.write((',\n' if index else '') + json.dumps(movie, indent=2))
+    if not lines:
+        data_file.write('\n]\n')
+
+
+def peak_rss():
+    # ru_maxrss survives exec and would include the parent's peak on Linux
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(file_path):
+    from movies.readers import read_movies
+    count = 0
+    with open(file_path, 'rb') as data_file:
+        for movie in read_movies(data_file):
+            count += 1
+    print count, peak_rss()
+
+
+def main(args):
+    lines = '--lines' in args
+    sizes = [int(arg) for arg in args if arg != '--lines'] or [10000, 100000, 1000000]
+    print '%10s %12s %12s' % ('movies', 'file MB', 'peak RSS MB')
+    for size in sizes:
+        handle, file_path = tempfile.mkstemp(suffix='.json')
+        try:
+            with os.fdopen(handle, 'w') as data_file:
+                write_catalogue(data_file, size, lines)
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--measure', file_path])
+            count, max_rss = output.split()
+            assert int(count) == size
+            print '%10d %12.1f %12.1f' % (size, os.path.getsize(file_path) / 1048576.0,
+                                          int(max_rss) / 1024.0)
+        finally:
+            os.remove(file_path)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        measure(sys.argv[2])
+    else:
+        main(sys.argv[1:])
@@ -0,0 +1,95 @@
+"""
+Latency of /movies/search/ for growing catalogues.
+
+A test database is created (the configured database is not touched),
+filled with synthetic movies for each size and searched by name, director
+and genre with each sort.
+
+    $ python benchmarks/search_latency.py 10000 100000 1000000
+    $ DJANGO_SETTINGS_MODULE=... python benchmarks/search_latency.py 10000
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'movies_for_all.settings')
+
+import django
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test.utils import setup_test_environment
+from rest_framework.test import APIClient
+
+from app_user.models import AppUser
+from movies.models import Movie, Genre, Director
+
+SEARCHES = (
+    ('name', 'Movie 12'),
+    ('director', 'Director 4'),
+    ('genre', 'ram'),
+)
+SORTS = ('name', 'director_name', 'imdb_score')
+REPEAT = 20
+
+
+def populate(count, batch_size=5000):
+    random.seed(count)
+    genres = [Genre.objects.create(name=name) for name in (
+        'Drama', 'Comedy', 'Action', 'Thriller', 'Romance', 'Adventure', 'Crime', 'Sci-Fi',
+        'Horror', 'Family', 'Fantasy', 'Mystery', 'War', 'Western', 'Animation', 'Music')]
+    Director.objects.bulk_create([Director(name='Director %d' % index, name_key='director %d' % index)
+                                  for index in range(max(count // 20, 1))])
+    director_ids = list(Director.objects.values_list('id', flat=True))
+    MovieGenre = Movie.genre.through
+    for start in range(0, count, batch_size):
+        with transaction.atomic():
+            last_id = Movie.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+            Movie.objects.bulk_create([
+                Movie(name='Movie %d' % index, imdb_score=random.randint(0, 100) / 10.0,
+                      popularity=float(random.randint(0, 100)), director_id=random.choice(director_ids))
+                for index in range(start, min(start + batch_size, count))], batch_size=500)
+            movie_ids = Movie.objects.filter(id__gt=last_id).values_list('id', flat=True)
+            MovieGenre.objects.bulk_create([
+                MovieGenre(movie_id=movie_id, genre_id=genre.id)
+                for movie_id in movie_ids for genre in random.sample(genres, 2)], batch_size=500)
+    if connection.vendor == 'postgresql':
+        connection.cursor().execute('ANALYZE')
+
+
+def measure(client, params):
+    timings = []
+    for i in range(REPEAT):
+        start = time.time()
+        response = client.get('/movies/search/', params)
+        timings.append(time.time() - start)
+        assert response.status_code == 200
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+def main(sizes):
+    setup_test_environment()
+    print 'Database: %s' % connection.vendor
+    print '%10s %10s %15s %10s' % ('movies', 'type', 'sort', 'p50 ms')
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        for size in sizes:
+            call_command('flush', interactive=False, verbosity=0)
+            populate(size)
+            client = APIClient()
+            client.force_authenticate(AppUser.objects.create_user(
+                username='bench', email='bench@example.com', password='bench'))
+            for search_type, keyword in SEARCHES:
+                for sort in SORTS:
+                    latency = measure(client, {'keyword': keyword, 'type': search_type, 'sort': sort})
+                    print '%10d %10s %15s %10.2f' % (size, search_type, sort, latency)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000])
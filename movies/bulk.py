@@ -0,0 +1,98 @@
+from collections import Counter
+
+from django.db.models import Case, When, Value, FloatField, IntegerField
+
+from .models import Movie, director_resolver, genre_resolver, refresh_search_documents
+from .cache import bump_catalogue_version
+from .facets import movie_deltas, apply_deltas
+from .changes import publish
+
+CREATED = 'created'
+UPDATED = 'updated'
+EXISTS = 'exists'
+DUPLICATE = 'duplicate'
+
+
+def bulk_save_movies(movies, update=False):
+
+    """
+        Saves a batch of movies with their directors and genres
+        * movies: list of dicts with name, imdb_score, popularity,
+          director and genre keys
+        * update: movies already in the database are updated, otherwise
+          they are left as they are
+        * Returns a result per movie: CREATED, UPDATED, EXISTS (not updated)
+          or DUPLICATE (name repeated in the batch, first one is saved)
+        * Costs a constant number of queries per batch. Keep batches to a
+          few hundred movies, SQLite limits the parameters of a query
+        * Should be called inside a transaction
+    """
+
+    names = set(movie['name'] for movie in movies)
+    existing = dict(Movie.objects.filter(name__in=names).values_list('name', 'id'))
+    results = []
+    new_movies = []
+    updated_movies = []
+    seen = set()
+    for movie in movies:
+        if movie['name'] in seen:
+            results.append(DUPLICATE)
+        elif movie['name'] not in existing:
+            results.append(CREATED)
+            new_movies.append(movie)
+        elif update:
+            results.append(UPDATED)
+            updated_movies.append(movie)
+        else:
+            results.append(EXISTS)
+        seen.add(movie['name'])
+    saved_movies = new_movies + updated_movies
+    if not saved_movies:
+        return results
+
+    director_ids = director_resolver.resolve(movie['director'] for movie in saved_movies)
+    genre_ids = genre_resolver.resolve(genre for movie in saved_movies for genre in movie['genre'])
+    movie_ids = dict((movie['name'], existing[movie['name']]) for movie in updated_movies)
+    if new_movies:
+        Movie.objects.bulk_create([
+            Movie(name=movie['name'], imdb_score=movie['imdb_score'],
+                  popularity=movie['popularity'], director_id=director_ids[movie['director']])
+            for movie in new_movies])
+        # bulk_create does not set primary keys, so read them back by name
+        movie_ids.update(Movie.objects.filter(
+            name__in=[movie['name'] for movie in new_movies]).values_list('name', 'id'))
+
+    MovieGenre = Movie.genre.through
+    facet_deltas = Counter()
+    if updated_movies:
+        updated_ids = [movie_ids[movie['name']] for movie in updated_movies]
+        # Facet counts of the movies as they were, before the update
+        for values in Movie.objects.filter(id__in=updated_ids).values_list(
+                'director_id', 'imdb_score', 'popularity'):
+            facet_deltas.update(movie_deltas(*values, sign=-1))
+        for genre_id in MovieGenre.objects.filter(movie_id__in=updated_ids).values_list('genre_id', flat=True):
+            facet_deltas['genre', genre_id] -= 1
+
+        def by_movie(value, output_field):
+            return Case(*[When(id=movie_ids[movie['name']], then=Value(value(movie)))
+                          for movie in updated_movies], output_field=output_field)
+
+        Movie.objects.filter(id__in=updated_ids).update(
+            imdb_score=by_movie(lambda movie: movie['imdb_score'], FloatField()),
+            popularity=by_movie(lambda movie: movie['popularity'], FloatField()),
+            director=by_movie(lambda movie: director_ids[movie['director']], IntegerField()))
+        MovieGenre.objects.filter(movie_id__in=updated_ids).delete()
+    MovieGenre.objects.bulk_create([
+        MovieGenre(movie_id=movie_ids[movie['name']], genre_id=genre_id)
+        for movie in saved_movies
+        for genre_id in set(genre_ids[genre_name] for genre_name in movie['genre'])])
+    for movie in saved_movies:
+        facet_deltas.update(movie_deltas(
+            director_ids[movie['director']], movie['imdb_score'], movie['popularity'],
+            set(genre_ids[genre_name] for genre_name in movie['genre'])))
+    apply_deltas(facet_deltas)
+    refresh_search_documents([movie_ids[movie['name']] for movie in saved_movies])
+    # Bulk writes send no signals
+    publish(movie_ids.values())
+    bump_catalogue_version()
+    return results
@@ -0,0 +1,232 @@
+"""
+    Cached values derived from the movie catalogue
+    * Every key includes the catalogue version, a counter bumped whenever a
+      movie, director or genre is written (signals in movies.models and
+      the bulk writers). Bumping the version invalidates everything at once
+    * Stored in the default Django cache. Use a shared backend (memcached,
+      redis) when running several processes, so they see the same version.
+      With a process local backend (shared_cache() False, the default
+      settings) each process seeds its own version once and a write bumps
+      the version of its own process only. Other processes serve cached
+      counts and responses for up to LOCAL_TIMEOUT seconds after it, and
+      their ETag and Last-Modified validators do not change: run a single
+      process, or a shared backend, for conditional GETs to follow writes
+    * Responses of the read endpoints are cached by ResponseCache
+"""
+import json
+import time
+import hashlib
+import threading
+from urllib import urlencode
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import connections
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from movies_for_all.lru import LRUCache
+from movies_for_all.routers import replica_in_sync
+
+CATALOGUE_VERSION_KEY = 'movies:catalogue_version'
+CATALOGUE_MODIFIED_KEY = 'movies:catalogue_modified'
+COUNT_TIMEOUT = 60 * 60
+# Backends keeping entries in process memory, or not at all
+LOCAL_CACHE_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache',
+                        'django.core.cache.backends.dummy.DummyCache')
+# Seconds values cached under a process local version are served
+LOCAL_TIMEOUT = 5
+
+
+def shared_cache():
+    # Whether the processes share the default cache, and so the version
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+
+def cache_timeout(timeout):
+    # timeout, cut to LOCAL_TIMEOUT when the version is not shared
+    if shared_cache():
+        return timeout
+    return LOCAL_TIMEOUT if timeout is None else min(timeout, LOCAL_TIMEOUT)
+
+
+def catalogue_version():
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        # Start from the clock so an evicted version is not reused
+        if cache.add(CATALOGUE_VERSION_KEY, int(time.time() * 1000), None):
+            cache.set(CATALOGUE_MODIFIED_KEY, timezone.now(), None)
+        version = cache.get(CATALOGUE_VERSION_KEY)
+    return version
+
+
+def catalogue_modified():
+    # Time of the last catalogue change, None if not known
+    return cache.get(CATALOGUE_MODIFIED_KEY)
+
+
+def bump_catalogue_version():
+    try:
+        cache.incr(CATALOGUE_VERSION_KEY)
+    except ValueError:
+        catalogue_version()
+    cache.set(CATALOGUE_MODIFIED_KEY, timezone.now(), None)
+
+
+def queryset_signature(queryset):
+    sql, params = queryset.query.sql_with_params()
+    return hashlib.md5((u'%s %r' % (sql, params)).encode('utf-8')).hexdigest()
+
+
+def estimated_count(queryset):
+    """
+        Row count from the PostgreSQL planner statistics, None when it can
+        not be used (other databases, filtered querysets)
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or queryset.query.where.children:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s',
+                       [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    # reltuples is -1 or 0 before the table is first analyzed
+    if row is None or row[0] <= 0:
+        return None
+    return int(row[0])
+
+
+def cached_count(queryset):
+
+    """
+        Count of a movie queryset, cached until the catalogue changes
+        * Ordering is not part of the key, sorted listings share the count
+        * With settings.MOVIES_ESTIMATED_COUNT the unfiltered count is read
+          from the planner estimate on PostgreSQL instead of COUNT(*)
+        * Kept COUNT_TIMEOUT seconds, LOCAL_TIMEOUT with a local cache
+    """
+
+    queryset = queryset.order_by()
+    if getattr(settings, 'MOVIES_ESTIMATED_COUNT', False):
+        count = estimated_count(queryset)
+        if count is not None:
+            return count
+    key = 'movies:count:%s:%s' % (catalogue_version(), queryset_signature(queryset))
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        if replica_in_sync():
+            cache.set(key, count, cache_timeout(COUNT_TIMEOUT))
+    return count
+
+
+class LocalResponseCache(object):
+
+    """
+        Response cache in process memory, least recently used entries are
+        dropped past MAX_ENTRIES
+        * Entries are kept until the shared version changes, LOCAL_TIMEOUT
+          seconds when the version is local too
+    """
+
+    def __init__(self, options):
+        self.entries = LRUCache(options.get('MAX_ENTRIES', 1024))
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, data):
+        self.entries.set(key, data, cache_timeout(None))
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DjangoResponseCache(object):
+
+    """
+        Response cache in a Django cache backend from settings.CACHES (ALIAS),
+        e.g. a redis backend shared by all processes
+        * Data is stored as JSON so it can be pickled by any backend
+    """
+
+    def __init__(self, options):
+        self.cache = caches[options.get('ALIAS', 'default')]
+        self.timeout = options.get('TIMEOUT', 300)
+
+    def get(self, key):
+        data = self.cache.get(key)
+        return json.loads(data) if data is not None else None
+
+    def set(self, key, data):
+        self.cache.set(key, JSONRenderer().render(data), cache_timeout(self.timeout))
+
+    def clear(self):
+        # Entries of other versions are unreachable and expire by themselves
+        bump_catalogue_version()
+
+    def __len__(self):
+        return 0
+
+
+RESPONSE_CACHE_BACKENDS = {
+    'local': LocalResponseCache,
+    'django': DjangoResponseCache,
+}
+
+
+class ResponseCache(object):
+
+    """
+        Cache of movie read responses
+        * Keys are the endpoint path, the query params that change the
+          response (normalised) and the catalogue version
+        * Backend is chosen by settings.MOVIES_RESPONSE_CACHE['BACKEND']:
+          local (default) or django
+        * Hits and misses are counted per process
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_backend(self):
+        if self.backend is None:
+            options = getattr(settings, 'MOVIES_RESPONSE_CACHE', {})
+            self.backend = RESPONSE_CACHE_BACKENDS[options.get('BACKEND', 'local')](options)
+        return self.backend
+
+    def make_key(self, path, query_params, params):
+        # Missing and empty params are the same, first page is page 1
+        values = dict((param, query_params.get(param)) for param in params
+                      if query_params.get(param))
+        if values.get('page') == '1':
+            del values['page']
+        signature = urlencode(sorted((param, value.encode('utf-8'))
+                                     for param, value in values.items()))
+        return 'movies:response:%s:%s?%s' % (catalogue_version(), path, signature)
+
+    def get(self, key):
+        data = self.get_backend().get(key)
+        with self.lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def set(self, key, data):
+        self.get_backend().set(key, data)
+
+    def clear(self):
+        self.get_backend().clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.get_backend())}
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,138 @@
+"""
+    Feed of written movies, read by the in process catalogue
+    (movies.snapshot) to refresh only what changed
+    * Receivers below publish the ids of the movies a write touches, bulk
+      writes publish them themselves. Entries are added once the
+      transaction commits, so readers never see ids before the rows
+    * Entries are numbered by a counter in the Django cache and the last
+      FEED_ENTRIES of them, FEED_IDS ids at most, are kept together in one
+      cache entry. A reader keeps the number it applied last and reads the
+      entries after it. RELOAD asks readers to read every movie again, as
+      does an entry no longer in the feed (dropped, expired, lost to an
+      append of another process) or a reader further behind than the feed
+    * Only a cache shared by the processes (memcached, redis) carries
+      the feed from the process writing to the others. Readers built in
+      another process call require_shared_cache
+"""
+import time
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .cache import shared_cache
+from .models import Movie, Director, Genre
+
+SEQUENCE_KEY = 'movies:changes:sequence'
+FEED_KEY = 'movies:changes:feed'
+FEED_TIMEOUT = 60 * 60
+FEED_ENTRIES = 500
+FEED_IDS = 20000
+RELOAD = 'reload'
+
+# Appends of this process read and write the feed one at a time
+append_lock = threading.Lock()
+
+
+def require_shared_cache(reader):
+    # A process local feed is never seen by the other processes
+    if not shared_cache():
+        raise ImproperlyConfigured(
+            '%s follows the change feed of every process, it needs a shared cache backend in '
+            'CACHES["default"] (memcached, redis, database), not %s' % (
+                reader, settings.CACHES['default']['BACKEND']))
+
+
+def sequence():
+    number = cache.get(SEQUENCE_KEY)
+    if number is None:
+        # Start from the clock so an evicted sequence is not reused
+        cache.add(SEQUENCE_KEY, int(time.time() * 1000), None)
+        number = cache.get(SEQUENCE_KEY)
+    return number
+
+
+def append(entry):
+    if entry != RELOAD and len(entry) > FEED_IDS:
+        entry = RELOAD
+    with append_lock:
+        try:
+            number = cache.incr(SEQUENCE_KEY)
+        except ValueError:
+            sequence()
+            number = cache.incr(SEQUENCE_KEY)
+        entries = sorted([(entry_number, ids) for entry_number, ids in cache.get(FEED_KEY) or ()
+                          if entry_number != number] + [(number, entry)])
+        # Newest entries within FEED_ENTRIES and FEED_IDS
+        kept, ids = [], 0
+        for entry_number, entry in reversed(entries[-FEED_ENTRIES:]):
+            ids += 1 if entry == RELOAD else len(entry)
+            if ids > FEED_IDS:
+                break
+            kept.append((entry_number, entry))
+        kept.reverse()
+        cache.set(FEED_KEY, kept, FEED_TIMEOUT)
+
+
+def publish(movie_ids):
+    # movie_ids: ids of written movies, or RELOAD
+    entry = RELOAD if movie_ids == RELOAD else tuple(set(movie_ids))
+    if entry:
+        transaction.on_commit(lambda: append(entry))
+
+
+def changes_since(number):
+
+    """
+        Returns the current sequence number and the ids of the movies
+        written after number, RELOAD when they are not all known
+        * A restarted sequence (evicted from the cache) or a gap larger
+          than the feed gives RELOAD without reading the feed
+    """
+
+    current = sequence()
+    if number == current:
+        return current, ()
+    if number > current or current - number > FEED_ENTRIES:
+        return current, RELOAD
+    entries = dict((entry_number, entry) for entry_number, entry in cache.get(FEED_KEY) or ()
+                   if number < entry_number <= current)
+    if len(entries) < current - number or RELOAD in entries.values():
+        return current, RELOAD
+    return current, set(movie_id for entry in entries.values() for movie_id in entry)
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def publish_movie(sender, instance, **kwargs):
+    publish([instance.pk])
+
+
+@receiver(m2m_changed, sender=Movie.genre.through)
+def publish_genre_links(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            publish([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        publish(pk_set)
+    elif action == 'pre_clear':
+        publish(instance.movie_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Director)
+def publish_director(sender, instance, created, **kwargs):
+    # Movies show the director name. Deleted directors delete their movies
+    if not created:
+        publish(Movie.objects.filter(director=instance).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Genre)
+@receiver(pre_delete, sender=Genre)
+def publish_genre(sender, instance, created=False, **kwargs):
+    # Links of a deleted genre are deleted without m2m signals
+    if not created:
+        publish(Movie.objects.filter(genre=instance).values_list('id', flat=True))
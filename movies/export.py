@@ -0,0 +1,54 @@
+"""
+    Whole catalogue export, read by load_movies
+    * Movies are read in chunks by id (keyset), with the director joined
+      and the genres of each chunk fetched in one query, so memory does
+      not grow with the catalogue
+    * JSON Lines records use the imdb.json fields, CSV has the columns of
+      CSV_FIELDS with the genres as a JSON array
+"""
+import csv
+import json
+
+from .models import Movie
+from .readers import CSV_FIELDS
+from .serializers import genre_names
+
+
+def iter_movies(chunk_size=1000, using='default'):
+    last_id = 0
+    while True:
+        rows = list(Movie.objects.using(using).filter(id__gt=last_id).order_by('id').list_rows()[:chunk_size])
+        if not rows:
+            return
+        genres = genre_names([row['id'] for row in rows], using)
+        for row in rows:
+            yield {'name': row['name'], 'director': row['director__name'], 'genre': genres[row['id']],
+                   'imdb_score': row['imdb_score'], 'popularity': row['popularity']}
+        last_id = rows[-1]['id']
+
+
+def jsonl_lines(movies):
+    for movie in movies:
+        record = {'name': movie['name'], 'director': movie['director'], 'genre': movie['genre'],
+                  'imdb_score': movie['imdb_score'], '99popularity': movie['popularity']}
+        yield json.dumps(record, sort_keys=True, ensure_ascii=False).encode('utf-8') + '\n'
+
+
+class Line(object):
+
+    """
+        File like object handing back what csv.writer writes
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(movies):
+    writer = csv.writer(Line())
+    yield writer.writerow(CSV_FIELDS)
+    for movie in movies:
+        yield writer.writerow([
+            movie['name'].encode('utf-8'), movie['director'].encode('utf-8'),
+            json.dumps(movie['genre'], ensure_ascii=False).encode('utf-8'),
+            repr(movie['imdb_score']), repr(movie['popularity'])])
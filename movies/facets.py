@@ -0,0 +1,208 @@
+"""
+    Facets of the catalogue: movies per genre, per director and
+    imdb_score/popularity histograms
+    * Global facets are read from the FacetCount summary table. It is
+      updated with deltas by the receivers below and by bulk_save_movies,
+      so no GROUP BY runs over the movies when they are read
+    * Facets of a search are counted live over the matching movies
+    * rebuild_facets recomputes the summary table (dedupe_names, tests),
+      migration 0007 runs its own copy
+"""
+from collections import Counter
+from operator import or_
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, When, Value, F, Q, Count, IntegerField
+from django.db.models.signals import m2m_changed, post_save, pre_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .models import Movie, Genre, Director, FacetCount
+from .names import in_batches
+
+# Bucket width of the histograms, values from 0 to 10 buckets wide
+HISTOGRAMS = (('imdb_score', 1.0), ('popularity', 10.0))
+BUCKETS = 10
+TOP_DIRECTORS = 20
+
+
+def bucket(width, value):
+    # The maximum value falls in the last bucket
+    return min(int(value // width), BUCKETS - 1)
+
+
+def bucket_expression(field, width):
+    return Case(*[When(**{field + '__lt': width * (index + 1), 'then': Value(index)})
+                  for index in range(BUCKETS - 1)],
+                default=Value(BUCKETS - 1), output_field=IntegerField())
+
+
+def movie_deltas(director_id, imdb_score, popularity, genre_ids=(), sign=1):
+    deltas = Counter()
+    deltas['movies', 0] += sign
+    deltas['director', director_id] += sign
+    values = {'imdb_score': imdb_score, 'popularity': popularity}
+    for field, width in HISTOGRAMS:
+        deltas[field, bucket(width, values[field])] += sign
+    for genre_id in genre_ids:
+        deltas['genre', genre_id] += sign
+    return deltas
+
+
+def apply_deltas(deltas):
+
+    """
+        Adds deltas ({(facet, key): delta}) to the summary table
+        * Missing rows are created in bulk, the others updated with one
+          UPDATE per batch of keys
+    """
+
+    deltas = dict((key, delta) for key, delta in deltas.items() if delta)
+    for batch in in_batches(deltas, 150):
+        lookup = reduce(or_, [Q(facet=facet, key=key) for facet, key in batch])
+        existing = set(FacetCount.objects.filter(lookup).values_list('facet', 'key'))
+        missing = [key for key in batch if key not in existing]
+        if missing:
+            try:
+                with transaction.atomic():
+                    FacetCount.objects.bulk_create([FacetCount(facet=facet, key=key, count=deltas[facet, key])
+                                                    for facet, key in missing])
+            except IntegrityError:
+                # Created meanwhile by another request, update them instead
+                existing.update(missing)
+        if existing:
+            FacetCount.objects.filter(reduce(or_, [Q(facet=facet, key=key) for facet, key in existing])).update(
+                count=F('count') + Case(*[When(facet=facet, key=key, then=Value(deltas[facet, key]))
+                                          for facet, key in existing], output_field=IntegerField()))
+
+
+def rebuild_facets():
+    """
+        Recomputes the summary table from the movies
+    """
+    counts = Counter()
+    counts['movies', 0] = Movie.objects.count()
+    links = Movie.genre.through.objects.values_list('genre_id').annotate(Count('id')).order_by()
+    for genre_id, count in links:
+        counts['genre', genre_id] = count
+    for director_id, count in Movie.objects.values_list('director_id').annotate(Count('id')).order_by():
+        counts['director', director_id] = count
+    for field, width in HISTOGRAMS:
+        for key, count in Movie.objects.annotate(bucket=bucket_expression(field, width)).values_list(
+                'bucket').annotate(Count('id')).order_by():
+            counts[field, key] = count
+    FacetCount.objects.all().delete()
+    FacetCount.objects.bulk_create([FacetCount(facet=facet, key=key, count=count)
+                                    for (facet, key), count in counts.items()], batch_size=500)
+
+
+def histogram(width, counts):
+    return [{'from': width * index, 'to': width * (index + 1), 'count': counts.get(index, 0)}
+            for index in range(BUCKETS)]
+
+
+def named_counts(model, counts):
+    names = dict(model.objects.filter(id__in=[key for key, count in counts]).values_list('id', 'name'))
+    return sorted([{'name': names[key], 'count': count} for key, count in counts if key in names],
+                  key=lambda facet: (-facet['count'], facet['name']))
+
+
+def global_facets():
+    rows = {}
+    for facet, key, count in FacetCount.objects.exclude(facet='director').filter(
+            count__gt=0).values_list('facet', 'key', 'count'):
+        rows.setdefault(facet, {})[key] = count
+    directors = FacetCount.objects.filter(facet='director', count__gt=0).order_by(
+        '-count', 'key').values_list('key', 'count')[:TOP_DIRECTORS]
+    facets = {'count': rows.get('movies', {}).get(0, 0),
+              'genres': named_counts(Genre, rows.get('genre', {}).items()),
+              'directors': named_counts(Director, directors)}
+    for field, width in HISTOGRAMS:
+        facets[field] = histogram(width, rows.get(field, {}))
+    return facets
+
+
+def search_facets(queryset):
+
+    """
+        Facets of the movies of queryset, counted live
+        * The matching movies are read once and counted here: searches
+          add raw SQL on movies_movie (full_text_search) that can not be
+          nested in a subquery
+        * Genres are counted by the database in batches of movie ids
+    """
+
+    movies = queryset.order_by().values_list('id', 'director__name', 'imdb_score', 'popularity').distinct()
+    movie_ids = []
+    directors = Counter()
+    histograms = dict((field, Counter()) for field, width in HISTOGRAMS)
+    for movie_id, director_name, imdb_score, popularity in movies:
+        movie_ids.append(movie_id)
+        directors[director_name] += 1
+        values = {'imdb_score': imdb_score, 'popularity': popularity}
+        for field, width in HISTOGRAMS:
+            histograms[field][bucket(width, values[field])] += 1
+    genres = Counter()
+    for batch in in_batches(movie_ids):
+        genres.update(dict(Movie.genre.through.objects.filter(movie_id__in=batch).values_list(
+            'genre__name').annotate(Count('id')).order_by()))
+    facets = {'count': len(movie_ids),
+              'genres': sorted([{'name': name, 'count': count} for name, count in genres.items()],
+                               key=lambda facet: (-facet['count'], facet['name'])),
+              'directors': sorted([{'name': name, 'count': count} for name, count in directors.items()],
+                                  key=lambda facet: (-facet['count'], facet['name']))[:TOP_DIRECTORS]}
+    for field, width in HISTOGRAMS:
+        facets[field] = histogram(width, histograms[field])
+    return facets
+
+
+@receiver(pre_save, sender=Movie)
+def remember_facet_values(sender, instance, raw=False, **kwargs):
+    if instance.pk and not instance._state.adding and not raw:
+        instance._facet_values = Movie.objects.filter(pk=instance.pk).values_list(
+            'director_id', 'imdb_score', 'popularity').first()
+
+
+@receiver(post_save, sender=Movie)
+def count_saved_movie(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = movie_deltas(instance.director_id, instance.imdb_score, instance.popularity)
+    old_values = instance.__dict__.pop('_facet_values', None)
+    if not created:
+        if old_values is None:
+            return
+        deltas.update(movie_deltas(*old_values, sign=-1))
+    apply_deltas(deltas)
+
+
+@receiver(pre_delete, sender=Movie)
+def count_deleted_movie(sender, instance, **kwargs):
+    # Genre links are deleted with the movie without m2m signals
+    genre_ids = Movie.genre.through.objects.filter(movie_id=instance.pk).values_list('genre_id', flat=True)
+    apply_deltas(movie_deltas(instance.director_id, instance.imdb_score, instance.popularity,
+                              genre_ids, sign=-1))
+
+
+@receiver(post_delete, sender=Director)
+@receiver(post_delete, sender=Genre)
+def delete_facet(sender, instance, **kwargs):
+    FacetCount.objects.filter(facet='director' if sender is Director else 'genre', key=instance.pk).delete()
+
+
+@receiver(m2m_changed, sender=Movie.genre.through)
+def count_genre_links(sender, instance, action, reverse, pk_set, **kwargs):
+    links = Movie.genre.through.objects.filter(**{'genre_id' if reverse else 'movie_id': instance.pk})
+    linked = 'movie_id' if reverse else 'genre_id'
+    if action == 'post_add':
+        # pk_set only has the links that were added
+        changed, sign = pk_set, 1
+    elif action == 'pre_remove':
+        changed, sign = links.filter(**{linked + '__in': pk_set}).values_list(linked, flat=True), -1
+    elif action == 'pre_clear':
+        changed, sign = links.values_list(linked, flat=True), -1
+    else:
+        return
+    if reverse:
+        apply_deltas({('genre', instance.pk): sign * len(changed)})
+    else:
+        apply_deltas(dict((('genre', genre_id), sign) for genre_id in changed))
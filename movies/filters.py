@@ -0,0 +1,256 @@
+"""
+    Declarative filters and sorts of movie listings
+    * MovieFilters.filters declares the query params and the lookup each
+      one adds, every filter is answered from an index:
+        - imdb_score_min/imdb_score_max, popularity_min/popularity_max:
+          ranges on the (imdb_score, id) and (popularity, id) indexes,
+          closed with the field's validator bounds
+        - genre=Drama,War with genre_match=any (default) or all: movies
+          linked to any or to each genre, through the genre_id index of
+          the genre links
+        - director: exact director, names compared as saved
+          (movies.names.normalise_name), through the director indexes.
+          Sorting by director_name walks the director name index and
+          sorts the movies of each name
+        - name_prefix: names starting with the prefix, case sensitive,
+          read as a range of the (name, id) index when the database
+          compares names by code point (SQLite, PostgreSQL "C"
+          collation), with LIKE otherwise
+    * MovieSort maps sort keys to fields, several keys sort on each in
+      turn: ?sort=popularity,-imdb_score,name
+    * Each filter also selects rows of the in memory catalogue
+      (movies.snapshot) with mask(), the same movies filter() selects
+"""
+from collections import OrderedDict
+
+import numpy
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import connections
+from rest_framework.exceptions import ValidationError
+
+from .models import Movie
+from .names import normalise_name, code_point_collation
+
+# Sorts after any character of a name, ends a name prefix range
+PREFIX_END = u'\uffff'
+
+
+class RangeFilter(object):
+
+    """
+        <field>_min and <field>_max params, both bounds included
+        * A range given one bound is closed with the field's validator
+          bound (MinValueValidator/MaxValueValidator). Planners estimate a
+          closed range as selective and search its index, instead of
+          walking the index of another sort field for the movies in range
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.params = (field + '_min', field + '_max')
+        validators = Movie._meta.get_field(field).validators
+        self.limits = tuple(next((validator.limit_value for validator in validators
+                                  if isinstance(validator, validator_class)), None)
+                            for validator_class in (MinValueValidator, MaxValueValidator))
+
+    def number(self, request, param):
+        value = request.query_params.get(param)
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            raise ValidationError({param: ['A valid number is required.']})
+
+    def bounds(self, request):
+        # (minimum, maximum) of the params, None when not filtered
+        bounds = [self.number(request, param) for param in self.params]
+        if bounds == [None, None]:
+            return None
+        return tuple(limit if bound is None else bound for bound, limit in zip(bounds, self.limits))
+
+    def filter(self, request, queryset):
+        bounds = self.bounds(request)
+        if bounds is None:
+            return queryset
+        lookups = {}
+        for bound, lookup in zip(bounds, ('gte', 'lte')):
+            if bound is not None:
+                lookups[self.field + '__' + lookup] = bound
+        return queryset.filter(**lookups)
+
+    def mask(self, request, snapshot):
+        bounds = self.bounds(request)
+        if bounds is None:
+            return None
+        mask = numpy.ones(len(snapshot.ids), dtype=bool)
+        for bound, compare in zip(bounds, (numpy.greater_equal, numpy.less_equal)):
+            if bound is not None:
+                mask &= compare(snapshot.columns[self.field], bound)
+        return mask
+
+
+class GenreFilter(object):
+
+    """
+        Comma separated genre names, movies of any or of all of them
+    """
+
+    params = ('genre', 'genre_match')
+    matches = ('any', 'all')
+
+    def genre_keys(self, request):
+        # Returns the normalised genre names and the match, None if not filtered
+        value = request.query_params.get('genre')
+        if not value:
+            return None, None
+        match = request.query_params.get('genre_match') or 'any'
+        if match not in self.matches:
+            raise ValidationError({'genre_match': ['Should be one of: %s' % ', '.join(self.matches)]})
+        return set(normalise_name(name) for name in value.split(',') if name.strip()), match
+
+    def filter(self, request, queryset):
+        keys, match = self.genre_keys(request)
+        if keys is None:
+            return queryset
+        # Subqueries on the links, so movies are not repeated per genre
+        links = Movie.genre.through.objects.values('movie_id')
+        if match == 'any':
+            return queryset.filter(id__in=links.filter(genre__name_key__in=keys))
+        for key in keys:
+            queryset = queryset.filter(id__in=links.filter(genre__name_key=key))
+        return queryset
+
+    def mask(self, request, snapshot):
+        keys, match = self.genre_keys(request)
+        if keys is None:
+            return None
+        masks = [snapshot.genre_mask(key) for key in keys]
+        if not masks:
+            return numpy.zeros(len(snapshot.ids), dtype=bool)
+        return reduce(numpy.logical_or if match == 'any' else numpy.logical_and, masks)
+
+
+class DirectorFilter(object):
+
+    params = ('director',)
+
+    def filter(self, request, queryset):
+        value = request.query_params.get('director')
+        if not value:
+            return queryset
+        return queryset.filter(director__name_key=normalise_name(value))
+
+    def mask(self, request, snapshot):
+        value = request.query_params.get('director')
+        if not value:
+            return None
+        return snapshot.columns['director_id'] == snapshot.director_keys.get(normalise_name(value), -1)
+
+
+class PrefixFilter(object):
+
+    """
+        Range rather than LIKE, which databases only read from an index
+        under some collations
+        * The range holds exactly the names with the prefix only when
+          names are compared by code point (names.code_point_collation),
+          as the snapshot compares them. Other collations use startswith
+    """
+
+    def __init__(self, param, field):
+        self.field = field
+        self.params = (param,)
+
+    def filter(self, request, queryset):
+        value = request.query_params.get(self.params[0])
+        if not value:
+            return queryset
+        if not code_point_collation(connections[queryset.db]):
+            return queryset.filter(**{self.field + '__startswith': value})
+        return queryset.filter(**{self.field + '__gte': value, self.field + '__lt': value + PREFIX_END})
+
+    def mask(self, request, snapshot):
+        value = request.query_params.get(self.params[0])
+        if not value:
+            return None
+        column = snapshot.columns[self.field]
+        return ((column >= value) & (column < value + PREFIX_END)).astype(bool)
+
+
+class MovieFilters(object):
+
+    """
+        Applies every filter of filters to a movie queryset
+    """
+
+    filters = (
+        RangeFilter('imdb_score'),
+        RangeFilter('popularity'),
+        GenreFilter(),
+        DirectorFilter(),
+        PrefixFilter('name_prefix', 'name'),
+    )
+
+    @classmethod
+    def params(cls):
+        return tuple(param for movie_filter in cls.filters for param in movie_filter.params)
+
+    def requested(self, request):
+        return any(request.query_params.get(param) for param in self.params())
+
+    def filter_queryset(self, request, queryset):
+        for movie_filter in self.filters:
+            queryset = movie_filter.filter(request, queryset)
+        return queryset
+
+    def filter_mask(self, request, snapshot):
+        # Rows of snapshot selected by every filter, deleted rows excluded
+        mask = snapshot.alive.copy()
+        for movie_filter in self.filters:
+            selected = movie_filter.mask(request, snapshot)
+            if selected is not None:
+                mask &= selected
+        return mask
+
+
+class MovieSort(object):
+
+    """
+        Class to sort movies
+        * sort: comma separated keys of sort_fields, a key prefixed with
+          '-' is sorted in descending order
+        * sort_criteria=desc sorts the keys without prefix in descending
+          order
+        * Unknown keys are ignored
+    """
+
+    sort_fields = OrderedDict((
+        ('name', 'name'),
+        ('director_name', 'director__name'),
+        ('imdb_score', 'imdb_score'),
+        ('popularity', 'popularity'),
+    ))
+
+    def movie_sorting(self, request, queryset):
+        ordering = self.sort_ordering(request)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return queryset
+
+    def sort_ordering(self, request):
+        # Returns the order_by fields for the sort params, () if not sorted
+        sort_param = request.query_params.get('sort') or ''
+        descending = request.query_params.get('sort_criteria') == 'desc'
+        ordering = []
+        fields = set()
+        for key in sort_param.split(','):
+            key = key.strip()
+            prefix = '-' if descending else ''
+            if key.startswith('-'):
+                key, prefix = key[1:], '-'
+            field = self.sort_fields.get(key)
+            if field and field not in fields:
+                fields.add(field)
+                ordering.append(prefix + field)
+        return tuple(ordering)
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from movies.similarity import SimilarityIndex, similarity_options
+
+
+class Command(BaseCommand):
+
+    """
+        * Command to compute the neighbours of every movie and save them
+          to settings.MOVIE_SIMILARITY['INDEX_FILE'] (see movies.similarity)
+        * Servers load the file when they first look up similar movies,
+          restart them to load a new file. Writes made after the build are
+          applied to the loaded index, up to SYNC_ROWS changed movies. Until
+          the file exists, and past that, similar movies answer 503 and
+          servers load the next file written
+            $ python manage.py build_similarity_index
+            $ python manage.py build_similarity_index --output /tmp/movie_similarity.npz
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None,
+                            help='File to write instead of the INDEX_FILE setting')
+
+    def handle(self, *args, **options):
+        index_file = options['output'] or similarity_options()['INDEX_FILE']
+        start = time.time()
+        index = SimilarityIndex()
+        index.build()
+        index.save(index_file)
+        self.stdout.write('Indexed %d movies, %d neighbours each, in %.1fs: %s' % (
+            len(index.rows), index.neighbours_count, time.time() - start, index_file))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from movies.cache import bump_catalogue_version
+from movies.changes import publish, RELOAD
+from movies.facets import rebuild_facets
+from movies.models import (Movie, Director, Genre, director_resolver, genre_resolver,
+                           refresh_search_documents)
+from movies.names import merge_duplicate_names
+
+
+class Command(BaseCommand):
+
+    """
+        * Command to merge directors and genres having the same name
+          once spaces and case are ignored (' Drama', 'drama')
+        * Movies of the duplicates are moved to the oldest row with bulk
+          updates, then the duplicates are deleted
+        * Migration 0006 does the same, run it again after changing how
+          names are normalised (movies.names.normalise_name)
+            $ python manage.py dedupe_names
+    """
+
+    def handle(self, *args, **kwargs):
+        counts = (Director.objects.count(), Genre.objects.count())
+        with transaction.atomic():
+            movie_ids = merge_duplicate_names(Director, Movie, 'director')
+            movie_ids |= merge_duplicate_names(Genre, Movie, 'genre')
+            # Bulk updates send no signals
+            refresh_search_documents(movie_ids)
+            rebuild_facets()
+            publish(RELOAD)
+            bump_catalogue_version()
+        director_resolver.clear()
+        genre_resolver.clear()
+        self.stdout.write('Merged %d directors and %d genres, %d movies updated' % (
+            counts[0] - Director.objects.count(), counts[1] - Genre.objects.count(), len(movie_ids)))
@@ -0,0 +1,33 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from movies.synthetic import synthetic_movies
+
+
+class Command(BaseCommand):
+
+    """
+        * Command to write a synthetic catalogue of movies, in the
+          imdb.json schema, for benchmarks (see movies.synthetic)
+        * The same count and seed give the same file. It can be loaded
+          with load_movies:
+            $ python manage.py generate_catalogue 100000 catalogue.json --seed 1
+            $ python manage.py load_movies catalogue.json --direct --batch-size 1000
+        * Movies are written one at a time, so the size is not limited
+          by memory
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int, help='Number of movies')
+        parser.add_argument('output', help='JSON file to write')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed of the random generator')
+
+    def handle(self, *args, **options):
+        with open(options['output'], 'wb') as output:
+            output.write('[')
+            for index, movie in enumerate(synthetic_movies(options['count'], options['seed'])):
+                output.write((',\n' if index else '\n') + json.dumps(movie, sort_keys=True))
+            output.write('\n]\n')
+        self.stdout.write('Wrote %d movies to %s' % (options['count'], options['output']))
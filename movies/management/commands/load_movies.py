@@ -1,44 +1,100 @@
 import os
-import json
-import requests
+import time
 import getpass
 
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from movies.bulk import bulk_save_movies, CREATED
+from movies.readers import read_movies, read_csv_movies
+from movies.remote import RemoteLoader
 
 
 class Command(BaseCommand):
 
     """
         * Command to load all data in json to database
-        * Spaces in genres and director names in json file is not considered
-        * Hence duplicates may exist
+        * The file is read one movie at a time, so its size is not limited
+          by memory. A JSON array (imdb.json) or JSON Lines can be given,
+          or CSV when the file name ends with .csv. Files exported from
+          /movies/export/ can be loaded as they are
+        * Leading and trailing spaces in genre and director names are removed
         * Arguments:
             File to be loaded. imdb.json with exact path
             url of the path: ex: http://localhost:8000
         * In heroku you should run
             $ heroku run python manage.py load_movies /app/imdb.json http://moviesforall.herokuapp.com
+        * Movies are posted by --concurrency parallel requests over pooled
+          keep-alive connections. Server errors are retried with backoff and
+          a rate/latency summary is printed every few seconds
+        * Direct mode writes to the database without the API, in batches:
+            $ python manage.py load_movies imdb.json --direct --batch-size 1000
     """
     args = '<config_file> <url>'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--direct', action='store_true', default=False,
+                            help='Insert movies straight into the database instead of using the API')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of movies inserted per transaction in direct mode')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Number of parallel requests when posting to the API')
+        parser.add_argument('--retries', type=int, default=5,
+                            help='Retries of a movie on server or connection errors')
+        parser.add_argument('--timeout', type=float, default=30,
+                            help='Seconds to wait for the server on each request')
+
     def handle(self, *args, **kwargs):
         if args:
             file_path = args[0]
+            if not os.path.exists(file_path):
+                return 'File not found'
+            if kwargs['direct']:
+                return self.load_direct(file_path, kwargs['batch_size'])
             url = args[1]
             username = raw_input('Enter admin username: ')
             password = getpass.getpass(prompt='Enter admin password: ')
-            r = requests.post(url=url + '/user/login_token/',
-                              data={'username': username, 'password': password})
-            token = r.json()['token']
-            headers = {'Authorization': 'Token ' + str(token), 'content-type': 'application/json'}
-            if os.path.exists(file_path):
-                with open(file_path, 'rb') as data_file:
-                    json_data = json.load(data_file)
-                    for data in json_data:
-                        data['popularity'] = data['99popularity']
-                        del data['99popularity']
-                        r = requests.post(url=url + '/movies/', data=json.dumps(data), headers=headers)
-                        print r
-            else:
-                return 'File not found'
+            loader = RemoteLoader(url, concurrency=kwargs['concurrency'],
+                                  retries=kwargs['retries'], timeout=kwargs['timeout'], stdout=self.stdout)
+            loader.login(username, password)
+            with open(file_path, 'rb') as data_file:
+                loader.load(self.reader(file_path)(data_file))
         else:
             return 'No arguments provided'
+
+    def load_direct(self, file_path, batch_size):
+        read = inserted = queries = 0
+        # Queries are logged only to be counted, the log is cleared after each batch
+        force_debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        start = time.time()
+        try:
+            with open(file_path, 'rb') as data_file:
+                batch = []
+                for data in self.reader(file_path)(data_file):
+                    batch.append(data)
+                    if len(batch) == batch_size:
+                        inserted += self.insert_batch(batch)
+                        read += len(batch)
+                        queries += len(connection.queries_log)
+                        connection.queries_log.clear()
+                        batch = []
+                if batch:
+                    inserted += self.insert_batch(batch)
+                    read += len(batch)
+                    queries += len(connection.queries_log)
+                    connection.queries_log.clear()
+        finally:
+            connection.force_debug_cursor = force_debug_cursor
+        elapsed = max(time.time() - start, 1e-6)
+        self.stdout.write('Read %d movies, inserted %d, skipped %d existing' % (
+            read, inserted, read - inserted))
+        self.stdout.write('%.2f seconds, %.1f movies/sec, %d queries' % (
+            elapsed, read / elapsed, queries))
+
+    def reader(self, file_path):
+        return read_csv_movies if file_path.lower().endswith('.csv') else read_movies
+
+    def insert_batch(self, batch):
+        with transaction.atomic():
+            return bulk_save_movies(batch).count(CREATED)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-17 14:57
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+
+# icontains is run as UPPER("column"::text) LIKE UPPER(%s) on PostgreSQL,
+# trigram indexes on the same expression serve substring searches.
+TRIGRAM_INDEXES = (
+    ('movies_movie_name_trgm', 'movies_movie', 'name'),
+    ('movies_director_name_trgm', 'movies_director', 'name'),
+    ('movies_genre_name_trgm', 'movies_genre', 'name'),
+)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # Other databases keep the plain B-tree indexes
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for index, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute('CREATE INDEX %s ON %s USING gin (UPPER(%s::text) gin_trgm_ops)' % (
+            index, table, column))
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for index, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='director',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='movie',
+            name='imdb_score',
+            field=models.FloatField(db_index=True, validators=[django.core.validators.MinValueValidator(0.0), django.core.validators.MaxValueValidator(10.0)]),
+        ),
+        migrations.AlterField(
+            model_name='movie',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
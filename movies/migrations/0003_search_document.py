@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-17 14:59
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# Column, index and trigger of full text search (movies.search). Written
+# out here, so the migration does not change with the app code
+POSTGRESQL_FTS = (
+    "ALTER TABLE movies_movie ADD COLUMN search_vector tsvector",
+    "UPDATE movies_movie SET search_vector = to_tsvector('pg_catalog.simple', search_document)",
+    "CREATE INDEX movies_movie_search_vector ON movies_movie USING gin (search_vector)",
+    "CREATE TRIGGER movies_movie_search_vector BEFORE INSERT OR UPDATE ON movies_movie "
+    "FOR EACH ROW EXECUTE PROCEDURE "
+    "tsvector_update_trigger(search_vector, 'pg_catalog.simple', search_document)",
+)
+
+POSTGRESQL_FTS_DROP = (
+    "DROP TRIGGER IF EXISTS movies_movie_search_vector ON movies_movie",
+    "ALTER TABLE movies_movie DROP COLUMN IF EXISTS search_vector",
+)
+
+
+def build_search_documents(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    for movie in Movie.objects.select_related('director').prefetch_related('genre'):
+        movie.search_document = u' '.join(
+            [movie.name, movie.director.name] + [genre.name for genre in movie.genre.all()])
+        movie.save(update_fields=['search_document'])
+
+
+def create_search_vector(apps, schema_editor):
+    # SQLite gets its FTS5 table after migrate, see movies.search
+    if schema_editor.connection.vendor == 'postgresql':
+        for statement in POSTGRESQL_FTS:
+            schema_editor.execute(statement)
+
+
+def drop_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for statement in POSTGRESQL_FTS_DROP:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0002_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='search_document',
+            field=models.TextField(blank=True, default=b'', editable=False),
+        ),
+        migrations.RunPython(build_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_search_vector, drop_search_vector),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-17 15:01
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0003_search_document'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='movie',
+            index_together=set([('name', 'id'), ('imdb_score', 'id')]),
+        ),
+    ]
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-17 17:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Case, When, Value, CharField, IntegerField
+
+# Copy of movies.names as of this migration, so it does not change with the
+# app code
+
+
+def clean_name(name):
+    return u' '.join(name.split())
+
+
+def normalise_name(name):
+    return clean_name(name).lower()
+
+
+def in_batches(values, batch_size=500):
+    # SQLite limits the parameters of a query
+    values = list(values)
+    for start in range(0, len(values), batch_size):
+        yield values[start:start + batch_size]
+
+
+def merge_duplicate_names(model, movie_model, field):
+    # Merges rows having the same normalised name into the oldest one and
+    # sets name_key on every row, returns the ids of the repointed movies
+    rows = {}
+    replacements = {}
+    for row_id, name, name_key in model.objects.order_by('id').values_list('id', 'name', 'name_key'):
+        key = normalise_name(name)
+        if key in rows:
+            replacements[row_id] = rows[key][0]
+        else:
+            rows[key] = (row_id, name, name_key)
+    movie_ids = set()
+    if replacements and field == 'director':
+        for batch in in_batches(replacements):
+            movie_ids.update(movie_model.objects.filter(director_id__in=batch).values_list('id', flat=True))
+        for batch in in_batches(replacements):
+            movie_model.objects.filter(director_id__in=batch).update(director=Case(
+                *[When(director_id=duplicate, then=Value(replacements[duplicate])) for duplicate in batch],
+                output_field=IntegerField()))
+    elif replacements:
+        through = movie_model.genre.through
+        links = []
+        for batch in in_batches(replacements):
+            links.extend(through.objects.filter(genre_id__in=batch).values_list('id', 'movie_id', 'genre_id'))
+        movie_ids = set(movie_id for link_id, movie_id, genre_id in links)
+        kept = set()
+        for batch in in_batches(movie_ids):
+            kept.update(through.objects.filter(movie_id__in=batch, genre_id__in=set(
+                replacements.values())).values_list('movie_id', 'genre_id'))
+        repointed = {}
+        deleted = []
+        for link_id, movie_id, genre_id in links:
+            link = (movie_id, replacements[genre_id])
+            if link in kept:
+                deleted.append(link_id)
+            else:
+                kept.add(link)
+                repointed.setdefault(replacements[genre_id], []).append(link_id)
+        for batch in in_batches(deleted):
+            through.objects.filter(id__in=batch).delete()
+        for genre_id, link_ids in repointed.items():
+            for batch in in_batches(link_ids):
+                through.objects.filter(id__in=batch).update(genre=genre_id)
+    for batch in in_batches(replacements):
+        model.objects.filter(id__in=batch).delete()
+
+    # Duplicates are gone, so the keys can be set without a conflict
+    changed = [(row_id, clean_name(name), key) for key, (row_id, name, name_key) in rows.items()
+               if name_key != key or name != clean_name(name)]
+    for batch in in_batches(changed, 250):
+        model.objects.filter(id__in=[row_id for row_id, name, key in batch]).update(
+            name=Case(*[When(id=row_id, then=Value(name)) for row_id, name, key in batch],
+                      output_field=CharField()),
+            name_key=Case(*[When(id=row_id, then=Value(key)) for row_id, name, key in batch],
+                          output_field=CharField()))
+    return movie_ids
+
+
+def rebuild_search_documents(movie_model, movie_ids):
+    # Repointed movies are searched by the name of the kept row
+    for batch in in_batches(movie_ids, 100):
+        for movie in movie_model.objects.filter(id__in=batch).select_related('director').prefetch_related('genre'):
+            movie.search_document = u' '.join(
+                [movie.name, movie.director.name] + [genre.name for genre in movie.genre.all()])
+            movie.save(update_fields=['search_document', 'updated_at'])
+
+
+def merge_duplicates(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    movie_ids = merge_duplicate_names(apps.get_model('movies', 'Director'), Movie, 'director')
+    movie_ids |= merge_duplicate_names(apps.get_model('movies', 'Genre'), Movie, 'genre')
+    rebuild_search_documents(Movie, movie_ids)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0005_movie_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='director',
+            name='name_key',
+            field=models.CharField(editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='name_key',
+            field=models.CharField(editable=False, max_length=255, null=True),
+        ),
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='director',
+            name='name_key',
+            field=models.CharField(editable=False, max_length=255, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='genre',
+            name='name_key',
+            field=models.CharField(editable=False, max_length=255, unique=True),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-17 18:20
+from __future__ import unicode_literals
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Case, When, Value, Count, IntegerField
+
+# Copy of movies.facets.rebuild_facets as of this migration, so it does not
+# change with the app code
+HISTOGRAMS = (('imdb_score', 1.0), ('popularity', 10.0))
+BUCKETS = 10
+
+
+def bucket_expression(field, width):
+    return Case(*[When(**{field + '__lt': width * (index + 1), 'then': Value(index)})
+                  for index in range(BUCKETS - 1)],
+                default=Value(BUCKETS - 1), output_field=IntegerField())
+
+
+def count_facets(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    FacetCount = apps.get_model('movies', 'FacetCount')
+    counts = Counter()
+    counts['movies', 0] = Movie.objects.count()
+    links = Movie.genre.through.objects.values_list('genre_id').annotate(Count('id')).order_by()
+    for genre_id, count in links:
+        counts['genre', genre_id] = count
+    for director_id, count in Movie.objects.values_list('director_id').annotate(Count('id')).order_by():
+        counts['director', director_id] = count
+    for field, width in HISTOGRAMS:
+        for key, count in Movie.objects.annotate(bucket=bucket_expression(field, width)).values_list(
+                'bucket').annotate(Count('id')).order_by():
+            counts[field, key] = count
+    FacetCount.objects.all().delete()
+    FacetCount.objects.bulk_create([FacetCount(facet=facet, key=key, count=count)
+                                    for (facet, key), count in counts.items()], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0006_unique_names'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=20)),
+                ('key', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='facetcount',
+            unique_together=set([('facet', 'key')]),
+        ),
+        migrations.RunPython(count_facets, migrations.RunPython.noop),
+    ]
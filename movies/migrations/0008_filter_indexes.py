@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.1 on 2026-10-17 19:05
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0007_facetcount'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='movie',
+            index_together=set([('name', 'id'), ('imdb_score', 'id'), ('popularity', 'id'),
+                                ('director', 'name', 'id'), ('director', 'imdb_score', 'id'),
+                                ('director', 'popularity', 'id')]),
+        ),
+    ]
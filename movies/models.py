@@ -1,6 +1,14 @@
-from django.db import models
+from django.db import models, connections
+from django.db.models import Case, When, Value
+from django.utils import timezone
+from django.db.models.signals import m2m_changed, post_save, pre_delete, post_delete, post_migrate
+from django.dispatch import receiver
 from django.core.validators import MaxValueValidator, MinValueValidator
 
+from .cache import bump_catalogue_version
+from .search import install_sqlite_fts
+from .names import NameResolver, normalise_name
+
 
 class Director(models.Model):
     
@@ -8,7 +16,13 @@ class Director(models.Model):
         Model for directors
     """
 
-    name = models.CharField(max_length=255, null=False, blank=False)
+    name = models.CharField(max_length=255, null=False, blank=False, db_index=True)
+    # Unique name used to match names, see movies.names
+    name_key = models.CharField(max_length=255, unique=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        self.name_key = normalise_name(self.name)
+        super(Director, self).save(*args, **kwargs)
 
     def __unicode__(self):
         return self.name
@@ -21,24 +35,206 @@ class Genre(models.Model):
     """
 
     name = models.CharField(max_length=255, null=False, blank=False)
+    # Unique name used to match names, see movies.names
+    name_key = models.CharField(max_length=255, unique=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        self.name_key = normalise_name(self.name)
+        super(Genre, self).save(*args, **kwargs)
 
     def __unicode__(self):
         return self.name
 
 
+class MovieQuerySet(models.QuerySet):
+
+    """
+        Queryset for movies
+    """
+
+    def with_relations(self):
+        # Director is joined and genres are fetched in one extra query for
+        # the whole page, instead of two queries per movie while serializing.
+        return self.select_related('director').prefetch_related(
+            models.Prefetch('genre', queryset=Genre.objects.order_by('name')))
+
+    def list_rows(self):
+        # Plain rows for movies.serializers.movie_list_data
+        return self.prefetch_related(None).values(
+            'id', 'name', 'imdb_score', 'popularity', 'director__name')
+
+
 class Movie(models.Model):
 
     """
         Model for movies
     """
 
-    name = models.CharField(max_length=255, null=False, blank=False)
-    imdb_score = models.FloatField(null=False, blank=False, validators=[
+    name = models.CharField(max_length=255, null=False, blank=False, db_index=True)
+    imdb_score = models.FloatField(null=False, blank=False, db_index=True, validators=[
         MinValueValidator(0.0), MaxValueValidator(10.0)])
     popularity = models.FloatField(null=False, blank=False, validators=[
         MinValueValidator(0.0), MaxValueValidator(100.0)])
     director = models.ForeignKey(Director)
     genre = models.ManyToManyField(Genre)
+    # Name, director and genres, indexed for full text search (movies.search)
+    search_document = models.TextField(blank=True, default='', editable=False)
+    # Last change of the movie, its director or genres (ETag/Last-Modified,
+    # movies changed since a time for movies.similarity)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = MovieQuerySet.as_manager()
+
+    class Meta:
+        # Sort keys with the id tie-breaker used by cursor pagination, alone
+        # and after the director filter (movies.filters)
+        index_together = (('name', 'id'), ('imdb_score', 'id'), ('popularity', 'id'),
+                          ('director', 'name', 'id'), ('director', 'imdb_score', 'id'),
+                          ('director', 'popularity', 'id'))
 
     def __unicode__(self):
         return self.name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        movie = super(Movie, cls).from_db(db, field_names, values)
+        movie._document_source = (movie.__dict__.get('name'), movie.__dict__.get('director_id'))
+        return movie
+
+    def save(self, *args, **kwargs):
+        # The document follows genre links and renames through the receivers
+        # below, save only rebuilds it for a new movie or a new name or
+        # director. Names are read only when not already known
+        source = (self.name, self.director_id)
+        if self._state.adding or source != getattr(self, '_document_source', None):
+            director = getattr(self, '_director_cache', None)
+            if director is None or director.pk != self.director_id:
+                director = Director.objects.get(pk=self.director_id)
+            genres = [] if self._state.adding else self.genre.values_list('name', flat=True)
+            self.search_document = build_search_document(self.name, director.name, genres)
+        super(Movie, self).save(*args, **kwargs)
+        self._document_source = source
+
+
+class FacetCount(models.Model):
+
+    """
+        Number of movies per genre, director and imdb_score/popularity
+        bucket (facet, key), plus the total (facet movies, key 0)
+        * Updated incrementally on every write, see movies.facets
+    """
+
+    facet = models.CharField(max_length=20)
+    key = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('facet', 'key'),)
+
+    def __unicode__(self):
+        return u'%s %s: %s' % (self.facet, self.key, self.count)
+
+
+def build_search_document(name, director, genres):
+    return u' '.join([name, director] + list(genres))
+
+
+def refresh_search_documents(movie_ids, batch_size=100):
+
+    """
+        Rebuilds the search document of the given movies and marks them
+        as updated
+        * Used when genres change and by bulk writes, which skip Movie.save
+        * Costs three queries per batch of movies
+    """
+
+    movie_ids = list(movie_ids)
+    for start in range(0, len(movie_ids), batch_size):
+        batch = movie_ids[start:start + batch_size]
+        movies = Movie.objects.filter(id__in=batch).values_list('id', 'name', 'director__name')
+        genres = dict((movie_id, []) for movie_id in batch)
+        for movie_id, genre_name in Movie.genre.through.objects.filter(
+                movie_id__in=batch).values_list('movie_id', 'genre__name'):
+            genres[movie_id].append(genre_name)
+        whens = [When(id=movie_id, then=Value(build_search_document(name, director, genres[movie_id])))
+                 for movie_id, name, director in movies]
+        if whens:
+            Movie.objects.filter(id__in=batch).update(
+                search_document=Case(*whens, output_field=models.TextField()),
+                updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Movie.genre.through)
+def update_genre_search_document(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # Movies of a genre are not known any more after clearing it
+        instance.cleared_movie_ids = list(instance.movie_set.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            refresh_search_documents([instance.pk])
+        else:
+            refresh_search_documents(pk_set or instance.__dict__.pop('cleared_movie_ids', []))
+
+
+# Name to id caches used by the write paths
+director_resolver = NameResolver(Director)
+genre_resolver = NameResolver(Genre)
+
+
+@receiver(pre_delete, sender=Genre)
+def remember_genre_movies(sender, instance, **kwargs):
+    # Links of a deleted genre are deleted without m2m signals
+    instance.deleted_movie_ids = list(Movie.objects.filter(genre=instance).values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Genre)
+def update_deleted_genre_search_document(sender, instance, **kwargs):
+    refresh_search_documents(instance.__dict__.pop('deleted_movie_ids', []))
+
+
+@receiver(post_save, sender=Director)
+@receiver(post_save, sender=Genre)
+def update_renamed_search_document(sender, instance, created, **kwargs):
+    if not created:
+        if sender is Director:
+            movies = Movie.objects.filter(director=instance)
+        else:
+            movies = Movie.objects.filter(genre=instance)
+        refresh_search_documents(movies.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Director)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Director)
+@receiver(post_delete, sender=Genre)
+def invalidate_name_resolver(sender, created=False, **kwargs):
+    if not created:
+        (director_resolver if sender is Director else genre_resolver).clear()
+
+
+# Cached counts and responses depend on every movie, director and genre
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=Director)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=Director)
+@receiver(post_delete, sender=Genre)
+def invalidate_catalogue(sender, **kwargs):
+    bump_catalogue_version()
+
+
+@receiver(m2m_changed, sender=Movie.genre.through)
+def invalidate_catalogue_genres(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_catalogue_version()
+
+
+@receiver(post_migrate)
+def install_search_index(sender, using, **kwargs):
+    if sender.name == 'movies':
+        install_sqlite_fts(connections[using])
+
+
+# Facet counts and the change feed are kept up to date by the receivers in
+# movies.facets and movies.changes
+from . import facets, changes  # noqa
@@ -0,0 +1,179 @@
+"""
+    Director and Genre names
+    * Names are unique by name_key, the name with spaces collapsed and
+      lower cased, so ' Drama', 'Drama' and 'drama' are the same genre
+    * resolve_names maps names to ids in batches, NameResolver keeps the
+      ids in a process local cache in front of it
+    * merge_duplicate_names merges rows having the same key (the
+      dedupe_names command, migration 0006 runs its own copy)
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Case, When, Value, CharField, IntegerField
+
+from movies_for_all.lru import LRUCache
+
+# Pairs a code point order and a linguistic collation order differently
+COLLATION_PROBES = ((u'B', u'a'), (u'a', u'B'), (u'a b', u'ab'), (u'Z', u'\xe9'), (u'a-c', u'ab'))
+
+
+def clean_name(name):
+    return u' '.join(name.split())
+
+
+def normalise_name(name):
+    return clean_name(name).lower()
+
+
+def code_point_collation(connection):
+    # Whether the database compares names by code point, as Python does.
+    # Compares the probes in both, once per connection
+    if getattr(connection, 'movies_code_point_collation', None) is None:
+        sql = 'SELECT %s' % ', '.join(['%s < %s'] * len(COLLATION_PROBES))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [value for pair in COLLATION_PROBES for value in pair])
+            results = cursor.fetchone()
+        connection.movies_code_point_collation = (
+            [bool(result) for result in results] == [first < second for first, second in COLLATION_PROBES])
+    return connection.movies_code_point_collation
+
+
+def in_batches(values, batch_size=500):
+    # SQLite limits the parameters of a query
+    values = list(values)
+    for start in range(0, len(values), batch_size):
+        yield values[start:start + batch_size]
+
+
+def resolve_names(model, names):
+
+    """
+        Maps names to ids for Director or Genre
+        * Missing rows are created with a single bulk insert
+        * Costs at most three queries however many names are given
+    """
+
+    keys = dict((name, normalise_name(name)) for name in names)
+    ids = dict(model.objects.filter(name_key__in=set(keys.values())).values_list('name_key', 'id'))
+    missing = dict((key, clean_name(name)) for name, key in keys.items() if key not in ids)
+    if missing:
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create([model(name=name, name_key=key)
+                                           for key, name in missing.items()])
+        except IntegrityError:
+            # Some were created meanwhile by another request
+            for key, name in missing.items():
+                ids[key] = model.objects.get_or_create(name_key=key, defaults={'name': name})[0].id
+        else:
+            ids.update(model.objects.filter(name_key__in=missing).values_list('name_key', 'id'))
+    return dict((name, ids[key]) for name, key in keys.items())
+
+
+class NameResolver(object):
+
+    """
+        Process local cache of name key: id for Director or Genre
+        * Names in the cache cost no query, the others are resolved with
+          resolve_names
+        * Ids are cached once the transaction resolving them commits, so
+          a rollback never leaves an unknown id behind
+        * Cleared when a row of the model is renamed or deleted in this
+          process (movies.models). Entries expire after timeout seconds
+          for changes made by other processes
+    """
+
+    def __init__(self, model, max_entries=10000, timeout=300):
+        self.model = model
+        self.ids = LRUCache(max_entries, timeout)
+
+    def resolve(self, names):
+        result = {}
+        missing = []
+        for name in set(names):
+            name_id = self.ids.get(normalise_name(name))
+            if name_id is None:
+                missing.append(name)
+            else:
+                result[name] = name_id
+        if missing:
+            resolved = resolve_names(self.model, missing)
+            result.update(resolved)
+            transaction.on_commit(lambda: self.remember(resolved))
+        return result
+
+    def resolve_one(self, name):
+        return self.resolve([name])[name]
+
+    def remember(self, resolved):
+        for name, name_id in resolved.items():
+            self.ids.set(normalise_name(name), name_id)
+
+    def clear(self):
+        self.ids.clear()
+
+
+def merge_duplicate_names(model, movie_model, field):
+
+    """
+        Merges Director or Genre rows having the same normalised name
+        into the oldest one and sets name_key on every row
+        * field: the Movie field pointing to model ('director' or 'genre')
+        * Movies of the duplicates are repointed with bulk updates, genre
+          links a movie already has with the kept genre are deleted
+        * Returns the ids of the movies that were repointed
+    """
+
+    rows = {}
+    replacements = {}
+    for row_id, name, name_key in model.objects.order_by('id').values_list('id', 'name', 'name_key'):
+        key = normalise_name(name)
+        if key in rows:
+            replacements[row_id] = rows[key][0]
+        else:
+            rows[key] = (row_id, name, name_key)
+    if not replacements:
+        movie_ids = set()
+    elif field == 'director':
+        movie_ids = set(movie_model.objects.filter(
+            director_id__in=replacements).values_list('id', flat=True))
+        for batch in in_batches(replacements):
+            movie_model.objects.filter(director_id__in=batch).update(director=Case(
+                *[When(director_id=duplicate, then=Value(replacements[duplicate])) for duplicate in batch],
+                output_field=IntegerField()))
+    else:
+        through = movie_model.genre.through
+        links = []
+        for batch in in_batches(replacements):
+            links.extend(through.objects.filter(genre_id__in=batch).values_list('id', 'movie_id', 'genre_id'))
+        movie_ids = set(movie_id for link_id, movie_id, genre_id in links)
+        kept = set()
+        for batch in in_batches(movie_ids):
+            kept.update(through.objects.filter(movie_id__in=batch, genre_id__in=set(
+                replacements.values())).values_list('movie_id', 'genre_id'))
+        repointed = {}
+        deleted = []
+        for link_id, movie_id, genre_id in links:
+            link = (movie_id, replacements[genre_id])
+            if link in kept:
+                deleted.append(link_id)
+            else:
+                kept.add(link)
+                repointed.setdefault(replacements[genre_id], []).append(link_id)
+        for batch in in_batches(deleted):
+            through.objects.filter(id__in=batch).delete()
+        for genre_id, link_ids in repointed.items():
+            for batch in in_batches(link_ids):
+                through.objects.filter(id__in=batch).update(genre=genre_id)
+    for batch in in_batches(replacements):
+        model.objects.filter(id__in=batch).delete()
+
+    # Duplicates are gone, so the keys can be set without a conflict
+    changed = [(row_id, clean_name(name), key) for key, (row_id, name, name_key) in rows.items()
+               if name_key != key or name != clean_name(name)]
+    for batch in in_batches(changed, 250):
+        model.objects.filter(id__in=[row_id for row_id, name, key in batch]).update(
+            name=Case(*[When(id=row_id, then=Value(name)) for row_id, name, key in batch],
+                      output_field=CharField()),
+            name_key=Case(*[When(id=row_id, then=Value(key)) for row_id, name, key in batch],
+                          output_field=CharField()))
+    return movie_ids
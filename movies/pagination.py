@@ -0,0 +1,132 @@
+import json
+import base64
+
+from django.core.paginator import Paginator
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.settings import api_settings
+
+from .cache import cached_count
+
+
+class CachedCountPaginator(Paginator):
+
+    """
+        Paginator reading the count from movies.cache
+    """
+
+    def _get_count(self):
+        if self._count is None:
+            self._count = cached_count(self.object_list)
+        return self._count
+    count = property(_get_count)
+
+
+class MoviePageNumberPagination(PageNumberPagination):
+
+    """
+        Page number pagination with the count computed once per request and
+        cached until the catalogue changes
+    """
+
+    django_paginator_class = CachedCountPaginator
+
+
+class RowsPageNumberPagination(MoviePageNumberPagination):
+
+    """
+        Page number pagination of rows already in memory (movies.snapshot),
+        counted with len()
+    """
+
+    django_paginator_class = Paginator
+
+
+class MovieCursorPagination(BasePagination):
+
+    """
+        Keyset pagination for movie listings
+        * Opt in with ?pagination=cursor, the response then has a "next"
+          cursor to pass as ?cursor=<next> for the following page
+        * Rows are ordered by the sort fields and then by id, the cursor
+          holds the values of the last row of the page. Next page is read
+          with first field >= value AND (rows after the last one on the
+          sort fields and id), so every page costs the same however deep
+          it is
+        * Except sort=director_name: the name is on the joined director,
+          no index of movies_movie holds it with the id. The next page
+          searches the director name index from the cursor, then reads and
+          sorts every movie of each director it walks, so a page costs as
+          much as the movies of the directors it spans
+        * id follows the direction of the last sort field
+        * No count is returned in this mode
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Invalid cursor'
+    # JSON types of the cursor values by field, bool is an int to Python
+    value_types = {
+        'id': (int, long),
+        'name': basestring,
+        'director__name': basestring,
+        'imdb_score': (int, long, float),
+        'popularity': (int, long, float),
+    }
+
+    @staticmethod
+    def requested(request):
+        return (request.query_params.get('pagination') == 'cursor' or
+                'cursor' in request.query_params)
+
+    def paginate_queryset(self, queryset, request, ordering=()):
+        """
+            ordering: sort fields as given to order_by ('-name', 'imdb_score'),
+            () to order by id only
+        """
+        ordering = tuple(ordering or ())
+        id_prefix = '-' if ordering and ordering[-1].startswith('-') else ''
+        keys = [(field.lstrip('-'), field.startswith('-')) for field in ordering + (id_prefix + 'id',)]
+        queryset = queryset.order_by(*(ordering + (id_prefix + 'id',)))
+
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            position = self.decode_cursor(cursor, ordering)
+            values = position['values'] + [position['id']]
+            # Rows after the last one: greater on a key, equal on the keys before
+            after = None
+            for (field, descending), value in reversed(zip(keys, values)):
+                later = Q(**{field + ('__lt' if descending else '__gt'): value})
+                after = later if after is None else later | (Q(**{field: value}) & after)
+            field, descending = keys[0]
+            # Same rows, but the first key alone can be read from its index
+            queryset = queryset.filter(Q(**{field + ('__lte' if descending else '__gte'): values[0]}), after)
+
+        # One more row tells if there is a next page
+        page = list(queryset[:self.page_size + 1])
+        self.next_cursor = None
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            self.next_cursor = self.encode_cursor(page[-1], ordering)
+        return page
+
+    def encode_cursor(self, movie, ordering):
+        # movie is a row from Movie.objects.list_rows()
+        position = {'sort': list(ordering), 'id': movie['id'],
+                    'values': [movie[field.lstrip('-')] for field in ordering]}
+        return base64.urlsafe_b64encode(json.dumps(position))
+
+    def decode_cursor(self, cursor, ordering):
+        try:
+            position = json.loads(base64.urlsafe_b64decode(str(cursor)))
+            # A cursor is only valid for the sort it was made with
+            if position['sort'] != list(ordering) or len(position['values']) != len(ordering):
+                raise ValueError
+            # Any other value would reach the filters (database or snapshot)
+            fields = [field.lstrip('-') for field in ordering] + ['id']
+            for field, value in zip(fields, position['values'] + [position['id']]):
+                if isinstance(value, bool) or not isinstance(value, self.value_types[field]):
+                    raise ValueError
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        return position
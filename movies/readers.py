@@ -0,0 +1,113 @@
+import re
+import csv
+import json
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Columns of movies in CSV files, others are ignored
+CSV_FIELDS = ('name', 'director', 'genre', 'imdb_score', 'popularity')
+
+
+def normalise_movie(data):
+    # Popularity is stored as 99popularity in imdb.json
+    if '99popularity' in data:
+        data['popularity'] = data.pop('99popularity')
+    # Genres are separated by ', ' in imdb.json which leaves leading spaces
+    data['director'] = data['director'].strip()
+    data['genre'] = [genre.strip() for genre in data['genre']]
+    return data
+
+
+def iter_json_values(data_file, chunk_size=64 * 1024, max_value_size=1024 * 1024):
+
+    """
+        Yields JSON values one by one from a file without loading it whole
+        * Accepts a top level JSON array (imdb.json) as well as JSON Lines
+        * Only the value being decoded and one chunk are kept in memory
+        * A value not decoded once max_value_size bytes are buffered is
+          invalid, rather than reading the rest of the file to find out
+    """
+
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    in_array = False
+    # In an array: 'first' (a value or ']'), 'value' or 'next' (',' or ']')
+    expected = None
+    while True:
+        pos = WHITESPACE.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                break
+            buf = data_file.read(chunk_size)
+            pos = 0
+            eof = not buf
+            continue
+        char = buf[pos]
+        if char == '[' and not in_array:
+            in_array = True
+            expected = 'first'
+            pos += 1
+            continue
+        if in_array:
+            if char == ',' and expected == 'next':
+                expected = 'value'
+                pos += 1
+                continue
+            if char == ']' and expected != 'value':
+                in_array = False
+                pos += 1
+                continue
+            # Empty elements ([,,] [1,]) or values without a comma ([1 2])
+            if char in ',]' or expected == 'next':
+                raise ValueError('Invalid JSON array at offset %d' % pos)
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            end = None
+        # A value ending at the end of the buffer may be cut short (numbers)
+        if end is None or (end == len(buf) and not eof):
+            if eof or (end is None and len(buf) - pos > max_value_size):
+                raise ValueError('Invalid JSON at offset %d' % pos)
+            chunk = data_file.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield value
+        if in_array:
+            expected = 'next'
+        pos = end
+        if pos >= chunk_size:
+            buf = buf[pos:]
+            pos = 0
+    if in_array:
+        raise ValueError('Unterminated JSON array')
+
+
+def read_movies(data_file):
+    for data in iter_json_values(data_file):
+        yield normalise_movie(data)
+
+
+def read_csv_movies(data_file):
+    """
+        Reads movies from CSV written by /movies/export/?output=csv
+        * Columns are found by their CSV_FIELDS header name, in any order,
+          other columns are ignored
+        * genre holds a JSON array of names, so a name can contain any
+          character, separators and quotes included
+    """
+    reader = csv.DictReader(data_file)
+    missing = [field for field in CSV_FIELDS if field not in (reader.fieldnames or ())]
+    if missing:
+        raise ValueError('Missing CSV columns: %s' % ', '.join(missing))
+    for line, row in enumerate(reader, 2):
+        data = dict((field, (row[field] or '').decode('utf-8')) for field in CSV_FIELDS)
+        genres = json.loads(data['genre']) if data['genre'].strip() else []
+        if not isinstance(genres, list) or not all(isinstance(genre, basestring) for genre in genres):
+            raise ValueError('Line %d: genre is not a JSON array of names' % line)
+        data['genre'] = [genre for genre in genres if genre.strip()]
+        data['imdb_score'] = float(data['imdb_score'])
+        data['popularity'] = float(data['popularity'])
+        yield normalise_movie(data)
@@ -0,0 +1,139 @@
+import json
+import time
+import threading
+from collections import deque
+from Queue import Queue
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Error of the movies API for a name already in the catalogue
+EXISTS = 'Movie already exists'
+
+
+class RemoteLoader(object):
+
+    """
+        Posts movies to the movies API of a running server
+        * One requests.Session is shared by all workers, its connection pool
+          holds one keep-alive connection per worker
+        * concurrency: number of requests in flight
+        * Server errors (5xx) and request errors (connection, timeout after
+          timeout seconds, broken response) are retried with exponential
+          backoff: backoff, 2 * backoff, 4 * backoff ...
+        * A movie whose request still fails, or whose response is not the
+          API's JSON, is counted as failed and the worker goes on
+        * A retried movie answered "Movie already exists" is counted as
+          created when an earlier attempt reached the server (timed out
+          reading the response, broken response, 5xx): it may have saved
+          it. Connection errors never sent the movie
+        * Movies are queued to workers through a bounded queue, so the input
+          is consumed only as fast as it is posted
+    """
+
+    def __init__(self, url, concurrency=8, retries=5, backoff=0.5, timeout=30, stdout=None):
+        self.url = url
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.stdout = stdout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        self.created = self.rejected = self.failed = self.retried = 0
+        # Latencies of the most recent requests, for percentiles
+        self.latencies = deque(maxlen=1000)
+
+    def login(self, username, password):
+        r = self.session.post(url=self.url + '/user/login_token/',
+                              data={'username': username, 'password': password}, timeout=self.timeout)
+        token = r.json()['token']
+        self.session.headers.update({'Authorization': 'Token ' + str(token),
+                                     'content-type': 'application/json'})
+
+    def post(self, data):
+        # Response, or None when every attempt failed, and whether an
+        # earlier attempt may have reached the server
+        body = json.dumps(data)
+        sent = False
+        for attempt in range(self.retries + 1):
+            if attempt:
+                with self.lock:
+                    self.retried += 1
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            start = time.time()
+            try:
+                r = self.session.post(url=self.url + '/movies/', data=body, timeout=self.timeout)
+            except (requests.exceptions.ReadTimeout, requests.exceptions.ChunkedEncodingError):
+                # Failed after the request was sent
+                sent = True
+                continue
+            except requests.RequestException:
+                # Refused, unresolved or timed out connection: never sent
+                continue
+            with self.lock:
+                self.latencies.append(time.time() - start)
+            if r.status_code < 500:
+                return r, sent
+            sent = True
+        return None, sent
+
+    def worker(self, queue):
+        while True:
+            data = queue.get()
+            if data is None:
+                break
+            try:
+                r, sent = self.post(data)
+                result = r.json() if r is not None and r.status_code == 200 else {}
+                status = result.get('status')
+                if sent and result.get('errors') == EXISTS:
+                    status = 1
+            except Exception:
+                # Counted as failed, a worker that stops would leave load()
+                # blocked on the full queue
+                status = None
+            with self.lock:
+                if status is None:
+                    self.failed += 1
+                elif status == 1:
+                    self.created += 1
+                else:
+                    # Movie already exists or is invalid
+                    self.rejected += 1
+
+    def load(self, movies, report_every=5.0):
+        queue = Queue(maxsize=self.concurrency * 2)
+        workers = [threading.Thread(target=self.worker, args=(queue,))
+                   for i in range(self.concurrency)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        self.start = last_report = time.time()
+        for data in movies:
+            queue.put(data)
+            if time.time() - last_report >= report_every:
+                self.report()
+                last_report = time.time()
+        for worker in workers:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+        self.report()
+
+    def report(self):
+        with self.lock:
+            done = self.created + self.rejected + self.failed
+            latencies = sorted(self.latencies)
+            line = '%d posted (%d created, %d rejected, %d failed, %d retries)' % (
+                done, self.created, self.rejected, self.failed, self.retried)
+        elapsed = max(time.time() - self.start, 1e-6)
+        line += ', %.1f movies/sec' % (done / elapsed)
+        if latencies:
+            line += ', latency p50 %.0f ms p95 %.0f ms' % (
+                latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.95)] * 1000)
+        if self.stdout:
+            self.stdout.write(line)
@@ -0,0 +1,99 @@
+"""
+    Full text search over Movie.search_document
+    * PostgreSQL: search_vector tsvector column kept up to date by a
+      trigger and indexed with GIN (see migration 0003)
+    * SQLite: FTS5 table kept up to date by triggers, installed after
+      migrate as SQLite drops triggers when Django rebuilds the table
+    * Other databases: unranked icontains on search_document
+"""
+from django.db import connections
+
+
+SQLITE_FTS = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS movies_movie_fts USING fts5("
+    "search_document, content='movies_movie', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS movies_movie_fts_insert AFTER INSERT ON movies_movie BEGIN "
+    "INSERT INTO movies_movie_fts(rowid, search_document) VALUES (new.id, new.search_document); END",
+    "CREATE TRIGGER IF NOT EXISTS movies_movie_fts_delete AFTER DELETE ON movies_movie BEGIN "
+    "INSERT INTO movies_movie_fts(movies_movie_fts, rowid, search_document) "
+    "VALUES ('delete', old.id, old.search_document); END",
+    "CREATE TRIGGER IF NOT EXISTS movies_movie_fts_update AFTER UPDATE OF search_document "
+    "ON movies_movie BEGIN "
+    "INSERT INTO movies_movie_fts(movies_movie_fts, rowid, search_document) "
+    "VALUES ('delete', old.id, old.search_document); "
+    "INSERT INTO movies_movie_fts(rowid, search_document) VALUES (new.id, new.search_document); END",
+)
+
+
+def sqlite_has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if cursor.fetchone()[0]:
+            return True
+        # Loaded as an extension or built in without the compile option
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.movies_fts5_check USING fts5(x)")
+            cursor.execute("DROP TABLE temp.movies_fts5_check")
+        except Exception:
+            return False
+    return True
+
+
+def install_sqlite_fts(connection):
+    """
+        Creates the FTS5 table and its triggers when missing
+    """
+    if connection.vendor != 'sqlite' or not sqlite_has_fts5(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' "
+                       "AND name LIKE 'movies_movie_fts_%'")
+        if cursor.fetchone()[0] == 3:
+            return
+        for statement in SQLITE_FTS:
+            cursor.execute(statement)
+        # Index the rows written while the triggers were missing
+        cursor.execute("INSERT INTO movies_movie_fts(movies_movie_fts) VALUES ('rebuild')")
+    connection.movies_fts_installed = True
+
+
+def sqlite_fts_installed(connection):
+    # Looked up once per connection
+    if getattr(connection, 'movies_fts_installed', None) is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM sqlite_master WHERE name = 'movies_movie_fts'")
+            connection.movies_fts_installed = bool(cursor.fetchone()[0])
+    return connection.movies_fts_installed
+
+
+def full_text_search(queryset, keyword):
+
+    """
+        Filters movies matching all words of keyword in name, director or
+        genres, ordered by relevance (best first) then id, so movies of
+        the same rank keep their place across pages
+    """
+
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        query = "plainto_tsquery('pg_catalog.simple', %s)"
+        return queryset.extra(
+            select={'search_rank': 'ts_rank(movies_movie.search_vector, %s)' % query},
+            select_params=[keyword],
+            where=['movies_movie.search_vector @@ %s' % query], params=[keyword],
+            order_by=['-search_rank', 'movies_movie.id'])
+    if connection.vendor == 'sqlite' and sqlite_fts_installed(connection):
+        # Each word is quoted so the keyword is not read as FTS5 query syntax
+        words = keyword.split()
+        if not words:
+            return queryset.none()
+        match = ' '.join('"%s"' % word.replace('"', '""') for word in words)
+        # bm25 rank, lower is better
+        return queryset.extra(
+            select={'search_rank': 'movies_movie_fts.rank'},
+            tables=['movies_movie_fts'],
+            where=['movies_movie_fts.rowid = movies_movie.id', 'movies_movie_fts MATCH %s'],
+            params=[match], order_by=['search_rank', 'movies_movie.id'])
+    for word in keyword.split():
+        queryset = queryset.filter(search_document__icontains=word)
+    return queryset
@@ -1,3 +1,6 @@
+from collections import OrderedDict
+
+from django.utils import six
 from rest_framework import serializers
 
 from .models import Movie, Genre, Director
@@ -23,14 +26,32 @@ class GenreSerializer(serializers.ModelSerializer):
         model = Genre
 
 
+class NameField(serializers.CharField):
+
+    """
+        Director or genre name, only strings are accepted
+    """
+
+    default_error_messages = {'invalid': 'Not a valid string.'}
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('max_length', 255)
+        super(NameField, self).__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if not isinstance(data, six.string_types):
+            self.fail('invalid')
+        return super(NameField, self).to_internal_value(data)
+
+
 class MovieSerializer(serializers.ModelSerializer):
 
     """
         Serializing movie model
     """
 
-    director = serializers.CharField()
-    genre = serializers.ListField(allow_empty=False)
+    director = NameField()
+    genre = serializers.ListField(child=NameField(), allow_empty=False)
 
     class Meta:
         model = Movie
@@ -48,10 +69,42 @@ class MovieListSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Movie
-        exclude = ('id',)
+        exclude = ('id', 'search_document', 'updated_at')
 
     def find_director(self, obj):
         return obj.director.name
 
     def list_genres(self, obj):
-        return obj.genre.all().values_list('name', flat=True)
+        # Iterating genre.all() uses the prefetched genres when available
+        return [genre.name for genre in obj.genre.all()]
+
+
+def genre_names(movie_ids, using='default'):
+    """
+        Genre names of each movie, sorted, in one query
+        * Sorted by the database like the prefetched genres of
+          Movie.objects.with_relations(), so both give the same order
+    """
+    links = Movie.genre.through.objects.using(using).filter(movie_id__in=movie_ids)
+    names = dict((movie_id, []) for movie_id in movie_ids)
+    for movie_id, genre_name in links.values_list('movie_id', 'genre__name').order_by('genre__name'):
+        names[movie_id].append(genre_name)
+    return names
+
+
+def movie_list_data(rows, using='default'):
+
+    """
+        Read only fast path of MovieListSerializer(many=True)
+        * rows: dicts from Movie.objects.list_rows()
+        * Gives the same data, keys in the same order, without building
+          serializer fields for every movie
+    """
+
+    genres = genre_names([row['id'] for row in rows], using)
+    return [OrderedDict((('director', row['director__name']),
+                         ('genre', genres[row['id']]),
+                         ('name', row['name']),
+                         ('imdb_score', row['imdb_score']),
+                         ('popularity', row['popularity'])))
+            for row in rows]
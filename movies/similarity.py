@@ -0,0 +1,357 @@
+"""
+    Movies similar to a movie, from an index of precomputed neighbours
+    * A movie is a vector of one-hot genres, its one-hot director and its
+      imdb_score and popularity scaled to 0-1, each part weighted. The
+      similarity of two movies is the cosine of their vectors. Directors
+      are kept as ids and compared, so the vectors stay small however
+      many directors there are
+    * The NEIGHBOURS most similar movies of every movie are computed with
+      NumPy, in blocks of movies, by the build_similarity_index command
+      and saved to settings.MOVIE_SIMILARITY['INDEX_FILE']
+    * Each process loads the file once and answers lookups from its
+      arrays. Building is never done while answering a request: without
+      the file, or with more than SYNC_ROWS movies changed since it was
+      built, lookups raise IndexUnavailable (503) until the command has
+      written a new file
+    * The index is built in another process (the command) than the one
+      answering, so the change feed must be in a shared cache: building
+      or loading the index with a process local cache raises
+      ImproperlyConfigured
+    * Writes are applied incrementally: when the catalogue version has
+      changed, the movies of the change feed (movies.changes) since the
+      last sync are read again and only their neighbours, and the
+      neighbours of the movies they were or become close to, are computed
+      again. When the feed cannot tell (RELOAD), every movie is read and
+      those whose vector differs from the index are the changed ones
+"""
+import os
+import tempfile
+import threading
+
+import numpy
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework import exceptions, status
+
+from . import changes
+from .cache import catalogue_version
+from .models import Movie
+from .names import in_batches
+
+GENRE_WEIGHT = 1.0
+DIRECTOR_WEIGHT = 1.0
+SCORE_WEIGHT = 0.5
+# Similarities computed at once (float32), a block of movies compared
+# with every movie holds about that many
+BLOCK_FLOATS = 4 * 1024 * 1024
+MAX_BLOCK_SIZE = 1024
+# Above this share of changed movies every neighbour is computed again
+REBUILD_RATIO = 0.1
+# Most changed movies applied while answering a request
+SYNC_ROWS = 1000
+
+
+class IndexUnavailable(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Similar movies are not available until the similarity index is built.'
+
+
+def similarity_options():
+    options = {'INDEX_FILE': None, 'NEIGHBOURS': 20}
+    options.update(getattr(settings, 'MOVIE_SIMILARITY', {}))
+    return options
+
+
+def read_movies(movie_ids=None):
+
+    """
+        Returns the rows (id, director_id, imdb_score, popularity) and the
+        genre ids by movie id, of every movie or of movie_ids
+        * Read from the primary, the index outlives the request
+    """
+
+    movies = Movie.objects.using(DEFAULT_DB_ALIAS).values_list('id', 'director_id', 'imdb_score', 'popularity')
+    genre_links = Movie.genre.through.objects.using(DEFAULT_DB_ALIAS).values_list('movie_id', 'genre_id')
+    if movie_ids is None:
+        rows = list(movies)
+        links = genre_links
+    else:
+        rows = []
+        links = []
+        for batch in in_batches(movie_ids):
+            rows.extend(movies.filter(id__in=batch))
+            links.extend(genre_links.filter(movie_id__in=batch))
+    genres = dict((row[0], []) for row in rows)
+    for movie_id, genre_id in links:
+        genres[movie_id].append(genre_id)
+    return rows, genres
+
+
+class SimilarityIndex(object):
+
+    """
+        Arrays of the movie vectors and of their neighbours, by row
+        * Rows of deleted movies stay, marked as not alive, so the rows
+          in neighbours keep pointing at the same movies
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.loaded = False
+            self.version = None
+            # (path, modification time) of an index file not to load again
+            self.stale_file = None
+
+    def reset(self, neighbours):
+        self.neighbours_count = neighbours
+        self.ids = numpy.zeros(0, dtype=numpy.int64)
+        self.rows = {}
+        self.directors = numpy.zeros(0, dtype=numpy.int64)
+        self.genre_columns = {}
+        self.genres = numpy.zeros((0, 0), dtype=numpy.float32)
+        self.scores = numpy.zeros((0, 2), dtype=numpy.float32)
+        self.norms = numpy.zeros(0, dtype=numpy.float32)
+        self.alive = numpy.zeros(0, dtype=bool)
+        self.neighbours = numpy.zeros((0, neighbours), dtype=numpy.int32)
+        self.neighbour_scores = numpy.zeros((0, neighbours), dtype=numpy.float32)
+        # Change feed number applied last
+        self.sequence = None
+
+    # Vectors
+
+    def set_movies(self, rows, genres):
+        # Adds or replaces the vectors of movies, returns the rows of those
+        # that are new or changed
+        new_ids = [row[0] for row in rows if row[0] not in self.rows]
+        new_genres = set(genre_id for movie_id, _, _, _ in rows for genre_id in genres[movie_id])
+        new_genres.difference_update(self.genre_columns)
+        if new_genres:
+            for genre_id in sorted(new_genres):
+                self.genre_columns[genre_id] = len(self.genre_columns)
+            self.genres = numpy.hstack([self.genres, numpy.zeros(
+                (len(self.ids), len(new_genres)), dtype=numpy.float32)])
+        if new_ids:
+            count = len(new_ids)
+            for row, movie_id in enumerate(new_ids, len(self.ids)):
+                self.rows[movie_id] = row
+            self.ids = numpy.concatenate([self.ids, numpy.array(new_ids, dtype=numpy.int64)])
+            self.directors = numpy.concatenate([self.directors, numpy.zeros(count, dtype=numpy.int64)])
+            self.genres = numpy.vstack([self.genres, numpy.zeros(
+                (count, len(self.genre_columns)), dtype=numpy.float32)])
+            self.scores = numpy.vstack([self.scores, numpy.zeros((count, 2), dtype=numpy.float32)])
+            self.norms = numpy.concatenate([self.norms, numpy.ones(count, dtype=numpy.float32)])
+            self.alive = numpy.concatenate([self.alive, numpy.zeros(count, dtype=bool)])
+            self.neighbours = numpy.vstack([self.neighbours, numpy.full(
+                (count, self.neighbours_count), -1, dtype=numpy.int32)])
+            self.neighbour_scores = numpy.vstack([self.neighbour_scores, numpy.full(
+                (count, self.neighbours_count), -numpy.inf, dtype=numpy.float32)])
+        changed = []
+        for movie_id, director_id, imdb_score, popularity in rows:
+            row = self.rows[movie_id]
+            movie_genres = numpy.zeros(len(self.genre_columns), dtype=numpy.float32)
+            movie_genres[[self.genre_columns[genre_id] for genre_id in genres[movie_id]]] = GENRE_WEIGHT
+            scores = numpy.array((imdb_score / 10.0 * SCORE_WEIGHT, popularity / 100.0 * SCORE_WEIGHT),
+                                 dtype=numpy.float32)
+            if (self.alive[row] and self.directors[row] == director_id and
+                    numpy.array_equal(self.genres[row], movie_genres) and numpy.array_equal(self.scores[row], scores)):
+                continue
+            changed.append(row)
+            self.directors[row] = director_id
+            self.genres[row] = movie_genres
+            self.scores[row] = scores
+            self.norms[row] = numpy.sqrt(numpy.dot(movie_genres, movie_genres) + DIRECTOR_WEIGHT ** 2 +
+                                         numpy.dot(scores, scores))
+            self.alive[row] = True
+        return numpy.array(changed, dtype=numpy.int32)
+
+    def delete_movies(self, movie_ids):
+        rows = [self.rows.pop(movie_id) for movie_id in movie_ids if movie_id in self.rows]
+        self.alive[rows] = False
+        return numpy.array(rows, dtype=numpy.int32)
+
+    def block_size(self):
+        return int(max(1, min(MAX_BLOCK_SIZE, BLOCK_FLOATS // max(len(self.ids), 1))))
+
+    def similarities(self, rows):
+        # Cosine similarity of rows with every row, -inf for themselves and
+        # deleted rows. float32, computed in place in one block sized array
+        similarities = self.genres[rows].dot(self.genres.T)
+        similarities += self.scores[rows].dot(self.scores.T)
+        similarities[self.directors[rows][:, None] == self.directors[None, :]] += numpy.float32(DIRECTOR_WEIGHT ** 2)
+        similarities /= self.norms[rows][:, None]
+        similarities /= self.norms[None, :]
+        similarities[:, ~self.alive] = -numpy.inf
+        similarities[numpy.arange(len(rows)), rows] = -numpy.inf
+        return similarities
+
+    # Neighbours
+
+    def top(self, candidates, scores):
+        # The neighbours_count best candidates of each row, best first
+        count = min(self.neighbours_count, scores.shape[1])
+        best = numpy.argpartition(-scores, count - 1, axis=1)[:, :count]
+        candidates = numpy.take_along_axis(candidates, best, axis=1)
+        scores = numpy.take_along_axis(scores, best, axis=1)
+        order = numpy.lexsort((candidates, -scores))
+        candidates = numpy.take_along_axis(candidates, order, axis=1)
+        scores = numpy.take_along_axis(scores, order, axis=1)
+        candidates[numpy.isneginf(scores)] = -1
+        missing = self.neighbours_count - count
+        if missing:
+            candidates = numpy.hstack([candidates, numpy.full((len(candidates), missing), -1, dtype=numpy.int32)])
+            scores = numpy.hstack([scores, numpy.full((len(scores), missing), -numpy.inf, dtype=numpy.float32)])
+        return candidates, scores
+
+    def compute_neighbours(self, rows):
+        all_rows = numpy.arange(len(self.ids), dtype=numpy.int32)
+        block_size = self.block_size()
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+            similarities = self.similarities(block)
+            candidates = numpy.broadcast_to(all_rows, similarities.shape)
+            self.neighbours[block], self.neighbour_scores[block] = self.top(candidates, similarities)
+
+    def update_neighbours(self, changed):
+
+        """
+            Neighbours after the movies of the changed rows were added,
+            updated or deleted
+            * Rows of changed movies, and rows which had one of them as
+              neighbour, are computed again
+            * Other rows only compare their neighbours with the changed
+              movies. Similarity is symmetric, so that is a block of
+              changed rows against every row
+        """
+
+        alive_rows = numpy.flatnonzero(self.alive).astype(numpy.int32)
+        if len(changed) > REBUILD_RATIO * len(alive_rows):
+            self.compute_neighbours(alive_rows)
+            return
+        recompute = numpy.isin(self.neighbours, changed).any(axis=1)
+        recompute[changed] = True
+        recompute &= self.alive
+        self.compute_neighbours(numpy.flatnonzero(recompute).astype(numpy.int32))
+        others = numpy.flatnonzero(self.alive & ~recompute)
+        changed = changed[self.alive[changed]]
+        if not len(others) or not len(changed):
+            return
+        block_size = self.block_size()
+        for start in range(0, len(changed), block_size):
+            block = changed[start:start + block_size]
+            similarities = self.similarities(block)[:, others].T
+            # Only rows where a changed movie beats the last neighbour
+            closer = (similarities > self.neighbour_scores[others, -1][:, None]).any(axis=1)
+            rows, similarities = others[closer], similarities[closer]
+            candidates = numpy.hstack([self.neighbours[rows], numpy.broadcast_to(block, similarities.shape)])
+            scores = numpy.hstack([self.neighbour_scores[rows], similarities])
+            self.neighbours[rows], self.neighbour_scores[rows] = self.top(candidates, scores)
+
+    # Loading and syncing
+
+    def build(self):
+        changes.require_shared_cache('The similarity index')
+        self.reset(similarity_options()['NEIGHBOURS'])
+        # Taken before reading, writes made meanwhile are applied again
+        self.sequence = changes.sequence()
+        rows, genres = read_movies()
+        self.compute_neighbours(self.set_movies(rows, genres))
+
+    def sync(self):
+        # Applies the movies of the change feed since the last sync, or
+        # compares every movie with the index when the feed cannot tell.
+        # Late commits are in the feed whatever their updated_at
+        if self.sequence is None:
+            sequence, movie_ids = changes.sequence(), changes.RELOAD
+        else:
+            sequence, movie_ids = changes.changes_since(self.sequence)
+        if movie_ids == changes.RELOAD:
+            rows, genres = read_movies()
+            deleted = set(self.rows).difference(genres)
+        else:
+            rows, genres = read_movies(movie_ids)
+            deleted = set(movie_ids).difference(genres)
+        changed = numpy.concatenate([self.set_movies(rows, genres), self.delete_movies(deleted)])
+        self.sequence = sequence
+        if len(changed) > SYNC_ROWS:
+            return False
+        if len(changed):
+            self.update_neighbours(changed)
+        return True
+
+    def ensure_loaded(self):
+        # Read first, writes made while syncing are applied by the next lookup
+        version = catalogue_version()
+        if self.loaded and version == self.version:
+            return
+        if not self.loaded:
+            index_file = similarity_options()['INDEX_FILE']
+            if not index_file or not os.path.exists(index_file):
+                raise IndexUnavailable()
+            index_state = (index_file, os.path.getmtime(index_file))
+            if index_state == self.stale_file:
+                raise IndexUnavailable()
+            changes.require_shared_cache('The similarity index')
+            if not self.load(index_file):
+                self.stale_file = index_state
+                raise IndexUnavailable()
+            self.index_state = index_state
+            self.loaded = True
+        if not self.sync():
+            # Too many changes to apply here, wait for a new file
+            self.loaded = False
+            self.stale_file = self.index_state
+            raise IndexUnavailable()
+        self.version = version
+
+    def similar(self, movie_id, limit=None):
+        """
+            Returns [(movie id, similarity)] of the movies most similar to
+            movie_id, best first, None if there is no such movie
+            * Raises IndexUnavailable when there is no usable index file
+        """
+        with self.lock:
+            self.ensure_loaded()
+            row = self.rows.get(movie_id)
+            if row is None:
+                return None
+            neighbours = self.neighbours[row]
+            scores = self.neighbour_scores[row]
+            similar = [(int(self.ids[neighbour]), float(score)) for neighbour, score in zip(neighbours, scores)
+                       if neighbour >= 0 and self.alive[neighbour]]
+        return similar[:limit]
+
+    # Index file
+
+    arrays = ('ids', 'directors', 'genres', 'scores', 'norms', 'alive', 'neighbours', 'neighbour_scores')
+
+    def save(self, index_file):
+        # Written next to index_file and renamed, readers never see half a file
+        genre_ids = sorted(self.genre_columns, key=self.genre_columns.get)
+        descriptor, path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(index_file)))
+        with os.fdopen(descriptor, 'wb') as temporary_file:
+            numpy.savez(temporary_file, genre_ids=numpy.array(genre_ids, dtype=numpy.int64),
+                        sequence=numpy.array(-1 if self.sequence is None else self.sequence, dtype=numpy.int64),
+                        **dict((name, getattr(self, name)) for name in self.arrays))
+        os.rename(path, index_file)
+
+    def load(self, index_file):
+        # False when the file was built for another number of neighbours
+        data = numpy.load(index_file)
+        neighbours = data['neighbours']
+        if neighbours.shape[1] != similarity_options()['NEIGHBOURS']:
+            return False
+        self.reset(neighbours.shape[1])
+        for name in self.arrays:
+            setattr(self, name, data[name])
+        self.genre_columns = dict((int(genre_id), column) for column, genre_id in enumerate(data['genre_ids']))
+        self.rows = dict((int(movie_id), row) for row, movie_id in enumerate(self.ids) if self.alive[row])
+        sequence = int(data['sequence'])
+        self.sequence = None if sequence < 0 else sequence
+        return True
+
+
+similarity_index = SimilarityIndex()
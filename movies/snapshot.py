@@ -0,0 +1,286 @@
+"""
+    In process copy of the catalogue answering movie listings without the
+    database (settings.MOVIES_SNAPSHOT)
+    * Movies are parallel arrays by row: id, name, imdb_score, popularity,
+      director id and name. Directors and genres are interned, each genre
+      keeps the set of its rows
+    * Rows of every sort field are kept sorted (by value, then id), so a
+      single sort is a walk of that permutation keeping the rows of the
+      filters (movies.filters masks). Several sort keys are sorted with
+      the ranks of each field
+    * Refreshed from the change feed (movies.changes) before answering:
+      only the written movies are read again. The feed only reaches the
+      other processes through a shared cache backend (settings), with a
+      process local cache a snapshot never sees the other processes'
+      writes
+    * Names are compared by code point in Python. The snapshot is only
+      used when the database compares them the same way (SQLite,
+      PostgreSQL "C" collation), otherwise listings use the database
+"""
+import threading
+from collections import OrderedDict
+
+import numpy
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from . import changes
+from .filters import MovieFilters
+from .models import Movie
+from .names import in_batches, code_point_collation
+
+# Above this number of changed movies the sorted rows are sorted again
+RESORT_SIZE = 100
+
+
+def snapshot_enabled():
+    return getattr(settings, 'MOVIES_SNAPSHOT', False)
+
+
+def object_array(values):
+    # numpy.array would make a fixed width string array
+    array = numpy.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+class MovieSnapshot(object):
+
+    """
+        Arrays of the movies, their sorted rows and the interned
+        directors and genres
+        * Rows of deleted movies stay, marked as not alive
+    """
+
+    sort_fields = ('id', 'name', 'director__name', 'imdb_score', 'popularity')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.loaded = False
+        self.usable = None
+        self.sequence = None
+
+    # Loading and refreshing
+
+    def read_movies(self, movie_ids=None):
+        # From the primary, a replica behind would be kept as current
+        movies = Movie.objects.using(DEFAULT_DB_ALIAS).values_list(
+            'id', 'name', 'imdb_score', 'popularity', 'director_id', 'director__name', 'director__name_key')
+        links = Movie.genre.through.objects.using(DEFAULT_DB_ALIAS).values_list(
+            'movie_id', 'genre_id', 'genre__name', 'genre__name_key')
+        if movie_ids is None:
+            return list(movies.order_by('id')), list(links)
+        rows, genre_links = [], []
+        for batch in in_batches(movie_ids):
+            rows.extend(movies.filter(id__in=batch))
+            genre_links.extend(links.filter(movie_id__in=batch))
+        return rows, genre_links
+
+    def load(self):
+        self.sequence = changes.sequence()
+        self.ids = numpy.zeros(0, dtype=numpy.int64)
+        self.rows = {}
+        self.alive = numpy.zeros(0, dtype=bool)
+        self.columns = {'id': self.ids}
+        self.movie_genres = []
+        self.genre_rows = {}
+        self.genre_names = {}
+        self.genre_keys = {}
+        self.director_keys = {}
+        self.key_of = {}
+        self.set_movies(*self.read_movies())
+        self.sort()
+        self.loaded = True
+
+    def refresh(self):
+        # Applies the feed, True when the snapshot can answer
+        if self.usable is None:
+            self.usable = code_point_collation(connections[DEFAULT_DB_ALIAS])
+        if not self.usable:
+            return False
+        if not self.loaded:
+            self.load()
+            return True
+        self.sequence, changed = changes.changes_since(self.sequence)
+        if changed == changes.RELOAD:
+            self.load()
+        elif changed:
+            rows, links = self.read_movies(changed)
+            deleted_rows = self.delete_movies(set(changed) - set(row[0] for row in rows))
+            changed_rows = self.set_movies(rows, links)
+            if len(changed) > RESORT_SIZE:
+                self.sort()
+            else:
+                self.resort(numpy.concatenate([changed_rows, deleted_rows]))
+        return True
+
+    def intern(self, keys, kind, item_id, key):
+        # Name key -> id, dropping the old key of a renamed director or genre
+        old_key = self.key_of.get((kind, item_id))
+        if old_key != key and keys.get(old_key) == item_id:
+            del keys[old_key]
+        keys[key] = item_id
+        self.key_of[kind, item_id] = key
+
+    def set_movies(self, rows, links):
+        # Adds or replaces movies, returns their rows
+        new_ids = [row[0] for row in rows if row[0] not in self.rows]
+        if new_ids:
+            for row, movie_id in enumerate(new_ids, len(self.ids)):
+                self.rows[movie_id] = row
+            count = len(new_ids)
+            self.ids = numpy.concatenate([self.ids, numpy.array(new_ids, dtype=numpy.int64)])
+            self.alive = numpy.concatenate([self.alive, numpy.zeros(count, dtype=bool)])
+            columns = {'id': self.ids}
+            for field, empty in (('name', object_array([u''] * count)), ('director__name', object_array([u''] * count)),
+                                 ('imdb_score', numpy.zeros(count)), ('popularity', numpy.zeros(count)),
+                                 ('director_id', numpy.zeros(count, dtype=numpy.int64))):
+                columns[field] = numpy.concatenate([self.columns[field], empty]) if field in self.columns else empty
+            self.columns = columns
+            self.movie_genres.extend([()] * count)
+        changed = []
+        for movie_id, name, imdb_score, popularity, director_id, director_name, director_key in rows:
+            row = self.rows[movie_id]
+            changed.append(row)
+            self.alive[row] = True
+            self.columns['name'][row] = name
+            self.columns['imdb_score'][row] = imdb_score
+            self.columns['popularity'][row] = popularity
+            self.columns['director_id'][row] = director_id
+            self.columns['director__name'][row] = director_name
+            self.intern(self.director_keys, 'director', director_id, director_key)
+            self.set_genres(row, ())
+        genres = {}
+        for movie_id, genre_id, genre_name, genre_key in links:
+            genres.setdefault(movie_id, []).append(genre_id)
+            self.genre_names[genre_id] = genre_name
+            self.intern(self.genre_keys, 'genre', genre_id, genre_key)
+        for movie_id, genre_ids in genres.items():
+            self.set_genres(self.rows[movie_id], genre_ids)
+        return numpy.array(changed, dtype=numpy.int64)
+
+    def set_genres(self, row, genre_ids):
+        for genre_id in self.movie_genres[row]:
+            self.genre_rows[genre_id].discard(row)
+        self.movie_genres[row] = tuple(genre_ids)
+        for genre_id in genre_ids:
+            self.genre_rows.setdefault(genre_id, set()).add(row)
+
+    def delete_movies(self, movie_ids):
+        # Marks the movies deleted, returns their rows
+        deleted = []
+        for movie_id in movie_ids:
+            row = self.rows.pop(movie_id, None)
+            if row is not None:
+                deleted.append(row)
+                self.alive[row] = False
+                self.set_genres(row, ())
+        return numpy.array(deleted, dtype=numpy.int64)
+
+    # Sorted rows
+
+    def sorted_rows(self, field, rows):
+        # rows ordered by the field's value, then id
+        values = self.columns[field][rows]
+        if values.dtype == object:
+            order = sorted(range(len(rows)), key=lambda index: (values[index], self.ids[rows[index]]))
+            return rows[numpy.array(order, dtype=numpy.int64)]
+        return rows[numpy.lexsort((self.ids[rows], values))]
+
+    def sort(self):
+        alive_rows = numpy.flatnonzero(self.alive)
+        self.permutations = dict((field, self.sorted_rows(field, alive_rows)) for field in self.sort_fields)
+        self.ranks = {}
+
+    def resort(self, changed_rows):
+        # Moves the changed rows to their place in each sorted field
+        for field in self.sort_fields:
+            values = self.columns[field]
+            permutation = self.permutations[field]
+            permutation = permutation[~numpy.isin(permutation, changed_rows)]
+            inserted = self.sorted_rows(field, changed_rows[self.alive[changed_rows]])
+            sorted_values, sorted_ids = values[permutation], self.ids[permutation]
+            positions = []
+            for row in inserted:
+                # Among equal values, before the first larger id
+                start = numpy.searchsorted(sorted_values, values[row], 'left')
+                end = numpy.searchsorted(sorted_values, values[row], 'right')
+                positions.append(start + numpy.searchsorted(sorted_ids[start:end], self.ids[row]))
+            self.permutations[field] = numpy.insert(permutation, positions, inserted)
+        self.ranks = {}
+
+    def rank(self, field):
+        # Position of each row's value among the sorted values, equal values share it
+        if field not in self.ranks:
+            permutation = self.permutations[field]
+            values = self.columns[field][permutation]
+            ranks = numpy.zeros(len(self.ids), dtype=numpy.int64)
+            if len(permutation):
+                ranks[permutation] = numpy.concatenate([[0], numpy.cumsum(
+                    (values[1:] != values[:-1]).astype(numpy.int64))])
+            self.ranks[field] = ranks
+        return self.ranks[field]
+
+    # Listings
+
+    def select(self, ordering, request=None):
+        # Rows of the movies (filtered by request's params) in the order of
+        # the sort fields, then id
+        mask = self.alive if request is None else MovieFilters().filter_mask(request, self)
+        keys = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        if len(keys) <= 1:
+            field, descending = keys[0] if keys else ('id', False)
+            permutation = self.permutations[field]
+            if descending:
+                permutation = permutation[::-1]
+            return permutation[mask[permutation]]
+        rows = self.permutations['id'][mask[self.permutations['id']]]
+        sort_keys = [-self.ids[rows] if keys[-1][1] else self.ids[rows]]
+        for field, descending in reversed(keys):
+            ranks = self.rank(field)[rows]
+            sort_keys.append(-ranks if descending else ranks)
+        return rows[numpy.lexsort(sort_keys)]
+
+    def after(self, rows, ordering, position):
+        # Rows following the cursor position, as MovieCursorPagination filters them
+        keys = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        keys.append(('id', bool(keys) and keys[-1][1]))
+        values = position['values'] + [position['id']]
+        after = None
+        for (field, descending), value in reversed(zip(keys, values)):
+            column = self.columns[field][rows]
+            later = numpy.asarray(column < value if descending else column > value, dtype=bool)
+            if after is not None:
+                later |= numpy.asarray(column == value, dtype=bool) & after
+            after = later
+        return rows[after]
+
+    def list_rows(self, rows):
+        # Same dicts as Movie.objects.list_rows()
+        return [{'id': int(self.ids[row]), 'name': self.columns['name'][row],
+                 'imdb_score': float(self.columns['imdb_score'][row]),
+                 'popularity': float(self.columns['popularity'][row]),
+                 'director__name': self.columns['director__name'][row]} for row in rows]
+
+    def movie_list_data(self, rows):
+        # Same data as movies.serializers.movie_list_data
+        return [OrderedDict((('director', movie['director__name']),
+                             ('genre', sorted(self.genre_names[genre_id]
+                                              for genre_id in self.movie_genres[self.rows[movie['id']]])),
+                             ('name', movie['name']),
+                             ('imdb_score', movie['imdb_score']),
+                             ('popularity', movie['popularity'])))
+                for movie in rows]
+
+    def genre_mask(self, key):
+        mask = numpy.zeros(len(self.ids), dtype=bool)
+        rows = self.genre_rows.get(self.genre_keys.get(key), ())
+        if rows:
+            mask[list(rows)] = True
+        return mask
+
+
+movie_snapshot = MovieSnapshot()
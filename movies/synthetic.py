@@ -0,0 +1,129 @@
+"""
+    Synthetic catalogues for benchmarks, as movies in the imdb.json schema
+    * Genres, their popularity and the number of genres per movie follow
+      imdb.json. Directors have a long tail: most make one or two movies,
+      a few make dozens (a new director for DIRECTOR_RATIO of the movies,
+      else one of the previous ones in proportion of their movies)
+    * imdb_score is normally distributed like in imdb.json, popularity
+      follows the score (imdb.json popularity is close to imdb_score * 10)
+    * Names are made of words, repeated names become sequels
+      ("Silent River 2"), so every name is unique
+    * The same count and seed give the same catalogue
+"""
+import os
+import math
+import random
+from bisect import bisect
+from collections import Counter
+
+from django.conf import settings
+
+from .readers import read_movies
+
+# Share of movies made by a new director, and most movies of a director
+DIRECTOR_RATIO = 0.3
+MAX_DIRECTOR_MOVIES = 60
+
+ADJECTIVES = (
+    'Silent', 'Dark', 'Golden', 'Lost', 'Broken', 'Hidden', 'Last', 'Wild', 'Red', 'Frozen', 'Secret',
+    'Burning', 'Distant', 'Empty', 'Little', 'Great', 'Bitter', 'Crimson', 'Quiet', 'Final', 'Long',
+    'Midnight', 'Iron', 'Eternal', 'Fallen', 'Shining', 'Savage', 'Pale', 'Sweet', 'Cold')
+NOUNS = (
+    'River', 'Night', 'City', 'Road', 'Heart', 'Shadow', 'Kingdom', 'Garden', 'Storm', 'Island', 'Dream',
+    'Summer', 'Empire', 'Mountain', 'Game', 'Voyage', 'Star', 'House', 'Sea', 'Winter', 'Machine',
+    'Horizon', 'Witness', 'Stranger', 'Journey', 'Frontier', 'Promise', 'Harbor', 'Legend', 'Fire',
+    'Desert', 'Angel', 'Station', 'Bridge', 'Crown', 'Forest', 'Letter', 'Hunter', 'Window', 'Planet')
+FIRST_NAMES = (
+    'John', 'Mary', 'Akira', 'Ingrid', 'Pedro', 'Agnes', 'Satyajit', 'Sofia', 'Werner', 'Claire',
+    'Luis', 'Kathryn', 'Fritz', 'Jane', 'Michael', 'Nora', 'Yasujiro', 'Greta', 'Sergio', 'Lucia',
+    'David', 'Chantal', 'Billy', 'Ava', 'Federico', 'Elaine', 'Wong', 'Alice', 'Hayao', 'Ida')
+LAST_NAMES = (
+    'Ford', 'Kurosawa', 'Bergman', 'Almodovar', 'Varda', 'Ray', 'Coppola', 'Herzog', 'Denis', 'Bunuel',
+    'Bigelow', 'Lang', 'Campion', 'Mann', 'Ephron', 'Ozu', 'Gerwig', 'Leone', 'Martel', 'Lynch',
+    'Akerman', 'Wilder', 'DuVernay', 'Fellini', 'May', 'Kar-wai', 'Guy', 'Miyazaki', 'Lupino', 'Reed')
+
+
+def catalogue_model(file_path=None):
+
+    """
+        Distributions read from imdb.json: genre weights, weights of the
+        number of genres per movie, mean and deviation of imdb_score
+    """
+
+    file_path = file_path or os.path.join(settings.BASE_DIR, 'imdb.json')
+    genres, genre_counts, scores = Counter(), Counter(), []
+    with open(file_path, 'rb') as data_file:
+        for movie in read_movies(data_file):
+            genres.update(set(movie['genre']))
+            genre_counts[len(set(movie['genre']))] += 1
+            scores.append(movie['imdb_score'])
+    mean = sum(scores) / len(scores)
+    deviation = math.sqrt(sum((score - mean) ** 2 for score in scores) / len(scores))
+    return sorted(genres.items()), sorted(genre_counts.items()), mean, deviation
+
+
+def weighted(items):
+    # Returns a function drawing an item of (item, weight) pairs
+    values, cumulative, total = [], [], 0.0
+    for value, weight in items:
+        total += weight
+        values.append(value)
+        cumulative.append(total)
+    return lambda generator: values[min(bisect(cumulative, generator.random() * total), len(values) - 1)]
+
+
+def director_name(index):
+    name = '%s %s' % (FIRST_NAMES[index % len(FIRST_NAMES)],
+                      LAST_NAMES[index // len(FIRST_NAMES) % len(LAST_NAMES)])
+    combinations = len(FIRST_NAMES) * len(LAST_NAMES)
+    if index >= combinations:
+        # Middle initials, then numbers once they run out
+        initial = index // combinations - 1
+        name = name.replace(' ', ' %s. ' % chr(ord('A') + initial % 26), 1)
+        if initial >= 26:
+            name += ' %d' % (initial // 26 + 1)
+    return name
+
+
+def synthetic_movies(count, seed=0, model=None):
+
+    """
+        Yields count movies in the imdb.json schema
+        * model: distributions of catalogue_model(), read from imdb.json
+          when not given
+    """
+
+    generator = random.Random(seed)
+    genres, genre_counts, mean, deviation = model or catalogue_model()
+    draw_genre = weighted(genres)
+    draw_genre_count = weighted(genre_counts)
+    # One entry per movie of each director, drawing one picks a director
+    # in proportion of their movies
+    credits, director_movies = [], []
+    names = Counter()
+    for index in range(count):
+        name = '%s %s' % (generator.choice(ADJECTIVES), generator.choice(NOUNS))
+        if generator.random() < 0.3:
+            name = 'The ' + name
+        if generator.random() < 0.5:
+            name += ' of the %s' % generator.choice(NOUNS)
+        names[name] += 1
+        if names[name] > 1:
+            name += ' %d' % names[name]
+        movie_genres = set()
+        for i in range(min(draw_genre_count(generator), len(genres))):
+            while True:
+                genre = draw_genre(generator)
+                if genre not in movie_genres:
+                    movie_genres.add(genre)
+                    break
+        imdb_score = round(min(max(generator.gauss(mean, deviation), 1.0), 10.0), 1)
+        popularity = round(min(max(imdb_score * 10 + generator.gauss(0, 5), 0.0), 100.0), 1)
+        director = generator.choice(credits) if credits and generator.random() >= DIRECTOR_RATIO else None
+        if director is None or director_movies[director] >= MAX_DIRECTOR_MOVIES:
+            director = len(director_movies)
+            director_movies.append(0)
+        director_movies[director] += 1
+        credits.append(director)
+        yield {'99popularity': popularity, 'director': director_name(director),
+               'genre': sorted(movie_genres), 'imdb_score': imdb_score, 'name': name}
@@ -1,3 +1,1836 @@
-from django.test import TestCase
+import os
+import json
+import base64
+import time
+import random
+import tempfile
+from datetime import timedelta
+from collections import Counter, OrderedDict
+from importlib import import_module
+from unittest import skipUnless
 
-# Create your tests here.
+import requests
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.db import connection, connections, transaction, IntegrityError
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APIRequestFactory
+
+from app_user.models import AppUser
+
+from .models import Movie, Genre, Director, FacetCount, director_resolver, genre_resolver
+from .serializers import MovieListSerializer, movie_list_data
+from .readers import iter_json_values, read_movies, read_csv_movies
+from .export import iter_movies
+from .pagination import MovieCursorPagination
+from .similarity import SimilarityIndex, similarity_index
+from .snapshot import movie_snapshot
+from . import changes, similarity, cache as cache_module
+from .facets import rebuild_facets
+from .filters import MovieFilters, MovieSort
+from .names import code_point_collation
+from .remote import RemoteLoader
+from .views import BulkMovies
+from .cache import response_cache
+from movies_for_all.lru import LRUCache
+from movies_for_all.metrics import request_metrics
+from movies_for_all import routers
+
+
+def create_movie(name, director, genres, imdb_score=7.5, popularity=75.0):
+    director = Director.objects.get_or_create(name=director)[0]
+    movie = Movie.objects.create(name=name, director=director,
+                                 imdb_score=imdb_score, popularity=popularity)
+    for genre_name in genres:
+        movie.genre.add(Genre.objects.get_or_create(name=genre_name)[0])
+    return movie
+
+
+class MovieTestCase(TestCase):
+
+    """
+        Base test case with a logged in user
+    """
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        self.user = AppUser.objects.create_user(
+            username='user', email='user@example.com', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+
+class AdminMovieTestCase(TestCase):
+
+    """
+        Base test case with a logged in admin
+    """
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        self.user = AppUser.objects.create_user(
+            username='admin', email='admin@example.com', password='password', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+
+class MovieListQueryCountTest(MovieTestCase):
+
+    """
+        Listing a page must cost the same number of queries
+        regardless of the page size
+    """
+
+    def setUp(self):
+        super(MovieListQueryCountTest, self).setUp()
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        for index in range(page_size + 5):
+            create_movie('Movie %02d' % index, 'Director %d' % (index % 3),
+                         ['Drama', 'Genre %d' % (index % 4)])
+
+    def test_list_query_count(self):
+        # count, page, genres
+        with self.assertNumQueries(3):
+            response = self.client.get('/movies/list/', {'sort': 'director_name'})
+        self.assertEqual(len(response.data['movies']), settings.REST_FRAMEWORK['PAGE_SIZE'])
+        self.assertEqual(response.data['count'], Movie.objects.count())
+        # count is cached for every page and sort
+        with self.assertNumQueries(2):
+            response = self.client.get('/movies/list/', {'page': 2})
+        self.assertEqual(len(response.data['movies']), 5)
+
+    def test_search_query_count(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/movies/search/', {'keyword': 'drama', 'type': 'genre'})
+        self.assertEqual(len(response.data['movies']), settings.REST_FRAMEWORK['PAGE_SIZE'])
+        self.assertEqual(response.data['count'], Movie.objects.count())
+        with self.assertNumQueries(3):
+            response = self.client.get('/movies/search/', {'keyword': 'genre 1', 'type': 'genre'})
+        self.assertEqual(response.data['count'], 4)
+
+    def test_count_invalidation(self):
+        self.client.get('/movies/list/')
+        create_movie('New movie', 'Director 1', ['Drama'])
+        response = self.client.get('/movies/list/')
+        self.assertEqual(response.data['count'], Movie.objects.count())
+        Movie.objects.get(name='New movie').delete()
+        response = self.client.get('/movies/list/')
+        self.assertEqual(response.data['count'], Movie.objects.count())
+
+    def test_detail_query_count(self):
+        movie = Movie.objects.get(name='Movie 01')
+        with self.assertNumQueries(2):
+            response = self.client.get('/movies/%d/view/' % movie.pk)
+        self.assertEqual(response.data['movie']['director'], 'Director 1')
+        self.assertEqual(sorted(response.data['movie']['genre']), ['Drama', 'Genre 1'])
+
+
+class MovieListDataTest(MovieTestCase):
+
+    """
+        The listing fast path renders the same bytes as MovieListSerializer
+    """
+
+    def setUp(self):
+        super(MovieListDataTest, self).setUp()
+        # Mixed case genres, sorted by the database collation on every path
+        create_movie(u'Am\xe9lie', u'Jean-Pierre Jeunet', ['Romance', 'comedy', u'\xc9pique'], 8.3, 83.0)
+        create_movie('Star Wars', 'George Lucas', ['Sci-Fi', 'Action', 'Adventure'], 8.7, 87.5)
+        create_movie('Nothing', 'Nobody', [], 1, 0)
+
+    def test_same_output(self):
+        queryset = Movie.objects.with_relations().order_by('name')
+        expected = JSONRenderer().render(MovieListSerializer(queryset, many=True).data)
+        data = movie_list_data(list(queryset.list_rows()))
+        self.assertEqual(JSONRenderer().render(data), expected)
+        response = self.client.get('/movies/list/', {'sort': 'name'})
+        self.assertEqual(response.content, JSONRenderer().render(
+            {'status': 1, 'count': 3, 'movies': json.loads(expected, object_pairs_hook=OrderedDict)}))
+
+    def test_search_and_cursor(self):
+        for params in ({'q': 'lucas'}, {'keyword': 'com', 'type': 'genre'},
+                       {'pagination': 'cursor', 'sort': 'director_name'}):
+            response = self.client.get('/movies/search/', params)
+            self.assertEqual(response.status_code, 200)
+            for movie in response.data['movies']:
+                expected = MovieListSerializer(Movie.objects.with_relations().get(name=movie['name'])).data
+                self.assertEqual(movie, expected)
+
+
+class FullTextSearchTest(MovieTestCase):
+
+    """
+        Ranked search across name, director and genres
+    """
+
+    def setUp(self):
+        super(FullTextSearchTest, self).setUp()
+        create_movie('Star Wars', 'George Lucas', ['Action', 'Sci-Fi'])
+        create_movie('American Graffiti', 'George Lucas', ['Comedy', 'Drama'])
+        create_movie('Star Trek', 'J.J. Abrams', ['Sci-Fi', 'Star'])
+        create_movie('Psycho', 'Alfred Hitchcock', ['Horror', 'Thriller'])
+
+    def search(self, **params):
+        response = self.client.get('/movies/search/', params)
+        return [movie['name'] for movie in response.data['movies']]
+
+    def test_all_fields(self):
+        self.assertEqual(self.search(keyword='lucas', type='all', sort='name'),
+                         ['American Graffiti', 'Star Wars'])
+        self.assertEqual(self.search(q='george sci-fi'), ['Star Wars'])
+        self.assertEqual(self.search(q='"hitchcock'), ['Psycho'])
+        self.assertEqual(self.search(q='nothing'), [])
+
+    def test_ranking(self):
+        # Star Trek matches star twice
+        self.assertEqual(self.search(q='star'), ['Star Trek', 'Star Wars'])
+
+    def test_equal_ranks_paged(self):
+        # Documents of the same length, same rank: each movie is on
+        # exactly one page, in the order they were created
+        names = ['Saga %02d' % index for index in range(25)]
+        for name in names:
+            create_movie(name, 'Saga Director', ['Saga'])
+        paged = []
+        for page in (1, 2, 3):
+            paged.extend(self.search(q='saga', page=page))
+        self.assertEqual(paged, names)
+
+    def test_incremental_update(self):
+        movie = Movie.objects.get(name='Psycho')
+        movie.genre.add(Genre.objects.get(name='Sci-Fi'))
+        self.assertEqual(self.search(q='hitchcock sci-fi'), ['Psycho'])
+        movie.genre.remove(Genre.objects.get(name='Sci-Fi'))
+        self.assertEqual(self.search(q='hitchcock sci-fi'), [])
+        director = movie.director
+        director.name = 'Hitch'
+        director.save()
+        self.assertEqual(self.search(q='hitch'), ['Psycho'])
+        movie.delete()
+        self.assertEqual(self.search(q='hitch'), [])
+
+    def test_deleted_genre(self):
+        movie = Movie.objects.get(name='Psycho')
+        updated_at = movie.updated_at
+        Genre.objects.get(name='Thriller').delete()
+        self.assertEqual(self.search(q='thriller'), [])
+        self.assertEqual(self.search(q='horror'), ['Psycho'])
+        self.assertGreater(Movie.objects.get(name='Psycho').updated_at, updated_at)
+
+    def test_save_queries(self):
+        movie = Movie.objects.get(name='Psycho')
+        movie.imdb_score = 9
+        # Same name and director: the document is kept without reading names
+        with CaptureQueriesContext(connection) as queries:
+            movie.save()
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'movies_genre' in query['sql'] or 'movies_director' in query['sql']])
+        self.assertEqual(Movie.objects.get(pk=movie.pk).search_document,
+                         'Psycho Alfred Hitchcock Horror Thriller')
+        movie.name = 'Psycho II'
+        movie.save()
+        self.assertEqual(self.search(q='psycho thriller'), ['Psycho II'])
+        movie.director = Director.objects.get(name='George Lucas')
+        movie.save()
+        self.assertEqual(self.search(q='lucas thriller'), ['Psycho II'])
+
+
+class SearchIndexTest(TestCase):
+
+    """
+        Sort and search columns are indexed
+    """
+
+    def indexed_columns(self, table):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+        return [tuple(constraint['columns']) for constraint in constraints.values()
+                if constraint['index']]
+
+    def test_indexes(self):
+        self.assertIn(('name',), self.indexed_columns('movies_movie'))
+        self.assertIn(('imdb_score',), self.indexed_columns('movies_movie'))
+        self.assertIn(('name',), self.indexed_columns('movies_director'))
+
+
+class LoadMoviesDirectTest(TestCase):
+
+    """
+        load_movies --direct inserts imdb.json through the ORM in batches
+    """
+
+    def test_load_direct(self):
+        file_path = os.path.join(settings.BASE_DIR, 'imdb.json')
+        call_command('load_movies', file_path, direct=True, batch_size=50, stdout=StringIO())
+        self.assertEqual(Movie.objects.count(), 246)
+        # Names are stripped so ' Drama' and 'Drama' are the same genre
+        self.assertFalse(Genre.objects.filter(name__startswith=' ').exists())
+        movie = Movie.objects.get(name='The Wizard of Oz')
+        self.assertEqual(movie.director.name, 'Victor Fleming')
+        self.assertEqual(movie.popularity, 83.0)
+        self.assertEqual(sorted(movie.genre.values_list('name', flat=True)),
+                         ['Adventure', 'Family', 'Fantasy', 'Musical'])
+        # Loading again skips every existing movie
+        out = StringIO()
+        call_command('load_movies', file_path, direct=True, stdout=out)
+        self.assertEqual(Movie.objects.count(), 246)
+        self.assertIn('inserted 0', out.getvalue())
+
+
+class GenerateCatalogueTest(TestCase):
+
+    """
+        generate_catalogue writes reproducible catalogues that load_movies
+        reads
+    """
+
+    def generate(self, count, seed):
+        output = tempfile.NamedTemporaryFile(suffix='.json')
+        call_command('generate_catalogue', str(count), output.name, seed=seed, stdout=StringIO())
+        with open(output.name, 'rb') as data_file:
+            return output, list(read_movies(data_file))
+
+    def test_generate(self):
+        output, movies = self.generate(500, 1)
+        self.assertEqual(movies, self.generate(500, 1)[1])
+        self.assertNotEqual(movies, self.generate(500, 2)[1])
+        self.assertEqual(len(set(movie['name'] for movie in movies)), 500)
+        # Few directors make many movies, genres come from imdb.json
+        directors = Counter(movie['director'] for movie in movies)
+        self.assertTrue(50 < len(directors) < 400)
+        self.assertTrue(max(directors.values()) > 5)
+        with open(os.path.join(settings.BASE_DIR, 'imdb.json'), 'rb') as data_file:
+            genres = set(genre for movie in read_movies(data_file) for genre in movie['genre'])
+        self.assertTrue(all(movie['genre'] and set(movie['genre']) <= genres for movie in movies))
+        self.assertTrue(all(0 <= movie['popularity'] <= 100 and 1 <= movie['imdb_score'] <= 10
+                            for movie in movies))
+        call_command('load_movies', output.name, direct=True, stdout=StringIO())
+        self.assertEqual(Movie.objects.count(), 500)
+        self.assertEqual(Director.objects.count(), len(directors))
+
+
+class ResponseCacheTest(MovieTestCase):
+
+    """
+        Read responses are cached until the catalogue changes
+    """
+
+    def setUp(self):
+        super(ResponseCacheTest, self).setUp()
+        self.movie = create_movie('Star Wars', 'George Lucas', ['Action', 'Sci-Fi'])
+        create_movie('Psycho', 'Alfred Hitchcock', ['Horror', 'Thriller'])
+
+    def test_hit(self):
+        for url, params in (('/movies/list/', {'sort': 'name'}),
+                            ('/movies/search/', {'keyword': 'psy', 'type': 'name'}),
+                            ('/movies/%d/view/' % self.movie.pk, {})):
+            response = self.client.get(url, params)
+            # With the local cache the validators of a movie are read from it
+            with self.assertNumQueries(0 if 'view' not in url else 1):
+                cached_response = self.client.get(url, params)
+            self.assertEqual(cached_response.data, response.data)
+
+    def test_normalised_params(self):
+        self.client.get('/movies/list/', {'sort': 'name', 'sort_criteria': 'desc'})
+        with self.assertNumQueries(0):
+            self.client.get('/movies/list/', {'sort_criteria': 'desc', 'sort': 'name',
+                                              'page': '1', 'keyword': 'ignored'})
+        # Another sort is a miss, only the count is shared
+        with self.assertNumQueries(2):
+            self.client.get('/movies/list/', {'sort': 'name'})
+
+    def test_invalidation(self):
+        url = '/movies/%d/view/' % self.movie.pk
+        self.client.get(url)
+        self.client.get('/movies/list/')
+        self.movie.genre.add(Genre.objects.create(name='Fantasy'))
+        response = self.client.get(url)
+        self.assertIn('Fantasy', response.data['movie']['genre'])
+        Movie.objects.get(name='Psycho').delete()
+        response = self.client.get('/movies/list/')
+        self.assertEqual(response.data['count'], 1)
+
+    def test_stats(self):
+        self.client.get('/movies/list/')
+        self.client.get('/movies/list/')
+        stats = response_cache.stats()
+        self.user.is_staff = True
+        response = self.client.get('/movies/cache_stats/')
+        self.assertEqual(response.data['hits'], stats['hits'])
+        self.assertEqual(response.data['misses'], stats['misses'])
+        self.user.is_staff = False
+        self.assertEqual(self.client.get('/movies/cache_stats/').status_code, 403)
+
+
+class ConditionalGetTest(MovieTestCase):
+
+    """
+        Read responses have an ETag and Last-Modified, unchanged ones are
+        answered with 304
+    """
+
+    def setUp(self):
+        super(ConditionalGetTest, self).setUp()
+        self.movie = create_movie('Star Wars', 'George Lucas', ['Action', 'Sci-Fi'])
+
+    def test_not_modified(self):
+        for url, params in (('/movies/list/', {'sort': 'name'}),
+                            ('/movies/search/', {'keyword': 'star', 'type': 'name'}),
+                            ('/movies/%d/view/' % self.movie.pk, {})):
+            response = self.client.get(url, params)
+            self.assertTrue(response.has_header('Last-Modified'))
+            # Only the updated_at of a movie is read
+            with self.assertNumQueries(0 if 'view' not in url else 1):
+                response = self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, '')
+
+    def test_changed(self):
+        url = '/movies/%d/view/' % self.movie.pk
+        etag = self.client.get(url)['ETag']
+        list_etag = self.client.get('/movies/list/')['ETag']
+        self.movie.genre.add(Genre.objects.create(name='Fantasy'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        response = self.client.get('/movies/list/', HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_params_in_etag(self):
+        etag = self.client.get('/movies/list/', {'sort': 'name'})['ETag']
+        self.assertEqual(self.client.get('/movies/list/', {'sort': 'name', 'page': '1'},
+                                         HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/movies/list/', {'sort': 'imdb_score'},
+                                         HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_missing_movie(self):
+        response = self.client.get('/movies/0/view/', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_shared_cache(self):
+        # The updated_at of a movie is cached with a shared version
+        with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': os.path.join(tempfile.gettempdir(), 'movies-conditional-get-test')}}):
+            cache.clear()
+            url = '/movies/%d/view/' % self.movie.pk
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_local_version_kept(self):
+        # Cached responses expire after LOCAL_TIMEOUT seconds, the version
+        # and the validators stay until a write
+        self.addCleanup(setattr, cache_module, 'LOCAL_TIMEOUT', cache_module.LOCAL_TIMEOUT)
+        cache_module.LOCAL_TIMEOUT = 1
+        cache.clear()
+        response = self.client.get('/movies/list/')
+        time.sleep(1.1)
+        self.assertEqual(self.client.get('/movies/list/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get('/movies/list/')['Last-Modified'], response['Last-Modified'])
+        create_movie('Alien', 'Ridley Scott', ['Horror'])
+        self.assertEqual(self.client.get('/movies/list/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class LRUCacheTest(SimpleTestCase):
+
+    def test_eviction(self):
+        entries = LRUCache(max_entries=2)
+        entries.set('a', 1)
+        entries.set('b', 2)
+        entries.get('a')
+        entries.set('c', 3)
+        self.assertEqual(entries.get('a'), 1)
+        self.assertIsNone(entries.get('b'))
+        self.assertEqual(entries.get('c'), 3)
+
+    def test_timeout(self):
+        entries = LRUCache(timeout=-1)
+        entries.set('a', 1)
+        self.assertIsNone(entries.get('a'))
+        entries.set('b', 2, 60)
+        self.assertEqual(entries.get('b'), 2)
+        entries = LRUCache()
+        entries.set('a', 1, -1)
+        self.assertIsNone(entries.get('a'))
+
+
+class CursorPaginationTest(MovieTestCase):
+
+    """
+        Keyset pagination walks every movie once, in order, for each sort
+    """
+
+    def setUp(self):
+        super(CursorPaginationTest, self).setUp()
+        # Repeated scores and directors to exercise the id tie-breaker
+        for index in range(23):
+            create_movie('Movie %02d' % (index % 17), 'Director %d' % (index % 4), ['Drama'],
+                         imdb_score=index % 5)
+
+    def walk(self, url, params):
+        names = []
+        params = dict(params, pagination='cursor')
+        while True:
+            with self.assertNumQueries(2):
+                response = self.client.get(url, params)
+            names.extend(movie['name'] for movie in response.data['movies'])
+            if not response.data['next']:
+                return names
+            params['cursor'] = response.data['next']
+
+    def test_sorts(self):
+        orderings = {'name': ('name', 'id'), 'director_name': ('director__name', 'id'),
+                     'imdb_score': ('imdb_score', 'id')}
+        for sort, ordering in orderings.items():
+            for criteria in ('asc', 'desc'):
+                if criteria == 'desc':
+                    ordering = ['-' + field for field in ordering]
+                expected = list(Movie.objects.order_by(*ordering).values_list('name', flat=True))
+                params = {'sort': sort, 'sort_criteria': criteria}
+                self.assertEqual(self.walk('/movies/list/', params), expected)
+        self.assertEqual(self.walk('/movies/list/', {}),
+                         list(Movie.objects.order_by('id').values_list('name', flat=True)))
+
+    def test_search(self):
+        names = self.walk('/movies/search/', {'keyword': 'director 1', 'type': 'director',
+                                              'sort': 'imdb_score'})
+        self.assertEqual(names, list(Movie.objects.filter(director__name='Director 1').order_by(
+            'imdb_score', 'id').values_list('name', flat=True)))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/movies/list/', {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/movies/list/', {'pagination': 'cursor', 'sort': 'name'})
+        # A cursor made for another sort is refused
+        response = self.client.get('/movies/list/', {'cursor': response.data['next'],
+                                                     'sort': 'imdb_score'})
+        self.assertEqual(response.status_code, 404)
+        # Values of the wrong type for their field
+        for values, movie_id in (([['Movie 1']], 1), ([{'name': 'Movie 1'}], 1), ([1.5], 1),
+                                 (['Movie 1'], [1]), (['Movie 1'], True), (['Movie 1'], '1')):
+            cursor = base64.urlsafe_b64encode(json.dumps({'sort': ['name'], 'values': values, 'id': movie_id}))
+            response = self.client.get('/movies/list/', {'cursor': cursor, 'sort': 'name'})
+            self.assertEqual(response.status_code, 404)
+
+
+class UpdateMovieTest(AdminMovieTestCase):
+
+    """
+        PUT /movies/<id>/ only changes the movie's own genre links
+    """
+
+    def put(self, movie, genres, director='George Lucas'):
+        return self.client.put('/movies/%d/' % movie.pk, {
+            'name': movie.name, 'director': director, 'imdb_score': 8.5,
+            'popularity': 85, 'genre': genres}, format='json')
+
+    def test_shared_genres_kept(self):
+        movie = create_movie('Star Wars', 'George Lucas', ['Action', 'Sci-Fi'])
+        other = create_movie('Alien', 'Ridley Scott', ['Horror', 'Sci-Fi'])
+        response = self.put(movie, ['Action', 'Adventure'], director='Irvin Kershner')
+        self.assertEqual(response.data['status'], 1)
+        movie = Movie.objects.get(pk=movie.pk)
+        self.assertEqual(movie.director.name, 'Irvin Kershner')
+        self.assertEqual(movie.imdb_score, 8.5)
+        self.assertEqual(sorted(movie.genre.values_list('name', flat=True)), ['Action', 'Adventure'])
+        self.assertEqual(sorted(other.genre.values_list('name', flat=True)), ['Horror', 'Sci-Fi'])
+        self.assertTrue(Genre.objects.filter(name='Sci-Fi').exists())
+        self.assertIn('Adventure', movie.search_document)
+
+    def test_genres_searched(self):
+        # Same name and director, the save does not rebuild the document
+        movie = create_movie('Star Wars', 'George Lucas', ['Action', 'Sci-Fi'])
+        self.assertEqual(self.put(movie, ['Action', 'Adventure']).data['status'], 1)
+        for keyword, names in (('adventure', ['Star Wars']), ('sci-fi', [])):
+            response = self.client.get('/movies/search/', {'q': keyword})
+            self.assertEqual([movie['name'] for movie in response.data['movies']], names)
+
+    def test_query_count(self):
+        # Facet rows of the new scores exist for both updates
+        create_movie('Other', 'George Lucas', ['Drama'], imdb_score=8.5, popularity=85)
+        counts = []
+        for count in (2, 20):
+            movie = create_movie('Movie %d' % count, 'George Lucas', ['Genre %d' % i for i in range(count)])
+            genres = ['Genre %d' % i for i in range(count // 2, count + count // 2)]
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.put(movie, genres).data['status'], 1)
+            counts.append(len(queries))
+            self.assertEqual(set(movie.genre.values_list('name', flat=True)), set(genres))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_invalid_not_saved(self):
+        movie = create_movie('Star Wars', 'George Lucas', ['Action'])
+        response = self.client.put('/movies/%d/' % movie.pk, {
+            'name': movie.name, 'director': 'Other', 'imdb_score': 11,
+            'popularity': 85, 'genre': ['Drama']}, format='json')
+        self.assertEqual(response.data['status'], -1)
+        self.assertFalse(Genre.objects.filter(name='Drama').exists())
+
+
+class NameResolverTest(AdminMovieTestCase):
+
+    """
+        Directors and genres are unique by normalised name
+    """
+
+    def test_normalised(self):
+        create_movie('Star Wars', 'George Lucas', ['Sci-Fi'])
+        response = self.client.post('/movies/', {
+            'name': 'THX 1138', 'director': ' george  lucas', 'imdb_score': 6.7,
+            'popularity': 67, 'genre': [' Sci-Fi', 'sci-fi', 'Drama']}, format='json')
+        self.assertEqual(response.data['status'], 1)
+        self.assertEqual(Director.objects.count(), 1)
+        self.assertEqual(sorted(Genre.objects.values_list('name', flat=True)), ['Drama', 'Sci-Fi'])
+        self.assertEqual(Movie.objects.get(name='THX 1138').genre.count(), 2)
+        with self.assertRaises(IntegrityError):
+            Genre.objects.create(name='DRAMA ')
+
+    def test_dedupe_command(self):
+        movie = create_movie('Star Wars', 'George Lucas', ['Sci-Fi', 'Action'])
+        other = create_movie('Alien', 'Ridley Scott', ['Horror'])
+        # Rows saved under an older normalisation
+        Director.objects.bulk_create([Director(name='George Lucas ', name_key='old lucas')])
+        Genre.objects.bulk_create([Genre(name=' sci-fi', name_key='old sci-fi'),
+                                   Genre(name='horror', name_key='old horror')])
+        movie.genre.add(Genre.objects.get(name_key='old sci-fi'))
+        other.genre.add(Genre.objects.get(name_key='old horror'))
+        other.director = Director.objects.get(name_key='old lucas')
+        other.save()
+        out = StringIO()
+        call_command('dedupe_names', stdout=out)
+        self.assertIn('Merged 1 directors and 2 genres', out.getvalue())
+        self.assertEqual(list(Director.objects.order_by('id').values_list('name', 'name_key')),
+                         [('George Lucas', 'george lucas'), ('Ridley Scott', 'ridley scott')])
+        self.assertEqual(Genre.objects.count(), 3)
+        self.assertEqual(sorted(movie.genre.values_list('name', flat=True)), ['Action', 'Sci-Fi'])
+        self.assertEqual(list(other.genre.values_list('name', flat=True)), ['Horror'])
+        self.assertEqual(Movie.objects.get(pk=other.pk).director.name, 'George Lucas')
+
+    def test_dedupe_migration(self):
+        migration = import_module('movies.migrations.0006_unique_names')
+        movie = create_movie('Star Wars', 'George Lucas', ['Sci-Fi'])
+        Director.objects.bulk_create([Director(name='george  lucas', name_key='old lucas')])
+        Genre.objects.bulk_create([Genre(name='SCI-FI', name_key='old sci-fi')])
+        # Finds the rows above by their exact name
+        other = create_movie('THX 1138', 'george  lucas', ['SCI-FI'])
+        migration.merge_duplicates(apps, None)
+        # Searched by the names of the kept rows
+        self.assertEqual(Movie.objects.get(pk=other.pk).search_document, 'THX 1138 George Lucas Sci-Fi')
+        self.assertEqual(Movie.objects.get(pk=movie.pk).search_document, 'Star Wars George Lucas Sci-Fi')
+
+
+class NameResolverCacheTest(TransactionTestCase):
+
+    """
+        Resolved names are kept in process once committed
+    """
+
+    def setUp(self):
+        director_resolver.clear()
+        genre_resolver.clear()
+
+    def test_cached(self):
+        ids = genre_resolver.resolve(['Drama', 'War'])
+        with self.assertNumQueries(0):
+            self.assertEqual(genre_resolver.resolve([' drama', 'War']),
+                             {' drama': ids['Drama'], 'War': ids['War']})
+        Genre.objects.get(name='War').delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(genre_resolver.resolve(['Drama']), {'Drama': ids['Drama']})
+
+    def test_rollback_not_cached(self):
+        try:
+            with transaction.atomic():
+                director_resolver.resolve_one('George Lucas')
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        self.assertFalse(Director.objects.exists())
+        self.assertEqual(len(director_resolver.ids), 0)
+
+
+class BulkMoviesTest(AdminMovieTestCase):
+
+    """
+        Batch create and upsert of movies
+    """
+
+    def movies(self, count, start=0, genre='Drama'):
+        return [{'name': 'Movie %d' % index, 'director': 'Director %d' % (index % 7),
+                 'imdb_score': 7.5, 'popularity': 75, 'genre': [genre, 'Genre %d' % index]}
+                for index in range(start, start + count)]
+
+    def test_statuses(self):
+        create_movie('Movie 1', 'Director 1', ['Drama'])
+        movies = self.movies(3)
+        movies.append({'name': 'Invalid', 'director': 'Director', 'imdb_score': 11,
+                       'popularity': 75, 'genre': ['Drama']})
+        movies.append(self.movies(1)[0])
+        response = self.client.post('/movies/bulk/', movies, format='json')
+        statuses = response.data['movies']
+        self.assertEqual([status['status'] for status in statuses], [1, -1, 1, -1, -1])
+        self.assertEqual(statuses[0]['result'], 'created')
+        self.assertEqual(statuses[1]['errors'], 'Movie already exists')
+        self.assertIn('imdb_score', statuses[3]['errors'])
+        self.assertEqual(statuses[4]['errors'], 'Movie repeated in request')
+        movie = Movie.objects.get(name='Movie 2')
+        self.assertEqual(movie.director.name, 'Director 2')
+        self.assertEqual(sorted(movie.genre.values_list('name', flat=True)), ['Drama', 'Genre 2'])
+
+    def test_invalid_genres(self):
+        movies = self.movies(5)
+        for movie, genre in zip(movies, ([1], [''], ['  '], ['G' * 256], [{'name': 'Drama'}])):
+            movie['genre'] = genre
+        response = self.client.post('/movies/bulk/', movies, format='json')
+        for status in response.data['movies']:
+            self.assertEqual(status['status'], -1)
+            self.assertIn('genre', status['errors'])
+        self.assertFalse(Movie.objects.exists())
+
+    def test_upsert(self):
+        self.client.post('/movies/bulk/', self.movies(3), format='json')
+        movies = self.movies(4, genre='War')
+        movies[0]['imdb_score'] = 9.0
+        movies[0]['director'] = 'Someone'
+        response = self.client.post('/movies/bulk/?upsert=true', movies, format='json')
+        self.assertEqual([status['result'] for status in response.data['movies']],
+                         ['updated', 'updated', 'updated', 'created'])
+        movie = Movie.objects.get(name='Movie 0')
+        self.assertEqual(movie.imdb_score, 9.0)
+        self.assertEqual(movie.director.name, 'Someone')
+        self.assertEqual(sorted(movie.genre.values_list('name', flat=True)), ['Genre 0', 'War'])
+        # Genres are shared, not replaced
+        self.assertEqual(Genre.objects.filter(name='Drama').count(), 1)
+
+    def test_query_count(self):
+        # Same number of queries for 5 and 50 movies, one batch of batch_size
+        with self.assertNumQueries(24):
+            self.client.post('/movies/bulk/', self.movies(5), format='json')
+        with self.assertNumQueries(24):
+            self.client.post('/movies/bulk/', self.movies(50, 5), format='json')
+        # No director is created, movies are updated and their genres replaced,
+        # facet counts of the updated movies are read first
+        with self.assertNumQueries(26):
+            self.client.post('/movies/bulk/?upsert=true', self.movies(90), format='json')
+        self.assertEqual(Movie.objects.count(), 90)
+
+    def test_query_count_per_batch(self):
+        # Past batch_size movies, each batch adds the same queries
+        self.addCleanup(setattr, BulkMovies, 'batch_size', BulkMovies.batch_size)
+        BulkMovies.batch_size = 10
+        # Directors, Drama and their facet rows exist, the resolvers are warm
+        for index in range(7):
+            create_movie('Seed %d' % index, 'Director %d' % index, ['Drama'])
+        self.client.post('/movies/bulk/', self.movies(10), format='json')
+        counts = []
+        start = 10
+        for batches in (1, 2, 3):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/movies/bulk/', self.movies(10 * batches, start), format='json')
+            self.assertEqual([status['status'] for status in response.data['movies']], [1] * 10 * batches)
+            counts.append(len(queries))
+            start += 10 * batches
+        self.assertGreater(counts[1], counts[0])
+        self.assertEqual(counts[2] - counts[1], counts[1] - counts[0])
+
+
+class MovieExportTest(AdminMovieTestCase):
+
+    """
+        /movies/export/ streams the catalogue in a format load_movies reads
+    """
+
+    def setUp(self):
+        super(MovieExportTest, self).setUp()
+        create_movie(u'Am\xe9lie', u'Jean-Pierre Jeunet', ['Romance', 'Comedy'], 8.3, 83.0)
+        create_movie('Star Wars', 'George Lucas', ['Sci-Fi', 'Action'], 8.7, 87.5)
+        create_movie('Say "Anything", again', 'Cameron Crowe', ['Drama', 'Teen | "Coming of age", 80s'], 7.4, 74.0)
+
+    def catalogue(self):
+        return sorted((movie.name, movie.director.name, sorted(genre.name for genre in movie.genre.all()),
+                       movie.imdb_score, movie.popularity)
+                      for movie in Movie.objects.with_relations())
+
+    def export(self, output, suffix):
+        response = self.client.get('/movies/export/', {'output': output})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn(suffix, response['Content-Disposition'])
+        return ''.join(response.streaming_content)
+
+    def reload(self, content, suffix):
+        expected = self.catalogue()
+        Movie.objects.all().delete()
+        data_file = tempfile.NamedTemporaryFile(suffix=suffix)
+        data_file.write(content)
+        data_file.flush()
+        call_command('load_movies', data_file.name, direct=True, stdout=StringIO())
+        self.assertEqual(self.catalogue(), expected)
+
+    def test_jsonl(self):
+        content = self.export('jsonl', '.jsonl')
+        self.assertEqual(len(content.splitlines()), 3)
+        self.assertEqual(json.loads(content.splitlines()[0]), {
+            'name': u'Am\xe9lie', 'director': 'Jean-Pierre Jeunet', 'genre': ['Comedy', 'Romance'],
+            'imdb_score': 8.3, '99popularity': 83.0})
+        self.reload(content, '.jsonl')
+
+    def test_csv(self):
+        content = self.export('csv', '.csv')
+        lines = content.splitlines()
+        self.assertEqual(lines[0], 'name,director,genre,imdb_score,popularity')
+        self.assertEqual(lines[3], '"Say ""Anything"", again",Cameron Crowe,'
+                                   '"[""Drama"", ""Teen | \\""Coming of age\\"", 80s""]",7.4,74.0')
+        self.reload(content, '.csv')
+
+    def test_chunks(self):
+        # One query for the movies and one for the genres per chunk
+        with self.assertNumQueries(5):
+            movies = list(iter_movies(chunk_size=2))
+        self.assertEqual([movie['name'] for movie in movies],
+                         [u'Am\xe9lie', 'Star Wars', 'Say "Anything", again'])
+
+    def test_admin_only(self):
+        self.assertEqual(self.client.get('/movies/export/', {'output': 'xml'}).data['status'], -1)
+        self.user.is_staff = False
+        self.assertEqual(self.client.get('/movies/export/').status_code, 403)
+
+
+class MovieFacetsTest(AdminMovieTestCase):
+
+    """
+        The facet summary table follows every kind of write and matches
+        a full recount
+    """
+
+    def counts(self):
+        return sorted(FacetCount.objects.exclude(count=0).values_list('facet', 'key', 'count'))
+
+    def assertSummaryCounted(self):
+        counts = self.counts()
+        rebuild_facets()
+        self.assertEqual(counts, self.counts())
+
+    def test_writes(self):
+        movie = create_movie('Star Wars', 'George Lucas', ['Sci-Fi', 'Action'], 8.7, 87.5)
+        other = create_movie('Alien', 'Ridley Scott', ['Horror', 'Sci-Fi'], 8.5, 85.0)
+        self.assertSummaryCounted()
+        self.client.put('/movies/%d/' % movie.pk, {
+            'name': 'Star Wars', 'director': 'Irvin Kershner', 'imdb_score': 10,
+            'popularity': 100, 'genre': ['Action', 'Adventure']}, format='json')
+        self.assertSummaryCounted()
+        Genre.objects.get(name='Sci-Fi').movie_set.clear()
+        self.assertSummaryCounted()
+        other.genre.remove(Genre.objects.get(name='Horror'), Genre.objects.get(name='Action'))
+        self.assertSummaryCounted()
+        Genre.objects.get(name='Action').delete()
+        self.assertSummaryCounted()
+        self.client.delete('/movies/%d/' % other.pk)
+        self.assertSummaryCounted()
+        self.client.post('/movies/bulk/', [
+            {'name': 'Alien', 'director': 'Ridley Scott', 'imdb_score': 0,
+             'popularity': 0, 'genre': ['Horror']},
+            {'name': 'Star Wars', 'director': 'George Lucas', 'imdb_score': 8.7,
+             'popularity': 87.5, 'genre': ['Sci-Fi']}], format='json')
+        self.client.post('/movies/bulk/?upsert=true', [
+            {'name': 'Star Wars', 'director': 'George Lucas', 'imdb_score': 8.7,
+             'popularity': 87.5, 'genre': ['Sci-Fi', 'Drama']}], format='json')
+        self.assertSummaryCounted()
+
+    def test_global_facets(self):
+        create_movie('Star Wars', 'George Lucas', ['Sci-Fi', 'Action'], 8.7, 87.5)
+        create_movie('THX 1138', 'George Lucas', ['Sci-Fi'], 6.7, 67.0)
+        create_movie('Alien', 'Ridley Scott', ['Horror', 'Sci-Fi'], 10, 100)
+        # Read from the summary table, nothing is grouped over the movies
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get('/movies/facets/').data
+        self.assertFalse(any('movies_movie' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['genres'], [{'name': 'Sci-Fi', 'count': 3}, {'name': 'Action', 'count': 1},
+                                          {'name': 'Horror', 'count': 1}])
+        self.assertEqual(data['directors'], [{'name': 'George Lucas', 'count': 2},
+                                             {'name': 'Ridley Scott', 'count': 1}])
+        self.assertEqual([bucket['count'] for bucket in data['imdb_score']], [0] * 6 + [1, 0, 1, 1])
+        self.assertEqual(data['popularity'][9], {'from': 90.0, 'to': 100.0, 'count': 1})
+
+    def test_search_facets(self):
+        create_movie('Star Wars', 'George Lucas', ['Sci-Fi', 'Action'], 8.7, 87.5)
+        create_movie('THX 1138', 'George Lucas', ['Sci-Fi'], 6.7, 67.0)
+        create_movie('Alien', 'Ridley Scott', ['Horror', 'Sci-Fi'], 8.5, 85.0)
+        data = self.client.get('/movies/facets/', {'keyword': 'lucas', 'type': 'director'}).data
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['genres'], [{'name': 'Sci-Fi', 'count': 2}, {'name': 'Action', 'count': 1}])
+        self.assertEqual(data['directors'], [{'name': 'George Lucas', 'count': 2}])
+        self.assertEqual(sum(bucket['count'] for bucket in data['popularity']), 2)
+        data = self.client.get('/movies/facets/', {'keyword': 'sci', 'type': 'genre'}).data
+        self.assertEqual(data['count'], 3)
+        data = self.client.get('/movies/facets/', {'q': 'alien'}).data
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['genres'], [{'name': 'Horror', 'count': 1}, {'name': 'Sci-Fi', 'count': 1}])
+
+
+class MovieFilterTest(MovieTestCase):
+
+    """
+        Filters combine with each other, the keyword and the sorts, and
+        every combination is read from indexes
+    """
+
+    def setUp(self):
+        super(MovieFilterTest, self).setUp()
+        create_movie('Star Wars', 'George Lucas', ['Sci-Fi', 'Action'], 8.7, 87.5)
+        create_movie('THX 1138', 'George Lucas', ['Sci-Fi', 'Drama'], 6.7, 67.0)
+        create_movie('Star Trek', 'Robert Wise', ['Sci-Fi'], 6.4, 64.0)
+        create_movie('Alien', 'Ridley Scott', ['Horror', 'Sci-Fi'], 8.5, 85.0)
+        create_movie('Stalker', 'Andrei Tarkovsky', ['Drama', 'Sci-Fi'], 8.2, 82.0)
+
+    def names(self, params):
+        response = self.client.get('/movies/search/', params)
+        self.assertEqual(response.data['status'], 1)
+        return [movie['name'] for movie in response.data['movies']]
+
+    def test_filters(self):
+        self.assertEqual(self.names({'imdb_score_min': 8.2, 'imdb_score_max': 8.5, 'sort': 'name'}),
+                         ['Alien', 'Stalker'])
+        self.assertEqual(self.names({'popularity_max': 67, 'sort': '-popularity'}), ['THX 1138', 'Star Trek'])
+        self.assertEqual(self.names({'genre': 'drama,action', 'sort': 'name'}),
+                         ['Stalker', 'Star Wars', 'THX 1138'])
+        self.assertEqual(self.names({'genre': 'Drama, Sci-Fi', 'genre_match': 'all', 'sort': 'name'}),
+                         ['Stalker', 'THX 1138'])
+        self.assertEqual(self.names({'director': ' george lucas', 'sort': 'imdb_score'}),
+                         ['THX 1138', 'Star Wars'])
+        self.assertEqual(self.names({'name_prefix': 'Sta', 'sort': 'name'}), ['Stalker', 'Star Trek', 'Star Wars'])
+        self.assertEqual(self.names({'name_prefix': 'sta'}), [])
+        self.assertEqual(self.names({'name_prefix': 'Star', 'genre': 'Action', 'popularity_min': 80,
+                                     'keyword': 'lucas', 'type': 'director'}), ['Star Wars'])
+
+    def test_name_prefix_collation(self):
+        # A range under code point comparisons, startswith under others
+        self.assertTrue(code_point_collation(connection))
+        request = Request(APIRequestFactory().get('/', {'name_prefix': 'Sta'}))
+        self.assertNotIn('LIKE', unicode(MovieFilters().filter_queryset(request, Movie.objects.all()).query))
+        self.addCleanup(setattr, connection, 'movies_code_point_collation', None)
+        connection.movies_code_point_collation = False
+        self.assertIn('LIKE', unicode(MovieFilters().filter_queryset(request, Movie.objects.all()).query))
+        self.assertEqual(self.names({'name_prefix': 'Sta', 'sort': 'name'}), ['Stalker', 'Star Trek', 'Star Wars'])
+        self.assertEqual(self.names({'name_prefix': 'St%'}), [])
+
+    def test_sorts(self):
+        self.assertEqual(self.names({'sort': 'popularity', 'sort_criteria': 'desc'}),
+                         ['Star Wars', 'Alien', 'Stalker', 'THX 1138', 'Star Trek'])
+        self.assertEqual(self.names({'sort': 'director_name,-imdb_score'}),
+                         ['Stalker', 'Star Wars', 'THX 1138', 'Alien', 'Star Trek'])
+        # Cursor pages follow every key
+        params = {'sort': 'director_name,-imdb_score', 'pagination': 'cursor'}
+        names = []
+        self.addCleanup(setattr, MovieCursorPagination, 'page_size', MovieCursorPagination.page_size)
+        MovieCursorPagination.page_size = 2
+        while True:
+            response = self.client.get('/movies/search/', params)
+            names.extend(movie['name'] for movie in response.data['movies'])
+            if not response.data['next']:
+                break
+            params['cursor'] = response.data['next']
+        self.assertEqual(names, ['Stalker', 'Star Wars', 'THX 1138', 'Alien', 'Star Trek'])
+
+    def test_invalid(self):
+        response = self.client.get('/movies/search/', {'imdb_score_min': 'high'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['status'], -1)
+        self.assertIn('imdb_score_min', response.data)
+        response = self.client.get('/movies/search/', {'genre': 'Drama', 'genre_match': 'some'})
+        self.assertEqual(response.data['status'], -1)
+
+    def test_facets(self):
+        data = self.client.get('/movies/facets/', {'genre': 'Drama'}).data
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['genres'], [{'name': 'Drama', 'count': 2}, {'name': 'Sci-Fi', 'count': 2}])
+
+    # Rows and distinct values per column of a large catalogue, given to
+    # the SQLite planner as ANALYZE statistics
+    catalogue_statistics = {
+        'movies_movie': (100000, {'id': 100000, 'name': 100000, 'imdb_score': 90, 'popularity': 1000,
+                                  'director_id': 30000, 'updated_at': 100000}),
+        'movies_director': (30000, {'id': 30000, 'name': 30000, 'name_key': 30000}),
+        'movies_genre': (25, {'id': 25, 'name': 25, 'name_key': 25}),
+        'movies_movie_genre': (250000, {'id': 250000, 'movie_id': 100000, 'genre_id': 25}),
+    }
+    # Columns each param filters on
+    filter_columns = {'imdb_score_min': 'imdb_score', 'imdb_score_max': 'imdb_score',
+                      'popularity_min': 'popularity', 'popularity_max': 'popularity',
+                      'genre': 'genre_id', 'director': 'director_id', 'name_prefix': 'name'}
+
+    def set_statistics(self):
+        # sqlite_stat1 rows: table rows, then rows per value of each prefix
+        # of the index columns. ANALYZE sqlite_master loads them
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            cursor.execute('DELETE FROM sqlite_stat1')
+            for table, (rows, distinct) in self.catalogue_statistics.items():
+                cursor.execute('PRAGMA index_list(%s)' % table)
+                for index in [row[1] for row in cursor.fetchall()]:
+                    cursor.execute('PRAGMA index_info(%s)' % index)
+                    stat, keys = [rows], 1
+                    for column in [row[2] for row in cursor.fetchall()]:
+                        keys *= distinct[column]
+                        stat.append(max(1, rows // min(keys, rows)))
+                    cursor.execute('INSERT INTO sqlite_stat1 VALUES (%s, %s, %s)',
+                                   [table, index, ' '.join(str(value) for value in stat)])
+            cursor.execute('ANALYZE sqlite_master')
+
+    def clear_statistics(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM sqlite_stat1')
+            cursor.execute('ANALYZE sqlite_master')
+
+    def query_plan(self, params):
+        # Plan of the first page, ordered as MovieListMixin orders it
+        request = Request(APIRequestFactory().get('/', params))
+        ordering = MovieSort().sort_ordering(request)
+        queryset = MovieFilters().filter_queryset(request, Movie.objects.all()).list_rows()
+        if ordering:
+            queryset = queryset.order_by(*(ordering + (('-' if ordering[-1].startswith('-') else '') + 'id',)))
+        else:
+            queryset = queryset.order_by('id')
+        sql, sql_params = queryset[:10].query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, sql_params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output of SQLite')
+    def test_director_name_cursor_plan(self):
+        self.set_statistics()
+        self.addCleanup(self.clear_statistics)
+        for sort in ('director_name', 'director_name,-popularity'):
+            request = Request(APIRequestFactory().get('/', {'sort': sort}))
+            ordering = MovieSort().sort_ordering(request)
+            queryset = Movie.objects.all().list_rows()
+            first = queryset.order_by(*(ordering + ('id',))).first()
+            request = Request(APIRequestFactory().get('/', {
+                'sort': sort, 'cursor': MovieCursorPagination().encode_cursor(first, ordering)}))
+            with CaptureQueriesContext(connection) as queries:
+                MovieCursorPagination().paginate_queryset(queryset, request, ordering)
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + queries.captured_queries[-1]['sql'])
+                plan = [row[-1] for row in cursor.fetchall()]
+            # Directors from the cursor on, then the movies of each one,
+            # sorted per director rather than as a whole
+            self.assertTrue(plan[0].startswith('SEARCH movies_director USING COVERING INDEX'), (sort, plan))
+            self.assertIn('(name>?)', plan[0])
+            self.assertTrue(plan[1].startswith('SEARCH movies_movie USING INDEX'), (sort, plan))
+            self.assertIn('(director_id=?)', plan[1])
+            self.assertFalse([step for step in plan[2:] if step != 'USE TEMP B-TREE FOR RIGHT PART OF ORDER BY'],
+                             (sort, plan))
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output of SQLite')
+    def test_query_plans(self):
+        self.set_statistics()
+        self.addCleanup(self.clear_statistics)
+        # params, whether the order is read from an index (no sort at all)
+        combinations = [
+            ({'imdb_score_min': 8, 'imdb_score_max': 9}, False),
+            ({'imdb_score_min': 8, 'sort': 'imdb_score'}, True),
+            ({'imdb_score_min': 8, 'sort': 'popularity'}, False),
+            ({'imdb_score_min': 8, 'sort': 'director_name'}, False),
+            ({'popularity_min': 80, 'sort': '-popularity,name'}, False),
+            ({'popularity_min': 80, 'imdb_score_max': 9, 'sort': 'popularity'}, True),
+            ({'genre': 'Drama,Action'}, True),
+            ({'genre': 'Drama,Sci-Fi', 'genre_match': 'all', 'sort': 'imdb_score'}, False),
+            ({'genre': 'Drama', 'sort': 'director_name'}, False),
+            ({'director': 'George Lucas'}, True),
+            ({'director': 'George Lucas', 'sort': '-popularity'}, True),
+            ({'director': 'George Lucas', 'sort': 'name'}, True),
+            ({'director': 'George Lucas', 'sort': 'director_name'}, True),
+            ({'director': 'George Lucas', 'sort': 'director_name,-imdb_score'}, True),
+            ({'director': 'George Lucas', 'imdb_score_min': 8, 'sort': 'imdb_score'}, True),
+            ({'name_prefix': 'Star'}, False),
+            ({'name_prefix': 'Star', 'sort': 'name'}, True),
+            ({'name_prefix': 'Star', 'genre': 'Sci-Fi', 'popularity_max': 90}, True),
+            ({'sort': 'popularity'}, True),
+            ({'sort': '-imdb_score'}, True),
+            ({'sort': 'name'}, True),
+            ({'sort': 'director_name'}, True),
+            ({'sort': 'director_name,-popularity'}, True),
+        ]
+        for params, index_ordered in combinations:
+            plan = self.query_plan(params)
+            columns = set(self.filter_columns[param] for param in params if param in self.filter_columns)
+            if columns:
+                # Rows are found by searching an index on a filtered column,
+                # no table is read whole
+                searched = [step for step in plan if step.startswith('SEARCH') and any(
+                    '(%s' % column in step for column in columns)]
+                self.assertTrue(searched, (params, plan))
+                self.assertFalse([step for step in plan if step.startswith('SCAN')], (params, plan))
+            else:
+                # Unfiltered, the sort index is walked
+                self.assertTrue(all('INDEX' in step for step in plan if step.startswith('SCAN')), (params, plan))
+            if index_ordered:
+                sorts = [step for step in plan if 'TEMP B-TREE' in step]
+                if params.get('sort', '').startswith('director_name'):
+                    # Director names are walked in order, only the movies
+                    # of each name are sorted
+                    sorts = [step for step in sorts if step != 'USE TEMP B-TREE FOR RIGHT PART OF ORDER BY']
+                self.assertFalse(sorts, (params, plan))
+            else:
+                # The filtered rows are sorted
+                self.assertTrue(columns, params)
+
+
+@override_settings(MOVIE_SIMILARITY={'INDEX_FILE': None, 'NEIGHBOURS': 5}, CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'movies-similarity-test'),
+}})
+class MovieSimilarTest(TransactionTestCase):
+
+    """
+        Similar movies come from the in memory index, which follows the
+        committed writes and matches a fresh build
+    """
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        director_resolver.clear()
+        genre_resolver.clear()
+        self.user = AppUser.objects.create_user(
+            username='admin', email='admin@example.com', password='password', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        similarity_index.clear()
+        self.addCleanup(similarity_index.clear)
+        self.star_wars = create_movie('Star Wars', 'George Lucas', ['Sci-Fi', 'Action', 'Adventure'], 8.7, 87.0)
+        self.empire = create_movie('Empire Strikes Back', 'Irvin Kershner', ['Sci-Fi', 'Action', 'Adventure'],
+                                   8.8, 88.0)
+        self.thx = create_movie('THX 1138', 'George Lucas', ['Sci-Fi', 'Drama'], 6.7, 67.0)
+        create_movie(u'Am\xe9lie', 'Jean-Pierre Jeunet', ['Romance', 'Comedy'], 8.3, 83.0)
+        index_file = tempfile.NamedTemporaryFile(suffix='.npz')
+        self.addCleanup(index_file.close)
+        self.index_file = index_file.name
+        call_command('build_similarity_index', output=self.index_file, stdout=StringIO())
+        index_settings = self.settings(MOVIE_SIMILARITY={'INDEX_FILE': self.index_file, 'NEIGHBOURS': 5})
+        index_settings.enable()
+        self.addCleanup(index_settings.disable)
+
+    def similar(self, movie, **params):
+        response = self.client.get('/movies/%d/similar/' % movie.pk, params)
+        self.assertEqual(response.data['status'], 1)
+        return [similar['name'] for similar in response.data['movies']]
+
+    def assertIndexBuilt(self):
+        # Same similarities as an index built from scratch
+        fresh = SimilarityIndex()
+        fresh.build()
+        for movie_id in fresh.rows:
+            self.assertEqual([round(score, 5) for _, score in similarity_index.similar(movie_id)],
+                             [round(score, 5) for _, score in fresh.similar(movie_id)])
+        self.assertEqual(sorted(similarity_index.rows), sorted(fresh.rows))
+
+    def test_similar(self):
+        self.assertEqual(self.similar(self.star_wars), ['Empire Strikes Back', 'THX 1138', u'Am\xe9lie'])
+        response = self.client.get('/movies/%d/similar/' % self.star_wars.pk, {'limit': 1})
+        self.assertEqual(list(response.data['movies'][0]), ['director', 'genre', 'name', 'imdb_score',
+                                                            'popularity', 'similarity'])
+        self.assertTrue(0 < response.data['movies'][0]['similarity'] <= 1)
+        self.assertEqual(self.client.get('/movies/0/similar/').status_code, 404)
+        self.assertEqual(self.client.get('/movies/%d/similar/' % self.thx.pk, {'limit': 6}).status_code, 400)
+        # Index is loaded, a lookup only reads the movies to show
+        with self.assertNumQueries(2):
+            self.assertEqual(self.similar(self.thx, limit=1), ['Star Wars'])
+
+    def test_writes(self):
+        self.similar(self.star_wars)
+        response = self.client.post('/movies/', {
+            'name': 'Return of the Jedi', 'director': 'George Lucas', 'imdb_score': 8.3,
+            'popularity': 83, 'genre': ['Sci-Fi', 'Action', 'Adventure']}, format='json')
+        self.assertEqual(response.data['status'], 1)
+        self.assertEqual(self.similar(self.star_wars, limit=2), ['Return of the Jedi', 'Empire Strikes Back'])
+        self.assertIndexBuilt()
+        self.client.put('/movies/%d/' % self.empire.pk, {
+            'name': 'Empire Strikes Back', 'director': 'Irvin Kershner', 'imdb_score': 8.8,
+            'popularity': 88, 'genre': ['Romance', 'Comedy']}, format='json')
+        self.assertEqual(self.similar(self.star_wars, limit=3),
+                         ['Return of the Jedi', 'THX 1138', 'Empire Strikes Back'])
+        self.assertIndexBuilt()
+        self.client.delete('/movies/%d/' % self.thx.pk)
+        self.assertNotIn('THX 1138', self.similar(self.star_wars))
+        self.assertIndexBuilt()
+        self.client.post('/movies/bulk/', [
+            {'name': 'Movie %d' % index, 'director': 'Director %d' % (index % 3), 'imdb_score': index % 10,
+             'popularity': index, 'genre': ['Genre %d' % (index % 4), 'Drama']} for index in range(30)],
+            format='json')
+        self.assertIndexBuilt()
+
+    def test_late_commits(self):
+        self.similar(self.star_wars)
+        # Committed after later writes were synced, with an older updated_at
+        jedi = create_movie('Return of the Jedi', 'George Lucas', ['Sci-Fi', 'Action', 'Adventure'], 8.3, 83.0)
+        Movie.objects.filter(pk=jedi.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.similar(self.star_wars, limit=1), ['Return of the Jedi'])
+        self.assertIndexBuilt()
+        # Feed lost: every movie is compared with the index
+        self.client.put('/movies/%d/' % self.empire.pk, {
+            'name': 'Empire Strikes Back', 'director': 'Irvin Kershner', 'imdb_score': 8.8,
+            'popularity': 88, 'genre': ['Romance', 'Comedy']}, format='json')
+        self.thx.delete()
+        cache.delete(changes.FEED_KEY)
+        self.assertEqual(self.similar(self.star_wars, limit=3), ['Return of the Jedi', 'Empire Strikes Back',
+                                                                 u'Am\xe9lie'])
+        self.assertIndexBuilt()
+
+    def test_command(self):
+        out = StringIO()
+        call_command('build_similarity_index', output=self.index_file, stdout=out)
+        self.assertIn('Indexed 4 movies, 5 neighbours each', out.getvalue())
+        expected = self.similar(self.star_wars)
+        create_movie('Return of the Jedi', 'George Lucas', ['Sci-Fi', 'Action', 'Adventure'], 8.3, 83.0)
+        similarity_index.clear()
+        # Movies written after the build are applied to the loaded file
+        self.assertEqual(self.similar(self.star_wars, limit=5), ['Return of the Jedi'] + expected)
+        self.assertIndexBuilt()
+
+    def test_local_cache(self):
+        # The command's feed would never reach the servers
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            with self.assertRaises(ImproperlyConfigured):
+                call_command('build_similarity_index', output=self.index_file, stdout=StringIO())
+            similarity_index.clear()
+            with self.assertRaises(ImproperlyConfigured):
+                self.client.get('/movies/%d/similar/' % self.star_wars.pk)
+
+    def test_unavailable(self):
+        # Never built while answering
+        with self.settings(MOVIE_SIMILARITY={'INDEX_FILE': None, 'NEIGHBOURS': 5}):
+            response = self.client.get('/movies/%d/similar/' % self.star_wars.pk)
+        self.assertEqual((response.status_code, response.data['status']), (503, -1))
+        self.similar(self.star_wars)
+        self.addCleanup(setattr, similarity, 'SYNC_ROWS', similarity.SYNC_ROWS)
+        similarity.SYNC_ROWS = 2
+        self.client.post('/movies/bulk/', [
+            {'name': 'Movie %d' % index, 'director': 'George Lucas', 'imdb_score': 8.0, 'popularity': 80,
+             'genre': ['Sci-Fi']} for index in range(3)], format='json')
+        self.assertEqual(self.client.get('/movies/%d/similar/' % self.star_wars.pk).status_code, 503)
+        # The same file is not loaded again, the next one is
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/movies/%d/similar/' % self.thx.pk).status_code, 503)
+        call_command('build_similarity_index', output=self.index_file, stdout=StringIO())
+        os.utime(self.index_file, (time.time() + 10, time.time() + 10))
+        self.assertIn('Movie 0', self.similar(self.star_wars))
+        self.assertIndexBuilt()
+
+
+class SnapshotTestMixin(object):
+
+    """
+        Responses of listings read from the database and from the
+        snapshot, following every page or cursor
+    """
+
+    def setUp(self):
+        super(SnapshotTestMixin, self).setUp()
+        movie_snapshot.clear()
+        self.addCleanup(movie_snapshot.clear)
+
+    def pages(self, path, params, snapshot):
+        params = dict(params)
+        pages = []
+        with self.settings(MOVIES_SNAPSHOT=snapshot):
+            while True:
+                response_cache.clear()
+                response = self.client.get(path, params)
+                pages.append((response.status_code, response.data))
+                if response.status_code != 200:
+                    break
+                if 'next' in response.data:
+                    if not response.data['next']:
+                        break
+                    params['cursor'] = response.data['next']
+                else:
+                    if params.get('page', 1) * 10 >= response.data['count']:
+                        break
+                    params['page'] = params.get('page', 1) + 1
+        return pages
+
+    def assertSameListing(self, path, params):
+        self.assertEqual(self.pages(path, params, True), self.pages(path, params, False), params)
+
+
+class MovieSnapshotTest(SnapshotTestMixin, MovieTestCase):
+
+    """
+        The snapshot answers listings as the database does
+    """
+
+    def setUp(self):
+        super(MovieSnapshotTest, self).setUp()
+        shuffled = random.Random(22)
+        names = [u'Alien', u'alien', u'Star Wars', u'Star Trek', u'\xc9t\xe9', u'Zorro', u'star', u'THX 1138']
+        directors = [u'George Lucas', u'Ridley Scott', u'andrei Tarkovsky', u'\xc9ric Rohmer']
+        genres = [u'Drama', u'Sci-Fi', u'Action', u'War', u'Horror']
+        for index in range(45):
+            # Repeated names and scores, to order ties
+            create_movie(u'%s %d' % (shuffled.choice(names), index % 7), shuffled.choice(directors),
+                         shuffled.sample(genres, shuffled.randint(0, 3)),
+                         shuffled.randint(0, 20) / 2.0, float(shuffled.randint(0, 10) * 10))
+
+    def test_listings(self):
+        sorts = ['', 'name', '-name', 'director_name', 'imdb_score', '-popularity', 'popularity,-imdb_score',
+                 'director_name,-imdb_score,name', '-imdb_score,popularity']
+        filters = [{}, {'imdb_score_min': 3, 'imdb_score_max': 7.5}, {'popularity_min': 50},
+                   {'genre': 'drama,war'}, {'genre': 'Drama,Sci-Fi', 'genre_match': 'all'}, {'genre': 'Comedy'},
+                   {'director': 'george lucas'}, {'name_prefix': 'Star'}, {'name_prefix': u'\xc9'},
+                   {'name_prefix': 'Star', 'genre': 'Action', 'imdb_score_max': 8}]
+        for sort in sorts:
+            for criteria in ('', 'desc'):
+                params = {'sort': sort, 'sort_criteria': criteria}
+                self.assertSameListing('/movies/list/', params)
+                self.assertSameListing('/movies/list/', dict(params, pagination='cursor'))
+                for movie_filter in filters:
+                    self.assertSameListing('/movies/search/', dict(params, **movie_filter))
+                    self.assertSameListing('/movies/search/', dict(params, pagination='cursor', **movie_filter))
+
+    def test_errors(self):
+        for params in ({'page': 9}, {'page': 'last'}, {'cursor': 'broken'}, {'imdb_score_min': 'high'},
+                       {'genre': 'Drama', 'genre_match': 'some'}):
+            self.assertSameListing('/movies/search/', params)
+
+    def test_no_queries(self):
+        with self.settings(MOVIES_SNAPSHOT=True):
+            self.client.get('/movies/list/')
+            with self.assertNumQueries(0):
+                response = self.client.get('/movies/search/', {'genre': 'Drama', 'sort': '-popularity'})
+            self.assertEqual(response.data['status'], 1)
+            # Keyword searches are read from the database
+            with self.assertNumQueries(3):
+                self.client.get('/movies/search/', {'keyword': 'lucas', 'type': 'director'})
+
+
+class MovieSnapshotChangesTest(SnapshotTestMixin, TransactionTestCase):
+
+    """
+        The snapshot follows committed writes through the change feed
+    """
+
+    def setUp(self):
+        super(MovieSnapshotChangesTest, self).setUp()
+        cache.clear()
+        director_resolver.clear()
+        genre_resolver.clear()
+        self.user = AppUser.objects.create_user(
+            username='admin', email='admin@example.com', password='password', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.star_wars = create_movie('Star Wars', 'George Lucas', ['Sci-Fi', 'Action'], 8.7, 87.0)
+        self.alien = create_movie('Alien', 'Ridley Scott', ['Horror', 'Sci-Fi'], 8.5, 85.0)
+
+    def assertSnapshotCurrent(self):
+        for params in ({'sort': 'name'}, {'sort': '-popularity', 'pagination': 'cursor'},
+                       {'genre': 'Sci-Fi', 'sort': 'director_name,imdb_score'}, {'director': 'George Lucas'}):
+            self.assertSameListing('/movies/search/', params)
+
+    def test_writes(self):
+        self.assertSnapshotCurrent()
+        self.client.post('/movies/', {'name': 'THX 1138', 'director': 'George Lucas', 'imdb_score': 6.7,
+                                      'popularity': 67, 'genre': ['Sci-Fi', 'Drama']}, format='json')
+        self.assertSnapshotCurrent()
+        self.client.put('/movies/%d/' % self.alien.pk, {
+            'name': 'Aliens', 'director': 'James Cameron', 'imdb_score': 8.4, 'popularity': 95,
+            'genre': ['Action']}, format='json')
+        self.assertSnapshotCurrent()
+        self.client.delete('/movies/%d/' % self.star_wars.pk)
+        self.assertSnapshotCurrent()
+        self.client.post('/movies/bulk/', [
+            {'name': 'Movie %d' % index, 'director': 'Director %d' % (index % 3), 'imdb_score': index % 10,
+             'popularity': index, 'genre': ['Genre %d' % (index % 4), 'Sci-Fi']} for index in range(30)],
+            format='json')
+        self.assertSnapshotCurrent()
+        director = Director.objects.get(name='George Lucas')
+        director.name = 'G. Lucas'
+        director.save()
+        Genre.objects.get(name='Action').delete()
+        self.assertSnapshotCurrent()
+        self.assertEqual(self.pages('/movies/search/', {'director': 'George Lucas'}, True)[0][1]['count'], 0)
+        # Read the changed movies only, not the catalogue
+        create_movie('Movie 1', 'Director 1', ['Drama'], 1.0, 1.0)
+        with self.settings(MOVIES_SNAPSHOT=True), self.assertNumQueries(2):
+            self.client.get('/movies/list/', {'sort': 'name'})
+
+
+class ChangeFeedTest(SimpleTestCase):
+
+    """
+        The change feed is one bounded cache entry, readers too far behind
+        or with an unknown sequence reload
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_changes_since(self):
+        start = changes.sequence()
+        changes.append((1, 2))
+        changes.append((2, 3))
+        self.assertEqual(changes.changes_since(start), (start + 2, set([1, 2, 3])))
+        self.assertEqual(changes.changes_since(start + 1), (start + 2, set([2, 3])))
+        self.assertEqual(changes.changes_since(start + 2), (start + 2, ()))
+        changes.append(changes.RELOAD)
+        self.assertEqual(changes.changes_since(start), (start + 3, changes.RELOAD))
+
+    def test_bounds(self):
+        start = changes.sequence()
+        for movie_id in range(changes.FEED_ENTRIES + 10):
+            changes.append((movie_id,))
+        self.assertEqual(len(cache.get(changes.FEED_KEY)), changes.FEED_ENTRIES)
+        self.assertEqual(changes.changes_since(start)[1], changes.RELOAD)
+        self.assertEqual(changes.changes_since(start + 20)[1], set(range(20, changes.FEED_ENTRIES + 10)))
+        # Entries over FEED_IDS become RELOAD
+        changes.append(tuple(range(changes.FEED_IDS + 1)))
+        self.assertEqual(changes.changes_since(start + 20)[1], changes.RELOAD)
+        # Sequence evicted and restarted, feed lost
+        current = changes.sequence()
+        cache.delete(changes.SEQUENCE_KEY)
+        cache.set(changes.SEQUENCE_KEY, 5)
+        self.assertEqual(changes.changes_since(current), (5, changes.RELOAD))
+        cache.delete(changes.FEED_KEY)
+        changes.append((1,))
+        self.assertEqual(changes.changes_since(4), (6, changes.RELOAD))
+        self.assertEqual(changes.changes_since(5), (6, set([1])))
+
+
+class RequestMetricsTest(AdminMovieTestCase):
+
+    """
+        Requests are measured in a Server-Timing header and in histograms
+        per view served to admins by /metrics
+    """
+
+    def setUp(self):
+        super(RequestMetricsTest, self).setUp()
+        request_metrics.reset()
+        self.addCleanup(request_metrics.reset)
+        create_movie('Star Wars', 'George Lucas', ['Sci-Fi', 'Action'], 8.7, 87.0)
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/movies/list/')
+        timings = dict(timing.split(';', 1) for timing in response['Server-Timing'].split(', '))
+        self.assertEqual(sorted(timings), ['db', 'render', 'total'])
+        self.assertIn('desc="%d queries"' % len(queries), timings['db'])
+
+    def test_metrics(self):
+        self.client.get('/movies/list/')
+        self.client.get('/movies/list/', {'page': 2})
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        lines = response.content.splitlines()
+        self.assertIn('# TYPE moviesforall_request_duration_seconds histogram', lines)
+        self.assertIn('moviesforall_request_duration_seconds_bucket{view="ViewMovies",method="GET",le="+Inf"} 2',
+                      lines)
+        self.assertIn('moviesforall_request_duration_seconds_count{view="ViewMovies",method="GET"} 2', lines)
+        self.assertIn('moviesforall_response_size_bytes_count{view="ViewMovies",method="GET"} 2', lines)
+        self.assertTrue(any(line.startswith('moviesforall_response_cache_misses_total ') for line in lines))
+        buckets = [int(line.rsplit(' ', 1)[1]) for line in lines
+                   if line.startswith('moviesforall_request_db_queries_bucket{view="ViewMovies"')]
+        self.assertEqual(buckets, sorted(buckets))
+
+    def test_admin_only(self):
+        user = AppUser.objects.create_user(username='user', email='user@example.com', password='password')
+        self.client.force_authenticate(user=user)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+
+@override_settings(DATABASE_REPLICAS={'ALIASES': ['replica_1', 'replica_2'], 'PIN_SECONDS': 5})
+class ReplicaRouterTest(SimpleTestCase):
+
+    """
+        Reads of safe requests go to a replica, chosen once per request,
+        unless the client wrote in the last PIN_SECONDS
+    """
+
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.middleware = routers.ReplicaPinningMiddleware()
+        routers.lags.clear()
+        self.addCleanup(routers.lags.clear)
+        self.addCleanup(routers.local.__dict__.pop, 'state', None)
+
+    def read(self, request, write=False):
+        # Returns the databases read by a request and its response
+        self.middleware.process_request(request)
+        databases = [self.router.db_for_read(Movie)]
+        if write:
+            self.assertEqual(self.router.db_for_write(Movie), 'default')
+        databases.append(self.router.db_for_read(Movie))
+        return databases, self.middleware.process_response(request, HttpResponse())
+
+    def test_round_robin(self):
+        first = self.read(RequestFactory().get('/movies/list/'))[0]
+        second = self.read(RequestFactory().get('/movies/list/'))[0]
+        self.assertEqual(len(set(first)), 1)
+        self.assertEqual(sorted(set(first + second)), ['replica_1', 'replica_2'])
+        self.assertEqual(self.router.db_for_read(Movie), 'default')
+        self.assertEqual(self.read(RequestFactory().post('/movies/'))[0], ['default', 'default'])
+
+    def test_pinned_after_write(self):
+        databases, response = self.read(RequestFactory().get('/movies/list/'), write=True)
+        self.assertEqual(databases[1], 'default')
+        cookie = response.cookies[routers.PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], 5)
+        request = RequestFactory().get('/movies/list/')
+        request.COOKIES[routers.PIN_COOKIE] = cookie.value
+        self.assertEqual(self.read(request)[0], ['default', 'default'])
+        request.COOKIES[routers.PIN_COOKIE] = '%.3f' % (time.time() - 1)
+        self.assertNotEqual(self.read(request)[0][0], 'default')
+        self.assertNotIn(routers.PIN_COOKIE, self.read(RequestFactory().get('/movies/list/'))[1].cookies)
+
+    def test_least_lag(self):
+        replica_lags = {'replica_1': 3.0, 'replica_2': 0.5}
+        self.addCleanup(setattr, routers, 'replica_lag', routers.replica_lag)
+        routers.replica_lag = lambda alias, options: replica_lags[alias]
+        with self.settings(DATABASE_REPLICAS={'ALIASES': ['replica_1', 'replica_2'], 'SELECTION': 'least_lag',
+                                              'MAX_LAG': 2, 'LAG_CHECK_SECONDS': 0}):
+            self.assertEqual(self.read(RequestFactory().get('/'))[0], ['replica_2', 'replica_2'])
+            replica_lags.update(replica_1=1.0, replica_2=None)
+            self.assertEqual(self.read(RequestFactory().get('/'))[0], ['replica_1', 'replica_1'])
+            # Every replica too far behind or down
+            replica_lags.update(replica_1=10.0)
+            self.assertEqual(self.read(RequestFactory().get('/'))[0], ['default', 'default'])
+
+    def test_primary_reads(self):
+        self.middleware.process_request(RequestFactory().get('/movies/list/'))
+        with routers.primary_reads():
+            self.assertEqual(self.router.db_for_read(Movie), 'default')
+        self.assertNotEqual(self.router.db_for_read(Movie), 'default')
+        with routers.primary_reads():
+            self.router.db_for_write(Movie)
+        # Still pinned after a write
+        self.assertEqual(self.router.db_for_read(Movie), 'default')
+
+    def test_replica_in_sync(self):
+        replica_lags = {'replica_1': 0.0, 'replica_2': 2.0}
+        self.addCleanup(setattr, routers, 'replica_lag', routers.replica_lag)
+        routers.replica_lag = lambda alias, options: replica_lags[alias]
+        self.assertTrue(routers.replica_in_sync())
+        self.middleware.process_request(RequestFactory().get('/movies/list/'))
+        self.assertTrue(routers.replica_in_sync())
+        replica = self.router.db_for_read(Movie)
+        self.assertEqual(routers.replica_in_sync(), replica == 'replica_1')
+        self.middleware.process_request(RequestFactory().post('/movies/'))
+        self.router.db_for_read(Movie)
+        self.assertTrue(routers.replica_in_sync())
+
+    def test_migrate(self):
+        self.assertFalse(self.router.allow_migrate('replica_1', 'movies'))
+        self.assertIsNone(self.router.allow_migrate('default', 'movies'))
+
+
+@skipUnless('replica' in settings.DATABASES, 'Needs a replica alias in DATABASES')
+@override_settings(DATABASE_REPLICAS={'ALIASES': ['replica'], 'PIN_SECONDS': 5})
+class ReplicaReadsTest(TransactionTestCase):
+
+    """
+        With a second database, GET requests read the replica and a client
+        that wrote reads the primary
+    """
+
+    multi_db = True
+
+    def setUp(self):
+        cache.clear()
+        response_cache.clear()
+        director_resolver.clear()
+        genre_resolver.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(AppUser.objects.create_user(
+            username='admin', email='admin@example.com', password='password', is_staff=True))
+        create_movie('Star Wars', 'George Lucas', ['Sci-Fi', 'Action'], 8.7, 87.0)
+
+    def queries(self, method, path, data=None):
+        response_cache.clear()
+        with CaptureQueriesContext(connections['default']) as primary:
+            with CaptureQueriesContext(connections['replica']) as replica:
+                if method == 'get':
+                    response = self.client.get(path, data)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                else:
+                    response = getattr(self.client, method)(path, data, format='json')
+        self.assertEqual(response.status_code, 200)
+        return len(primary), len(replica)
+
+    def test_reads(self):
+        self.assertEqual(self.queries('get', '/movies/export/')[0], 0)
+        primary, replica = self.queries('post', '/movies/', {
+            'name': 'THX 1138', 'director': 'George Lucas', 'imdb_score': 6.7, 'popularity': 67,
+            'genre': ['Sci-Fi', 'Drama']})
+        self.assertEqual(replica, 0)
+        # Pinned by the cookie of the write
+        primary, replica = self.queries('get', '/movies/export/')
+        self.assertEqual(replica, 0)
+        self.client.cookies.pop(routers.PIN_COOKIE)
+        self.assertTrue(self.queries('get', '/movies/export/')[1])
+
+    def test_cached_reads(self):
+        # Cache misses of the read endpoints are read from the replica,
+        # and kept when it is in sync
+        for path, data in (('/movies/list/', None), ('/movies/search/', {'genre': 'Action'})):
+            primary, replica = self.queries('get', path, data)
+            self.assertTrue(replica)
+            self.assertEqual(primary, 0)
+            with CaptureQueriesContext(connections['replica']) as replica:
+                self.assertEqual(self.client.get(path, data).status_code, 200)
+            self.assertEqual(len(replica), 0)
+
+    def test_replica_behind(self):
+        # Nothing read from a replica behind the primary is kept
+        with self.settings(DATABASE_REPLICAS={'ALIASES': ['replica'], 'LAG_QUERY': 'SELECT 5'}):
+            self.queries('get', '/movies/list/')
+            with CaptureQueriesContext(connections['replica']) as replica:
+                self.client.get('/movies/list/')
+        self.assertTrue([query for query in replica.captured_queries if 'movies_movie' in query['sql']])
+
+    def test_token_read_from_replica(self):
+        user = AppUser.objects.get(username='admin')
+        token = Token.objects.get_or_create(user=user)[0]
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        with CaptureQueriesContext(connections['default']) as primary:
+            with CaptureQueriesContext(connections['replica']) as replica:
+                self.assertEqual(self.client.get('/movies/list/').status_code, 200)
+        self.assertTrue([query for query in replica.captured_queries if 'authtoken' in query['sql']])
+        self.assertFalse([query for query in primary.captured_queries if 'authtoken' in query['sql']])
+
+    def test_missing_token_read_from_primary(self):
+        # A token newer than the replica's copy is looked up on the primary
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + 'x' * 40)
+        with CaptureQueriesContext(connections['default']) as primary:
+            self.assertEqual(self.client.get('/movies/list/').status_code, 401)
+        self.assertTrue([query for query in primary.captured_queries if 'authtoken' in query['sql']])
+
+
+class CountingFile(object):
+
+    """
+        File like object generating an endless JSON array of movies,
+        counting the bytes read from it
+    """
+
+    record = json.dumps({'name': 'Movie', 'director': 'Director', 'genre': [' Drama'],
+                         '99popularity': 50.0, 'imdb_score': 5.0}) + ', '
+
+    def __init__(self):
+        self.bytes_read = 0
+        self.pending = '['
+
+    def read(self, size):
+        while len(self.pending) < size:
+            self.pending += self.record
+        data, self.pending = self.pending[:size], self.pending[size:]
+        self.bytes_read += len(data)
+        return data
+
+
+class ReadMoviesTest(SimpleTestCase):
+
+    """
+        Streaming reader used by load_movies
+    """
+
+    movies = [{'name': 'Movie %d' % index, 'director': ' Director ', 'genre': ['Drama', ' War'],
+               '99popularity': 10.5 * index, 'imdb_score': index} for index in range(50)]
+
+    def test_json_array(self):
+        data = json.dumps(self.movies, indent=2)
+        # Small chunks so values are split across reads
+        for chunk_size in (1, 7, 64, len(data)):
+            values = list(iter_json_values(StringIO(data), chunk_size=chunk_size))
+            self.assertEqual(values, self.movies)
+
+    def test_json_lines(self):
+        data = '\n'.join(json.dumps(movie) for movie in self.movies) + '\n'
+        self.assertEqual(list(iter_json_values(StringIO(data), chunk_size=16)), self.movies)
+
+    def test_normalisation(self):
+        movie = next(read_movies(StringIO(json.dumps(self.movies[1:2]))))
+        self.assertEqual(movie['popularity'], 10.5)
+        self.assertNotIn('99popularity', movie)
+        self.assertEqual(movie['director'], 'Director')
+        self.assertEqual(movie['genre'], ['Drama', 'War'])
+
+    def test_constant_memory(self):
+        data_file = CountingFile()
+        movies = iter_json_values(data_file, chunk_size=1024)
+        for index in range(10000):
+            next(movies)
+            # Never more than a couple of chunks ahead of the decoded values
+            self.assertLess(data_file.bytes_read, len(data_file.record) * (index + 1) + 3 * 1024)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_values(StringIO('[{"name": "Movie"}, {"name"')))
+        with self.assertRaises(ValueError):
+            list(iter_json_values(StringIO('[{"name": "Movie"}')))
+        for data in ('[,,]', '[,{"name": "Movie"}]', '[{"name": "Movie"},]', '[{"name": "Movie"},,{}]',
+                     '[{"name": "Movie"} {}]'):
+            with self.assertRaises(ValueError):
+                list(iter_json_values(StringIO(data), chunk_size=4))
+        self.assertEqual(list(iter_json_values(StringIO('[]\n[ {} , [1] ]'), chunk_size=4)), [{}, [1]])
+
+    def test_invalid_early(self):
+        # Stops once a value's worth is buffered, not at the end of the file
+        data_file = StringIO('[{"name": "Movie"}, {"name" "Movie"}, ' + '{"name": "Movie"}, ' * 100000 + '{}]')
+        with self.assertRaises(ValueError):
+            list(iter_json_values(data_file, chunk_size=1024, max_value_size=4096))
+        self.assertLess(data_file.tell(), 4096 + 2 * 1024)
+
+    def test_csv_columns(self):
+        # By header name, in any order, unknown columns ignored
+        data = ('popularity,rank,genre,name,imdb_score,director\r\n'
+                '83.0,1,"[""Comedy|Romance"", "" ""]",Am\xc3\xa9lie,8.3, Jean-Pierre Jeunet \r\n')
+        self.assertEqual(list(read_csv_movies(StringIO(data))), [{
+            'name': u'Am\xe9lie', 'director': 'Jean-Pierre Jeunet', 'genre': ['Comedy|Romance'],
+            'imdb_score': 8.3, 'popularity': 83.0}])
+        with self.assertRaises(ValueError):
+            list(read_csv_movies(StringIO('name,director,genre,popularity\r\nMovie,Director,[],1\r\n')))
+        with self.assertRaises(ValueError):
+            list(read_csv_movies(StringIO('name,director,genre,imdb_score,popularity\r\n'
+                                          'Movie,Director,Drama|War,1,1\r\n')))
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeSession(object):
+
+    """
+        Session failing the first request of every movie with a 503
+    """
+
+    def __init__(self):
+        self.posted = []
+
+    def post(self, url, data, timeout):
+        self.posted.append(json.loads(data)['name'])
+        if self.posted.count(json.loads(data)['name']) == 1:
+            return FakeResponse(503, {})
+        return FakeResponse(200, {'status': 1})
+
+
+class BrokenResponse(FakeResponse):
+
+    def json(self):
+        raise ValueError('No JSON object could be decoded')
+
+
+class FailingSession(FakeSession):
+
+    """
+        Session timing out, answering with HTML or a rejection, by movie
+    """
+
+    def post(self, url, data, timeout):
+        name = json.loads(data)['name']
+        self.posted.append(name)
+        if name.startswith('Timeout'):
+            raise requests.Timeout()
+        if name.startswith('Broken'):
+            raise requests.exceptions.ChunkedEncodingError()
+        if name.startswith('Html'):
+            return BrokenResponse(200, None)
+        if name.startswith('Exists'):
+            return FakeResponse(200, {'status': -1})
+        return FakeResponse(200, {'status': 1})
+
+
+class LostResponseSession(FakeSession):
+
+    """
+        Session saving every movie but timing out on its first response
+    """
+
+    def post(self, url, data, timeout):
+        name = json.loads(data)['name']
+        self.posted.append(name)
+        if self.posted.count(name) == 1:
+            raise requests.exceptions.ReadTimeout()
+        return FakeResponse(200, {'status': -1, 'errors': 'Movie already exists'})
+
+
+class RefusedSession(FakeSession):
+
+    """
+        Session refusing the first connection of every movie, whose name is
+        already in the catalogue
+    """
+
+    def post(self, url, data, timeout):
+        name = json.loads(data)['name']
+        self.posted.append(name)
+        if self.posted.count(name) == 1:
+            raise requests.exceptions.ConnectionError('Connection refused')
+        return FakeResponse(200, {'status': -1, 'errors': 'Movie already exists'})
+
+
+class RemoteLoaderTest(SimpleTestCase):
+
+    """
+        Concurrent loader used by load_movies against a server
+    """
+
+    def test_retry_server_errors(self):
+        loader = RemoteLoader('http://localhost', concurrency=3, backoff=0)
+        loader.session = FakeSession()
+        loader.load({'name': 'Movie %d' % index} for index in range(20))
+        self.assertEqual(loader.created, 20)
+        self.assertEqual(loader.retried, 20)
+        self.assertEqual(len(loader.session.posted), 40)
+
+    def test_failures(self):
+        # Every movie is counted, failures do not stop the workers
+        loader = RemoteLoader('http://localhost', concurrency=2, retries=2, backoff=0)
+        loader.session = FailingSession()
+        loader.load({'name': '%s %d' % (kind, index)} for index in range(5)
+                    for kind in ('Timeout', 'Broken', 'Html', 'Exists', 'Movie'))
+        self.assertEqual((loader.created, loader.rejected, loader.failed), (5, 5, 15))
+        self.assertEqual(loader.session.posted.count('Timeout 0'), 3)
+        self.assertEqual(loader.session.posted.count('Html 0'), 1)
+
+    def test_exists_after_retry(self):
+        # Saved by the attempt that timed out
+        loader = RemoteLoader('http://localhost', concurrency=2, backoff=0)
+        loader.session = LostResponseSession()
+        loader.load({'name': 'Movie %d' % index} for index in range(5))
+        self.assertEqual((loader.created, loader.rejected, loader.failed), (5, 0, 0))
+
+    def test_exists_after_refused_connection(self):
+        # The refused attempt did not reach the server, the movie was there
+        loader = RemoteLoader('http://localhost', concurrency=2, backoff=0)
+        loader.session = RefusedSession()
+        loader.load({'name': 'Movie %d' % index} for index in range(5))
+        self.assertEqual((loader.created, loader.rejected, loader.failed), (0, 5, 0))
+        self.assertEqual(loader.retried, 5)
@@ -1,11 +1,17 @@
 from django.conf.urls import url
 
-from .views import Movies, ViewMovies, UpdateMovie, MovieDetail, MovieSearch
+from .views import (Movies, BulkMovies, ViewMovies, UpdateMovie, MovieDetail, MovieSearch,
+                    ResponseCacheStats, MovieExport, MovieFacets, MovieSimilar)
 
 urlpatterns = [
     url(r'^$', Movies.as_view(), name="movies"),
+    url(r'^bulk/$', BulkMovies.as_view()),
     url(r'^(?P<pk>[0-9]+)/$', UpdateMovie.as_view()),
     url(r'^(?P<pk>[0-9]+)/view/$', MovieDetail.as_view()),
+    url(r'^(?P<pk>[0-9]+)/similar/$', MovieSimilar.as_view()),
     url(r'^list/$', ViewMovies.as_view(), name="movies"),
     url(r'^search/$', MovieSearch.as_view()),
+    url(r'^facets/$', MovieFacets.as_view()),
+    url(r'^cache_stats/$', ResponseCacheStats.as_view()),
+    url(r'^export/$', MovieExport.as_view()),
 ]
\ No newline at end of file
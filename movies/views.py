@@ -1,9 +1,35 @@
+import hashlib
+from calendar import timegm
+
+from django.core.cache import cache
+from django.db import router, transaction
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
 from rest_framework import generics, permissions
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.response import Response
-
-from .serializers import MovieSerializer, MovieListSerializer
-from .models import Movie, Genre, Director
+from rest_framework.views import APIView
+
+from .serializers import MovieSerializer, MovieListSerializer, movie_list_data
+from .export import iter_movies, jsonl_lines, csv_lines
+from .models import Movie, director_resolver, genre_resolver
+from .bulk import bulk_save_movies, CREATED, UPDATED
+from .search import full_text_search
+from .facets import global_facets, search_facets
+from .filters import MovieFilters, MovieSort
+from .similarity import similarity_index, similarity_options
+from .snapshot import movie_snapshot, snapshot_enabled
+from .pagination import MovieCursorPagination, MoviePageNumberPagination, RowsPageNumberPagination
+from .cache import response_cache, catalogue_version, catalogue_modified, shared_cache
 from app_user.permissions import IsAdminUser
+from movies_for_all.routers import replica_in_sync
+
+
+CONDITIONAL_HEADERS = ('HTTP_IF_NONE_MATCH', 'HTTP_IF_MATCH',
+                       'HTTP_IF_MODIFIED_SINCE', 'HTTP_IF_UNMODIFIED_SINCE')
 
 
 class Movies(generics.GenericAPIView):
@@ -41,21 +67,215 @@ class Movies(generics.GenericAPIView):
             genres = data['genre']
             del data['director']
             del data['genre']
-            # Save movie data
-            movie = Movie(**data)
-            # Create director if not existing
-            director = Director.objects.get_or_create(name=director_name)
-            movie.director = director[0]
-            movie.save()
-            for genre_name in genres:
-                # Create genre if not existing
-                genre = Genre.objects.get_or_create(name=genre_name)
-                movie.genre.add(genre[0])
+            with transaction.atomic():
+                # Save movie data
+                movie = Movie(**data)
+                # Director and genres are created if not existing
+                movie.director_id = director_resolver.resolve_one(director_name)
+                movie.save()
+                movie.genre.add(*genre_resolver.resolve(genres).values())
             return Response({'status': 1})
         return Response({'status': -1, 'errors': movie_serializer.errors})
 
 
-class ViewMovies(generics.GenericAPIView):
+class BulkMovies(generics.GenericAPIView):
+
+    """
+        API to create or update many movies at once.
+        * IsAdminUser permission is set as movies can be created
+          by admins only.
+        * URL: /movies/bulk/
+            - Update existing movies instead of skipping them: /movies/bulk/?upsert=true
+        * METHOD: POST
+        * Headers:
+            - Content-Type: Application/Json
+            - Authorization: Token <token> (Space after Token is required)
+        * Data example:
+            - [{"name":"Movie name", "director": "Director Name","imdb_score":8.5,"popularity": 85, "genre":
+             ["<Genre 1>", "<Genre 2>"]}, ...]
+        * All movies are saved in one transaction, in batches of batch_size
+          movies. Directors and genres are looked up and created in a
+          constant number of queries per batch: a request runs a fixed
+          number of queries per batch_size movies, not per request
+        * A status is returned for every movie, in the order they were given:
+            - {"name": "Movie name", "status": 1, "result": "created"/"updated"}
+            - {"name": "Movie name", "status": -1, "errors": ...}
+    """
+
+    queryset = Movie.objects.all()
+    permission_classes = (permissions.IsAuthenticated,
+                          IsAdminUser)
+    batch_size = 100
+
+    def post(self, request, *args, **kwargs):
+        data = request.data
+        if not isinstance(data, list):
+            return Response({'status': -1, 'errors': 'Expected a list of movies'})
+        movie_serializer = MovieSerializer(data=data, many=True)
+        valid = movie_serializer.is_valid()
+        if valid:
+            errors = [{}] * len(data)
+        else:
+            errors = movie_serializer.errors
+        upsert = request.query_params.get('upsert') == 'true'
+        statuses = []
+        movies = []
+        names = set()
+        for index, movie_data in enumerate(data):
+            if errors[index]:
+                name = movie_data.get('name') if isinstance(movie_data, dict) else None
+                statuses.append({'name': name, 'status': -1, 'errors': errors[index]})
+                continue
+            if valid:
+                movie = movie_serializer.validated_data[index]
+            else:
+                # Validated data is dropped when any movie is invalid
+                movie = movie_serializer.child.run_validation(movie_data)
+            if movie['name'] in names:
+                statuses.append({'name': movie['name'], 'status': -1,
+                                 'errors': 'Movie repeated in request'})
+                continue
+            names.add(movie['name'])
+            statuses.append(None)
+            movies.append((index, movie))
+        with transaction.atomic():
+            for start in range(0, len(movies), self.batch_size):
+                batch = movies[start:start + self.batch_size]
+                results = bulk_save_movies([movie for index, movie in batch], update=upsert)
+                for (index, movie), result in zip(batch, results):
+                    if result in (CREATED, UPDATED):
+                        statuses[index] = {'name': movie['name'], 'status': 1, 'result': result}
+                    else:
+                        statuses[index] = {'name': movie['name'], 'status': -1,
+                                           'errors': 'Movie already exists'}
+        return Response({'status': 1, 'movies': statuses})
+
+
+class CachedResponseMixin(object):
+
+    """
+        Serves read responses from movies.cache.response_cache
+        * Only the query params in cache_params are part of the key
+        * Cached until a movie, director or genre is written
+        * Responses have a strong ETag and a Last-Modified header. By
+          default both follow the catalogue version, so a matching
+          If-None-Match (or If-Modified-Since) is answered with 304
+          before anything is read or serialized
+        * With a process local cache (shared_cache() False) each process
+          has its own version: validators only follow the writes of the
+          process answering (see movies.cache)
+    """
+
+    cache_params = ()
+
+    def get_etag(self, request, key, *args, **kwargs):
+        # The key holds the catalogue version and the normalised params
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def get_last_modified(self, request, *args, **kwargs):
+        return catalogue_modified()
+
+    def cached_response(self, request, view_method, *args, **kwargs):
+        key = response_cache.make_key(request.path, request.query_params, self.cache_params)
+        response = None
+        if any(header in request.META for header in CONDITIONAL_HEADERS):
+            etag, last_modified = self.get_validators(request, key, *args, **kwargs)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            data = response_cache.get(key)
+            if data is not None:
+                response = Response(data)
+            else:
+                # Kept under the version read before the query, unless the
+                # replica read may be older than that version
+                response = view_method(request, *args, **kwargs)
+                if response.status_code == 200 and replica_in_sync():
+                    response_cache.set(key, response.data)
+        if response.status_code in (200, 304):
+            etag, last_modified = self.get_validators(request, key, *args, **kwargs)
+            if etag is not None:
+                response['ETag'] = quote_etag(etag)
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def get_validators(self, request, key, *args, **kwargs):
+        etag = self.get_etag(request, key, *args, **kwargs)
+        last_modified = self.get_last_modified(request, *args, **kwargs)
+        if last_modified is not None:
+            last_modified = timegm(last_modified.utctimetuple())
+        return etag, last_modified
+
+
+class MovieListMixin(object):
+
+    """
+        Paginated response for movie listings, by page number (default)
+        or by cursor (?pagination=cursor, see MovieCursorPagination)
+        * The count given with page numbers is the paginator's one, cached
+          until the catalogue changes
+        * Pages are read as plain rows and built by movie_list_data, the
+          same data MovieListSerializer gives
+        * Rows equal on the sort fields are ordered by id, in the direction
+          of the last sort field
+        * With settings.MOVIES_SNAPSHOT, snapshot_response answers from the
+          in memory catalogue (movies.snapshot) with the same data
+    """
+
+    pagination_class = MoviePageNumberPagination
+    renderer_classes = (JSONRenderer, BrowsableAPIRenderer)
+
+    def paginated_response(self, request, queryset):
+        ordering = MovieSort().sort_ordering(request)
+        queryset = queryset.list_rows()
+        if MovieCursorPagination.requested(request):
+            paginator = MovieCursorPagination()
+            page = paginator.paginate_queryset(queryset, request, ordering)
+            return Response({"status": 1, "movies": movie_list_data(page, queryset.db),
+                             "next": paginator.next_cursor})
+        if ordering:
+            id_prefix = '-' if ordering[-1].startswith('-') else ''
+            queryset = queryset.order_by(*(ordering + (id_prefix + 'id',)))
+        elif not queryset.ordered:
+            queryset = queryset.order_by('id')
+        page = list(self.paginate_queryset(queryset))
+        return Response({"status": 1, "count": self.paginator.page.paginator.count,
+                         "movies": movie_list_data(page, queryset.db)})
+
+    def snapshot_response(self, request, filtered=False):
+
+        """
+            Response read from the snapshot, None when it is not enabled or
+            not usable with the database
+            * filtered: apply the MovieFilters params
+        """
+
+        if not snapshot_enabled():
+            return None
+        ordering = MovieSort().sort_ordering(request)
+        with movie_snapshot.lock:
+            if not movie_snapshot.refresh():
+                return None
+            rows = movie_snapshot.select(ordering, request if filtered else None)
+            if MovieCursorPagination.requested(request):
+                paginator = MovieCursorPagination()
+                cursor = request.query_params.get('cursor')
+                if cursor:
+                    rows = movie_snapshot.after(rows, ordering, paginator.decode_cursor(cursor, ordering))
+                page = movie_snapshot.list_rows(rows[:paginator.page_size + 1])
+                next_cursor = None
+                if len(page) > paginator.page_size:
+                    page = page[:paginator.page_size]
+                    next_cursor = paginator.encode_cursor(page[-1], ordering)
+                return Response({"status": 1, "movies": movie_snapshot.movie_list_data(page),
+                                 "next": next_cursor})
+            paginator = RowsPageNumberPagination()
+            page = movie_snapshot.list_rows(paginator.paginate_queryset(rows, request, view=self))
+            return Response({"status": 1, "count": paginator.page.paginator.count,
+                             "movies": movie_snapshot.movie_list_data(page)})
+
+
+class ViewMovies(CachedResponseMixin, MovieListMixin, generics.GenericAPIView):
 
     """
         API to view all movies
@@ -70,24 +290,26 @@ class ViewMovies(generics.GenericAPIView):
         * Pagination is done. Query param: page
             - If no page param lists first 10 results (/movies/list/)
         * No.of results per page is set in settings.REST_FRAMEWORK
+        * Cursor pagination: /movies/list/?pagination=cursor, then
+          /movies/list/?cursor=<next> with the same sort params
         Query params:
             1. sort: name/director_name/imdb_score
             2. sort_criteria: asc/desc
     """
 
-    queryset = Movie.objects.all()
+    queryset = Movie.objects.with_relations()
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = MovieListSerializer
+    cache_params = ('sort', 'sort_criteria', 'page', 'pagination', 'cursor')
 
     def get(self, request, *args, **kwargs):
-        return self.list(request, *args, **kwargs)
+        return self.cached_response(request, self.list, *args, **kwargs)
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        movie_queryset = MovieSort().movie_sorting(request, queryset)
-        paginated_queryset = self.paginate_queryset(movie_queryset)
-        serializer = self.get_serializer(paginated_queryset, many=True)
-        return Response({"status": 1, "count": queryset.count(), "movies": serializer.data})
+        response = self.snapshot_response(request)
+        if response is not None:
+            return response
+        return self.paginated_response(request, self.get_queryset())
 
 
 class UpdateMovie(generics.GenericAPIView):
@@ -121,17 +343,23 @@ class UpdateMovie(generics.GenericAPIView):
         movie_instance = self.get_object()
         serializer = self.get_serializer(movie_instance, data=request.data)
         if serializer.is_valid():
-            movie_instance.name = data['name']
-            movie_instance.imdb_score = data['imdb_score']
-            movie_instance.popularity = data['popularity']
-            director = Director.objects.get_or_create(name=data['director'])
-            movie_instance.director = director[0]
-            movie_instance.save()
-            movie_instance.genre.all().delete()
-            for genre_name in data['genre']:
-                # Create genre if not existing
-                genre = Genre.objects.get_or_create(name=genre_name)
-                movie_instance.genre.add(genre[0])
+            with transaction.atomic():
+                movie_instance.name = data['name']
+                movie_instance.imdb_score = data['imdb_score']
+                movie_instance.popularity = data['popularity']
+                # Directors and genres are looked up (or created) in batches
+                movie_instance.director_id = director_resolver.resolve_one(data['director'])
+                genre_ids = set(genre_resolver.resolve(data['genre']).values())
+                # Saved before the links change: their receiver rebuilds the
+                # search document in the database, a later save would write
+                # back the one in memory
+                movie_instance.save()
+                # Only the links that changed are written, genres are shared
+                current_ids = set(movie_instance.genre.values_list('id', flat=True))
+                if current_ids - genre_ids:
+                    movie_instance.genre.remove(*(current_ids - genre_ids))
+                if genre_ids - current_ids:
+                    movie_instance.genre.add(*(genre_ids - current_ids))
             return Response({"status": 1})
         return Response({"status": -1, "errors": serializer.errors})
 
@@ -141,7 +369,7 @@ class UpdateMovie(generics.GenericAPIView):
         return Response({"status": 1})
 
 
-class MovieDetail(generics.GenericAPIView):
+class MovieDetail(CachedResponseMixin, generics.GenericAPIView):
 
     """
         Api to view a particular movie
@@ -152,87 +380,274 @@ class MovieDetail(generics.GenericAPIView):
         * Headers:
             - Content-Type: Application/Json
             - Authorization: Token <token> (Space after Token is required)
+            - If-None-Match: <ETag> gives 304 when the movie is unchanged
     """
 
     serializer_class = MovieListSerializer
-    queryset = Movie.objects.all()
+    queryset = Movie.objects.with_relations()
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request, *args, **kwargs):
-        return self.detail(request, *args, **kwargs)
+        return self.cached_response(request, self.detail, *args, **kwargs)
+
+    def updated_at_key(self):
+        return 'movies:updated_at:%s:%s' % (catalogue_version(), self.kwargs['pk'])
+
+    def get_updated_at(self):
+        # Shared by the ETag and Last-Modified, cached with the catalogue
+        # version when the cache is shared, read from the movie otherwise
+        if not hasattr(self, 'updated_at'):
+            self.updated_at = cache.get(self.updated_at_key()) if shared_cache() else None
+            if self.updated_at is None:
+                self.set_updated_at(Movie.objects.filter(
+                    pk=self.kwargs['pk']).values_list('updated_at', flat=True).first())
+        return self.updated_at
+
+    def set_updated_at(self, updated_at):
+        self.updated_at = updated_at
+        if updated_at is not None and shared_cache() and replica_in_sync():
+            cache.set(self.updated_at_key(), updated_at, 60 * 60)
+
+    def get_etag(self, request, key, *args, **kwargs):
+        updated_at = self.get_updated_at()
+        if updated_at is None:
+            return None
+        return hashlib.md5('%s:%s' % (self.kwargs['pk'], updated_at.isoformat())).hexdigest()
+
+    def get_last_modified(self, request, *args, **kwargs):
+        return self.get_updated_at()
 
     def detail(self, request, *args, **kwargs):
         movie = self.get_object()
+        self.set_updated_at(movie.updated_at)
         movie_serializer = self.get_serializer(movie)
         return Response({"status": 1, "movie": movie_serializer.data})
 
 
-class MovieSearch(generics.GenericAPIView):
+class MovieSimilar(CachedResponseMixin, generics.GenericAPIView):
+
+    """
+        Api to view the movies most similar to a movie
+        * Any logged in user can view similar movies
+        * URL: /movies/<id>/similar/
+            - Query params: limit, number of movies (default 10, at most
+              settings.MOVIE_SIMILARITY['NEIGHBOURS'])
+        * METHOD: GET
+        * Movies sharing genres, director and close scores come first,
+          with their similarity (cosine, 0-1). Neighbours are read from
+          the in memory index of movies.similarity
+    """
+
+    permission_classes = (permissions.IsAuthenticated,)
+    renderer_classes = (JSONRenderer, BrowsableAPIRenderer)
+    cache_params = ('limit',)
+    default_limit = 10
+
+    def get(self, request, *args, **kwargs):
+        return self.cached_response(request, self.similar, *args, **kwargs)
+
+    def get_limit(self, request):
+        maximum = similarity_options()['NEIGHBOURS']
+        limit = request.query_params.get('limit') or min(self.default_limit, maximum)
+        try:
+            limit = int(limit)
+            if not 0 < limit <= maximum:
+                raise ValueError
+        except ValueError:
+            raise ValidationError({'limit': ['Should be a number from 1 to %d.' % maximum]})
+        return limit
+
+    def similar(self, request, *args, **kwargs):
+        limit = self.get_limit(request)
+        similar = similarity_index.similar(int(kwargs['pk']), limit)
+        if similar is None:
+            raise NotFound()
+        similarities = dict(similar)
+        rows = dict((row['id'], row) for row in Movie.objects.filter(id__in=similarities).list_rows())
+        # Neighbours deleted since the last sync are skipped
+        rows = [rows[movie_id] for movie_id, similarity in similar if movie_id in rows]
+        movies = movie_list_data(rows)
+        for row, movie in zip(rows, movies):
+            movie['similarity'] = round(similarities[row['id']], 4)
+        return Response({"status": 1, "movies": movies})
+
+
+class MovieSearchMixin(object):
+
+    """
+        Filters movies by the search params (keyword, type, q) and by the
+        filters of MovieFilters, shared by the search and its facets
+    """
+
+    search_query_params = ('keyword', 'type', 'q') + MovieFilters.params()
+
+    def search_params(self, request):
+        # Returns the keyword and the search type, None if not searched
+        user_keyword = request.query_params.get('keyword')
+        search_type = request.query_params.get('type')
+        if request.query_params.get('q'):
+            user_keyword = request.query_params.get('q')
+            search_type = 'all'
+        if not user_keyword:
+            return None, None
+        return user_keyword, search_type
+
+    def search_queryset(self, request, movie_queryset):
+        user_keyword, search_type = self.search_params(request)
+        if user_keyword:
+            if search_type == 'name':
+                movie_queryset = movie_queryset.filter(name__icontains=user_keyword)
+            if search_type == 'director':
+                movie_queryset = movie_queryset.filter(director__name__icontains=user_keyword)
+            if search_type == 'genre':
+                movie_queryset = movie_queryset.filter(genre__name__icontains=user_keyword)
+            if search_type == 'all':
+                movie_queryset = full_text_search(movie_queryset, user_keyword)
+        return MovieFilters().filter_queryset(request, movie_queryset)
+
+    def searched(self, request):
+        return bool(self.search_params(request)[0]) or MovieFilters().requested(request)
+
+
+class MovieSearch(MovieSearchMixin, CachedResponseMixin, MovieListMixin, generics.GenericAPIView):
 
     """
         Api for movie search.
         * Any logged in user can search for user.
         * Keyword search can be done for name, director or genre.
+        * type=all (or q=<keyword>) searches name, director and genres at
+          once with a full text index. Results are ranked by relevance
+          unless a sort is given.
         * Sorting can be done based on movie name (Asc/ Desc),
           imdb_score (low to high and high to low),
-          director name (Asc/ Desc)
+          director name (Asc/ Desc), popularity, or several of them
+        * Filters can be combined with each other and with the keyword,
+          see movies.filters
         * URL: /movies/search/
             - Query params:
                 1. keyword: search keyword
-                2. type: name/director/genre
+                2. type: name/director/genre/all
                 3. page: page number
-                4. sort: name/director_name/imdb_score
+                4. sort: name/director_name/imdb_score/popularity, or
+                   comma separated keys, '-' for descending:
+                   popularity,-imdb_score
                 5. sort_criteria: asc/desc
+                6. pagination: cursor, then cursor: next cursor
+                   (relevance ranking of type=all needs page numbers)
+                7. imdb_score_min, imdb_score_max, popularity_min,
+                   popularity_max: ranges, bounds included
+                8. genre: comma separated genres, genre_match: any/all
+                9. director: exact director name
+                10. name_prefix: names starting with it (case sensitive)
             - Example: /movies/search/?keyword=George&type=director&
               sort=name&sort_criteria=asc&page=2
+            - Example: /movies/search/?q=lucas+star+wars
+            - Example: /movies/search/?genre=Drama,War&genre_match=all&
+              imdb_score_min=8&sort=-popularity,name
     """
 
-    queryset = Movie.objects.all()
+    queryset = Movie.objects.with_relations()
     permission_classes = (permissions.IsAuthenticated, )
     serializer_class = MovieListSerializer
+    cache_params = MovieSearchMixin.search_query_params + ('sort', 'sort_criteria', 'page', 'pagination',
+                                                           'cursor')
 
     def get(self, request, *args, **kwargs):
-        return self.list(request, *args, **kwargs)
+        return self.cached_response(request, self.list, *args, **kwargs)
 
     def list(self, request, *args, **kwargs):
-        movie_queryset = self.get_queryset()
-        user_keyword = request.query_params.get('keyword')
-        search_type = request.query_params.get('type')
-        if user_keyword:
-            if search_type == 'name':
-                movie_queryset = movie_queryset.filter(name__icontains=user_keyword)
-            if search_type == 'director':
-                movie_queryset = movie_queryset.filter(director__name__icontains=user_keyword)
-            if search_type == 'genre':
-                movie_queryset = movie_queryset.filter(genre__name__icontains=user_keyword)
-        movie_queryset = MovieSort().movie_sorting(request, movie_queryset)
-        paginated_queryset = self.paginate_queryset(movie_queryset)
-        serializer = self.get_serializer(paginated_queryset, many=True)
-        return Response({"status": 1, "movies": serializer.data, "count": movie_queryset.count()})
+        # Keyword searches are read from the database
+        if not self.search_params(request)[0]:
+            response = self.snapshot_response(request, filtered=True)
+            if response is not None:
+                return response
+        return self.paginated_response(request, self.search_queryset(request, self.get_queryset()))
 
 
-class MovieSort(object):
+class MovieFacets(MovieSearchMixin, CachedResponseMixin, generics.GenericAPIView):
 
     """
-        Class to sort movies
+        API to count movies per genre, per director (top 20) and per
+        imdb_score and popularity bucket
+        * Any logged in user can view facets
+        * URL: /movies/facets/
+            - Query params: the search and filter params of
+              /movies/search/, facets are then those of the results
+            - Example: /movies/facets/?keyword=George&type=director
+        * METHOD: GET
+        * Without search params the counts are read from the FacetCount
+          summary table, kept up to date on every write (movies.facets)
+        * Histograms have 10 buckets: imdb_score 0-1 ... 9-10, popularity
+          0-10 ... 90-100 (upper bound excluded, except the last bucket)
     """
 
-    def movie_sorting(self, request, queryset):
-        sort_param = request.query_params.get('sort')
-        sort_criteria = request.query_params.get('sort_criteria')
-        if sort_param == 'name':
-            if sort_criteria == 'desc':
-                queryset = queryset.order_by('-name')
-            else:
-                queryset = queryset.order_by('name')
-        if sort_param == 'director_name':
-            if sort_criteria == 'desc':
-                queryset = queryset.order_by('-director__name')
-            else:
-                queryset = queryset.order_by('director__name')
-        if sort_param == 'imdb_score':
-            if sort_criteria == 'desc':
-                queryset = queryset.order_by('-imdb_score')
-            else:
-                queryset = queryset.order_by('imdb_score')
-        return queryset
+    queryset = Movie.objects.all()
+    permission_classes = (permissions.IsAuthenticated,)
+    cache_params = MovieSearchMixin.search_query_params
+
+    def get(self, request, *args, **kwargs):
+        return self.cached_response(request, self.facets, *args, **kwargs)
+
+    def facets(self, request, *args, **kwargs):
+        if self.searched(request):
+            data = search_facets(self.search_queryset(request, self.get_queryset()))
+        else:
+            data = global_facets()
+        return Response(dict(data, status=1))
+
+
+class ResponseCacheStats(APIView):
+
+    """
+        API to view the hit and miss counters of the movie response cache
+        * Admins only. Counters are per server process
+        * URL: /movies/cache_stats/
+        * METHOD: GET
+        * Headers:
+            - Content-Type: Application/Json
+            - Authorization: Token <token> (Space after Token is required)
+    """
+
+    permission_classes = (permissions.IsAuthenticated,
+                          IsAdminUser)
+
+    def get(self, request, *args, **kwargs):
+        return Response(dict(response_cache.stats(), status=1))
+
+
+class MovieExport(APIView):
+
+    """
+        API to download the whole catalogue
+        * Admins only
+        * URL: /movies/export/
+            - JSON Lines (default): /movies/export/
+            - CSV: /movies/export/?output=csv
+        * METHOD: GET
+        * Headers:
+            - Authorization: Token <token> (Space after Token is required)
+        * The response is streamed, movies are read in chunks of
+          chunk_size (movies.export)
+        * The file can be loaded with load_movies (name it .csv for CSV)
+    """
+
+    permission_classes = (permissions.IsAuthenticated,
+                          IsAdminUser)
+    chunk_size = 1000
+    outputs = {
+        'jsonl': (jsonl_lines, 'application/x-ndjson', 'movies.jsonl'),
+        'csv': (csv_lines, 'text/csv; charset=utf-8', 'movies.csv'),
+    }
+
+    def get(self, request, *args, **kwargs):
+        output = request.query_params.get('output', 'jsonl')
+        if output not in self.outputs:
+            return Response({'status': -1, 'errors': 'output should be one of: %s' % (
+                ', '.join(sorted(self.outputs)))})
+        lines, content_type, filename = self.outputs[output]
+        # Streamed after the middleware, the database is chosen now
+        using = router.db_for_read(Movie)
+        response = StreamingHttpResponse(lines(iter_movies(self.chunk_size, using)),
+                                         content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+        return response
@@ -0,0 +1,51 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+
+    """
+        Thread safe in-process cache keeping the most recently used entries
+        * max_entries: least recently used entries are dropped past it
+        * timeout: optional seconds after which an entry is stale
+    """
+
+    def __init__(self, max_entries=1000, timeout=None):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value, expires = self.entries.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires < time.time():
+                return default
+            # Re-inserted as the most recently used
+            self.entries[key] = (value, expires)
+            return value
+
+    def set(self, key, value, timeout=None):
+        # timeout: seconds for this entry, the cache's timeout by default
+        timeout = self.timeout if timeout is None else timeout
+        expires = time.time() + timeout if timeout is not None else None
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, expires)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
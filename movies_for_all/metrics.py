@@ -0,0 +1,254 @@
+"""
+    Per request measurements, aggregated per view
+    * MetricsMiddleware measures the wall time, the SQL queries (number and
+      time), the rendering of the response (serialisation to JSON) and its
+      size. Each response gets them in a Server-Timing header:
+        Server-Timing: total;dur=12.1, db;dur=3.4;desc="5 queries", render;dur=0.6
+    * Measurements are added to histograms per view and method, kept per
+      server process and served in the Prometheus text format by /metrics
+      (admins only)
+    * Queries are timed by wrapping the cursors of the request's thread, a
+      clock read on each side of every execute. Recording a request is a
+      few additions under a lock
+"""
+import threading
+from bisect import bisect_left
+from timeit import default_timer
+
+from django.db import connections
+from django.http import HttpResponse
+from rest_framework import permissions
+from rest_framework.views import APIView
+
+from app_user.hashers import hashing_stats
+from app_user.permissions import IsAdminUser
+from movies.cache import response_cache
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# name, help, buckets, in the order of RequestTiming.values()
+HISTOGRAMS = (
+    ('request_duration_seconds', 'Wall time of requests', DURATION_BUCKETS),
+    ('request_db_queries', 'SQL queries per request', QUERY_BUCKETS),
+    ('request_db_duration_seconds', 'Time spent in SQL queries per request', DURATION_BUCKETS),
+    ('request_render_duration_seconds', 'Time spent rendering responses', DURATION_BUCKETS),
+    ('response_size_bytes', 'Size of response bodies, streamed responses excluded', SIZE_BUCKETS),
+)
+PREFIX = 'moviesforall_'
+
+local = threading.local()
+
+
+class RequestMetrics(object):
+
+    """
+        Histograms of the measurements of each (view, method)
+        * Only the bucket of a value is counted when observed, buckets are
+          made cumulative when exported
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def observe(self, labels, values):
+        # values: one per HISTOGRAMS, None when not measured
+        with self.lock:
+            histograms = self.histograms.get(labels)
+            if histograms is None:
+                histograms = self.histograms[labels] = [
+                    [[0] * (len(buckets) + 1), 0, 0] for name, help_text, buckets in HISTOGRAMS]
+            for (name, help_text, buckets), histogram, value in zip(HISTOGRAMS, histograms, values):
+                if value is not None:
+                    histogram[0][bisect_left(buckets, value)] += 1
+                    histogram[1] += value
+                    histogram[2] += 1
+
+    def exposition(self):
+        # Prometheus text format of every histogram
+        with self.lock:
+            histograms = sorted((labels, [[list(counts), total, count] for counts, total, count in values])
+                                for labels, values in self.histograms.items())
+        lines = []
+        for index, (name, help_text, buckets) in enumerate(HISTOGRAMS):
+            name = PREFIX + name
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s histogram' % name)
+            for (view, method), values in histograms:
+                counts, total, count = values[index]
+                labels = 'view="%s",method="%s"' % (escape_label(view), escape_label(method))
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+                lines.append('%s_sum{%s} %r' % (name, labels, float(total)))
+                lines.append('%s_count{%s} %d' % (name, labels, count))
+        return lines
+
+
+request_metrics = RequestMetrics()
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RequestTiming(object):
+
+    """
+        Measurements of the request handled by the current thread
+    """
+
+    def __init__(self):
+        self.start = default_timer()
+        self.view = 'unresolved'
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.render_start = None
+        self.render_seconds = None
+
+    def add_query(self, seconds):
+        self.queries += 1
+        self.db_seconds += seconds
+
+    def rendered(self, response):
+        self.render_seconds = default_timer() - self.render_start
+
+
+class TimedCursor(object):
+
+    """
+        Cursor adding the time of each execute to a RequestTiming
+    """
+
+    def __init__(self, cursor, timing):
+        self.cursor = cursor
+        self.timing = timing
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.cursor.__exit__(exc_type, exc_value, traceback)
+
+    def timed(self, method, *args):
+        start = default_timer()
+        try:
+            return method(*args)
+        finally:
+            self.timing.add_query(default_timer() - start)
+
+    def execute(self, *args):
+        return self.timed(self.cursor.execute, *args)
+
+    def executemany(self, *args):
+        return self.timed(self.cursor.executemany, *args)
+
+    def callproc(self, *args):
+        return self.timed(self.cursor.callproc, *args)
+
+
+def instrument(connection):
+    # Cursors of the connection are timed while a request is measured
+    if 'cursor' not in connection.__dict__:
+        make_cursor = connection.cursor
+
+        def cursor():
+            timing = getattr(local, 'timing', None)
+            if timing is None:
+                return make_cursor()
+            return TimedCursor(make_cursor(), timing)
+        connection.cursor = cursor
+
+
+def view_name(view_func):
+    # Class of class based views (DRF and Django), else the function
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    return (view_class or view_func).__name__
+
+
+class MetricsMiddleware(object):
+
+    """
+        Measures every request, first in MIDDLEWARE_CLASSES so the time of
+        the other middleware is included
+    """
+
+    def process_request(self, request):
+        for connection in connections.all():
+            instrument(connection)
+        local.timing = RequestTiming()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timing = getattr(local, 'timing', None)
+        if timing is not None:
+            timing.view = view_name(view_func)
+
+    def process_template_response(self, request, response):
+        # Called last, right before the response is rendered
+        timing = getattr(local, 'timing', None)
+        if timing is not None:
+            timing.render_start = default_timer()
+            response.add_post_render_callback(timing.rendered)
+        return response
+
+    def process_response(self, request, response):
+        timing = local.__dict__.pop('timing', None)
+        if timing is None:
+            return response
+        seconds = default_timer() - timing.start
+        size = None if response.streaming else len(response.content)
+        request_metrics.observe((timing.view, request.method), (
+            seconds, timing.queries, timing.db_seconds, timing.render_seconds, size))
+        server_timing = ['total;dur=%.1f' % (seconds * 1000),
+                         'db;dur=%.1f;desc="%d queries"' % (timing.db_seconds * 1000, timing.queries)]
+        if timing.render_seconds is not None:
+            server_timing.append('render;dur=%.1f' % (timing.render_seconds * 1000))
+        response['Server-Timing'] = ', '.join(server_timing)
+        return response
+
+
+class Metrics(APIView):
+
+    """
+        Request histograms, response cache and password hashing counters
+        of this process in the Prometheus text format
+        * Admins only
+        * URL: /metrics
+        * METHOD: GET
+        * Headers:
+            - Authorization: Token <token> (Space after Token is required)
+    """
+
+    permission_classes = (permissions.IsAuthenticated,
+                          IsAdminUser)
+
+    def get(self, request, *args, **kwargs):
+        lines = request_metrics.exposition()
+        cache_stats = response_cache.stats()
+        hashing = hashing_stats.stats()
+        for name, metric_type, help_text, value in (
+                ('response_cache_hits_total', 'counter', 'Responses read from the response cache',
+                 cache_stats['hits']),
+                ('response_cache_misses_total', 'counter', 'Responses not found in the response cache',
+                 cache_stats['misses']),
+                ('response_cache_entries', 'gauge', 'Responses in the response cache', cache_stats['entries']),
+                ('password_hashing_seconds_total', 'counter', 'Time spent hashing passwords', hashing['seconds']),
+                ('password_hashing_rejected_total', 'counter', 'Logins rejected with a full hashing queue',
+                 hashing['rejected'])):
+            lines.append('# HELP %s%s %s' % (PREFIX, name, help_text))
+            lines.append('# TYPE %s%s %s' % (PREFIX, name, metric_type))
+            lines.append('%s%s %r' % (PREFIX, name, value))
+        return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
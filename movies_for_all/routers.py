@@ -0,0 +1,179 @@
+"""
+    Read replicas (settings.DATABASE_REPLICAS)
+    * ReplicaRouter sends the reads of GET/HEAD/OPTIONS requests to a
+      replica, everything else to the primary ('default'): writes, every
+      query of POST/PUT/PATCH/DELETE requests, management commands
+    * A replica is chosen once per request, so the queries of a response
+      read the same copy of the data. SELECTION:
+        - round_robin: each replica in turn
+        - least_lag: the replica with the least replication lag, checked
+          every LAG_CHECK_SECONDS. Replicas further behind than MAX_LAG
+          seconds, or not answering, are skipped, the primary is read when
+          none is left
+    * Read your writes: ReplicaPinningMiddleware gives a client that wrote
+      a cookie which keeps its reads on the primary for PIN_SECONDS
+    * Cache misses (responses, counts, tokens) are read from the replica
+      and kept only when replica_in_sync(): a replica behind would be
+      cached as the current catalogue version. The snapshot and the
+      similarity index are built from the primary, with
+      using(DEFAULT_DB_ALIAS)
+    * Tests with two databases: add an alias with 'TEST': {'MIRROR':
+      'default'} to DATABASES and list it in ALIASES. A SQLite default
+      needs a file test database ('TEST': {'NAME': ...}) to be mirrored
+"""
+import time
+import threading
+from itertools import count
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+PIN_COOKIE = 'primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Seconds the replica is behind, 0 when all the received changes are applied
+LAG_QUERIES = {
+    'postgresql': 'SELECT CASE WHEN NOT pg_is_in_recovery() OR '
+                  'pg_last_xlog_receive_location() = pg_last_xlog_replay_location() THEN 0 '
+                  'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END',
+}
+
+local = threading.local()
+turns = count()
+# alias: (checked at, lag in seconds or None when not answering)
+lags = {}
+lags_lock = threading.Lock()
+
+
+def replica_options():
+    options = {'ALIASES': (), 'SELECTION': 'round_robin', 'PIN_SECONDS': 5, 'MAX_LAG': 30,
+               'LAG_CHECK_SECONDS': 5, 'LAG_QUERY': None}
+    options.update(getattr(settings, 'DATABASE_REPLICAS', {}))
+    return options
+
+
+def replica_lag(alias, options):
+    connection = connections[alias]
+    query = options['LAG_QUERY'] or LAG_QUERIES.get(connection.vendor)
+    if query is None:
+        return 0.0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(query)
+            return float(cursor.fetchone()[0] or 0)
+    except DatabaseError:
+        return None
+
+
+def current_lag(alias, options):
+    # Lag of the last check, checked again when older than LAG_CHECK_SECONDS
+    now = time.time()
+    with lags_lock:
+        checked_at, lag = lags.get(alias, (None, None))
+        if checked_at is not None and now - checked_at < options['LAG_CHECK_SECONDS']:
+            return lag
+        # Other threads use the previous value meanwhile
+        lags[alias] = (now, lag)
+    lag = replica_lag(alias, options)
+    with lags_lock:
+        lags[alias] = (now, lag)
+    return lag
+
+
+def choose_replica(options):
+    aliases = list(options['ALIASES'])
+    if options['SELECTION'] == 'least_lag':
+        candidates = []
+        for alias in aliases:
+            lag = current_lag(alias, options)
+            if lag is not None and lag <= options['MAX_LAG']:
+                candidates.append((lag, alias))
+        return min(candidates)[1] if candidates else DEFAULT_DB_ALIAS
+    return aliases[next(turns) % len(aliases)]
+
+
+@contextmanager
+def primary_reads():
+    # Reads of the block, in the current request, go to the primary
+    state = getattr(local, 'state', None)
+    if state is None:
+        yield
+        return
+    pinned = state['pinned']
+    state['pinned'] = True
+    try:
+        yield
+    finally:
+        state['pinned'] = pinned or state['wrote']
+
+
+def replica_in_sync():
+    """
+        Whether the reads of the current request saw the primary's data:
+        they went to the primary, or their replica has applied all the
+        changes it received (checked now, not LAG_CHECK_SECONDS ago)
+    """
+    state = getattr(local, 'state', None)
+    if state is None or state['replica'] in (None, DEFAULT_DB_ALIAS):
+        return True
+    return replica_lag(state['replica'], replica_options()) == 0
+
+
+class ReplicaRouter(object):
+
+    """
+        Reads of safe requests go to a replica, the rest to the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        state = getattr(local, 'state', None)
+        if state is None or state['pinned']:
+            return DEFAULT_DB_ALIAS
+        if state['replica'] is None:
+            options = replica_options()
+            state['replica'] = choose_replica(options) if options['ALIASES'] else DEFAULT_DB_ALIAS
+        return state['replica']
+
+    def db_for_write(self, model, **hints):
+        state = getattr(local, 'state', None)
+        if state is not None:
+            # Later reads of the request see the write
+            state['pinned'] = state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = (DEFAULT_DB_ALIAS,) + tuple(replica_options()['ALIASES'])
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the tables from the primary
+        if db in replica_options()['ALIASES']:
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware(object):
+
+    """
+        Marks the requests allowed to read from replicas and pins clients
+        to the primary for PIN_SECONDS after they write
+        * Before SessionMiddleware, so saving the session counts as a write
+    """
+
+    def process_request(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        local.state = {'pinned': request.method not in SAFE_METHODS or pinned_until > time.time(),
+                       'wrote': False, 'replica': None}
+
+    def process_response(self, request, response):
+        state = local.__dict__.pop('state', None)
+        if state is not None and state['wrote'] and replica_options()['ALIASES']:
+            pin_seconds = replica_options()['PIN_SECONDS']
+            response.set_cookie(PIN_COOKIE, '%.3f' % (time.time() + pin_seconds), max_age=pin_seconds,
+                                httponly=True)
+        return response
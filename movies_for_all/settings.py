@@ -10,6 +10,7 @@ https://docs.djangoproject.com/en/1.7/ref/settings/
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 import os
+from django.core.exceptions import ImproperlyConfigured
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
 
@@ -47,12 +48,61 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'app_user.authentication.CachedTokenAuthentication',
     ),
     'EXCEPTION_HANDLER': 'app_user.rest_exception.custom_exception_handler'
 }
 
+# Counts of movie listings are cached until the catalogue changes
+# (movies.cache). The default local memory cache is per process, configure
+# a shared cache (memcached, redis) when running several gunicorn workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Users of recently used tokens are kept in process memory
+# (app_user.authentication) for at most TIMEOUT seconds
+APP_USER_TOKEN_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 60,
+}
+
+# Response cache of the movie read endpoints (movies.cache.ResponseCache)
+# 'local': per process LRU of MAX_ENTRIES responses
+# 'django': the cache ALIAS from CACHES, e.g. redis, for TIMEOUT seconds
+MOVIES_RESPONSE_CACHE = {
+    'BACKEND': 'local',
+    'MAX_ENTRIES': 1024,
+}
+
+# Serve the unfiltered movie count from the PostgreSQL planner estimate
+# (pg_class.reltuples) instead of COUNT(*). Approximate on large tables.
+MOVIES_ESTIMATED_COUNT = False
+
+# Answer listings without keyword (/movies/list/, /movies/search/ with
+# filters and sorts) from an in process copy of the catalogue, refreshed
+# from the change feed (movies.snapshot). Each process holds every movie.
+# The feed is kept in CACHES['default']: with several processes it must be
+# a shared backend (memcached, redis), the LocMem default only carries the
+# writes of the process answering, the others keep serving stale copies.
+MOVIES_SNAPSHOT = False
+
+# Similar movies (movies.similarity): NEIGHBOURS kept per movie, index built
+# by the build_similarity_index command into INDEX_FILE and loaded by every
+# process. Without the file /movies/<id>/similar/ answers 503. Needs a shared
+# CACHES['default'] for the change feed, ImproperlyConfigured otherwise.
+MOVIE_SIMILARITY = {
+    'INDEX_FILE': os.environ.get('MOVIE_SIMILARITY_INDEX', os.path.join(BASE_DIR, 'movie_similarity.npz')),
+    'NEIGHBOURS': 20,
+}
+
 MIDDLEWARE_CLASSES = (
+    # First, to time the whole request (movies_for_all.metrics)
+    'movies_for_all.metrics.MetricsMiddleware',
+    # Before sessions, a saved session pins the client to the primary
+    'movies_for_all.routers.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -81,6 +131,23 @@ DATABASES = {
     }
 }
 
+# Read replicas (movies_for_all.routers): reads of GET requests go to the
+# DATABASES aliases in ALIASES, chosen by SELECTION (round_robin or
+# least_lag, skipping replicas over MAX_LAG seconds behind, checked every
+# LAG_CHECK_SECONDS). Clients that wrote read the primary for PIN_SECONDS.
+# Example replica, a copy of default in tests:
+#   DATABASES['replica'] = dict(DATABASES['default'], HOST='replica-host',
+#                               TEST={'MIRROR': 'default'})
+DATABASE_REPLICAS = {
+    'ALIASES': [],
+    'SELECTION': 'round_robin',
+    'PIN_SECONDS': 5,
+    'MAX_LAG': 30,
+    'LAG_CHECK_SECONDS': 5,
+}
+
+DATABASE_ROUTERS = ['movies_for_all.routers.ReplicaRouter']
+
 # import dj_database_url
 # DATABASES['default'] =  dj_database_url.config()
 # # Honor the 'X-Forwarded-Proto' header for request.is_secure()
@@ -101,6 +168,38 @@ USE_TZ = True
 
 AUTH_USER_MODEL = 'app_user.AppUser'
 
+# Password hashing (app_user.hashers), set per deployment from the environment
+# PROFILE: fast (12000 PBKDF2 iterations), default (Django's) or strong (100000)
+# THREADS: hash in a pool of that many threads, 0 hashes in the request thread.
+# Requests beyond THREADS wait in a queue of QUEUE_SIZE, then get a 503.
+PASSWORD_HASHING = {
+    'PROFILE': os.environ.get('PASSWORD_HASHING_PROFILE', 'default'),
+    'THREADS': int(os.environ.get('PASSWORD_HASHING_THREADS', 0)),
+    'QUEUE_SIZE': int(os.environ.get('PASSWORD_HASHING_QUEUE_SIZE', 64)),
+}
+
+PASSWORD_HASHING_PROFILES = {
+    'fast': 'app_user.hashers.FastPBKDF2PasswordHasher',
+    'default': 'app_user.hashers.TimedPBKDF2PasswordHasher',
+    'strong': 'app_user.hashers.StrongPBKDF2PasswordHasher',
+}
+
+if PASSWORD_HASHING['PROFILE'] not in PASSWORD_HASHING_PROFILES:
+    raise ImproperlyConfigured('PASSWORD_HASHING_PROFILE should be one of: %s, not %r' % (
+        ', '.join(sorted(PASSWORD_HASHING_PROFILES)), PASSWORD_HASHING['PROFILE']))
+
+# The profile's hasher makes and verifies pbkdf2_sha256 hashes, the others
+# still verify old ones
+PASSWORD_HASHERS = (
+    PASSWORD_HASHING_PROFILES[PASSWORD_HASHING['PROFILE']],
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.BCryptPasswordHasher',
+    'django.contrib.auth.hashers.SHA1PasswordHasher',
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+    'django.contrib.auth.hashers.CryptPasswordHasher',
+)
+
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/1.7/howto/static-files/
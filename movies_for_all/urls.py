@@ -3,12 +3,15 @@ from django.contrib import admin
 from django.conf import settings
 from django.views.generic.base import TemplateView
 
+from .metrics import Metrics
+
 urlpatterns = patterns(
     '',
     url(r'^$', TemplateView.as_view(template_name='help.html')),
     url(r'^admin/', include(admin.site.urls)),
     url(r'^user/', include('app_user.urls')),
     url(r'^movies/', include('movies.urls')),
+    url(r'^metrics$', Metrics.as_view()),
     url(r'^api/', include('rest_framework.urls', namespace='rest_framework'))
 )
 